@@ -0,0 +1,342 @@
+import os
+import sys
+import gc
+import platform
+import subprocess
+import tracemalloc
+from argparse import ArgumentParser
+from functools import partial
+from json import dump, load
+from threading import Thread
+from time import perf_counter
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, f"{ROOT_FOLDER}/src")
+
+from util import *
+from html_dom import parse_html
+from http_fetch import HttpFetcher
+from crawler import AsyncCrawler
+from mal_parser import ANIME_FIELDS, REVIEW_FIELDS, RANKING_FIELDS, extract_anime_details, extract_review_page, extract_ranking_entries, ranking_rows, review_elements
+
+FIXTURES_FOLDER = f"{ROOT_FOLDER}/benchmarks/fixtures"
+RESULTS_FOLDER = "temp/benchmarks"
+DEFAULT_ITERATIONS = 20
+DEFAULT_THRESHOLD = 10
+PAGE_TYPES = ["anime", "reviews", "ranking"]
+# Metrics where a higher value is better, every other number is a cost
+HIGHER_IS_BETTER = ("pages_per_second", "records_per_second")
+
+# How many records each page type yields, for the per-record numbers
+EXTRACTORS = {
+  "anime": lambda html, url: [extract_anime_details(html, url)],
+  "reviews": lambda html, url: extract_review_page(html)[1],
+  "ranking": lambda html, url: extract_ranking_entries(html)
+}
+
+def load_fixtures():
+  fixtures = {page_type: [] for page_type in PAGE_TYPES}
+
+  for file_name in sorted(os.listdir(FIXTURES_FOLDER)):
+    page_type = file_name.split("_")[0]
+
+    if (page_type in fixtures and file_name.endswith(".html")):
+      with open(f"{FIXTURES_FOLDER}/{file_name}", "r", encoding="utf-8") as f:
+        fixtures[page_type].append((file_name, f.read()))
+
+  return fixtures
+
+def rate(count, seconds):
+  return round(count / seconds, 2) if seconds else 0.0
+
+def bench_parse(pages, extract, iterations):
+  """Pages/sec of the HTTP engine's extraction on in-memory pages"""
+  record_count = 0
+  started = perf_counter()
+
+  for _ in range(iterations):
+    for file_name, html in pages:
+      record_count += len(extract(html, file_name))
+
+  elapsed = perf_counter() - started
+  page_count = len(pages) * iterations
+
+  return {
+    "pages_per_second": rate(page_count, elapsed),
+    "records_per_second": rate(record_count, elapsed),
+    "ms_per_page": round(elapsed / page_count * 1000, 3)
+  }
+
+def time_fields(fields, targets, iterations):
+  # Microseconds per record spent in each field extractor
+  timings = {}
+
+  for name, extract in fields.items():
+    started = perf_counter()
+
+    for _ in range(iterations):
+      for target in targets:
+        extract(*target)
+
+    timings[name] = round((perf_counter() - started) / (iterations * len(targets)) * 1e6, 2)
+
+  return timings
+
+def bench_fields(page_type, pages, iterations):
+  """Time spent building the DOM and in every field extractor, separately"""
+  started = perf_counter()
+
+  for _ in range(iterations):
+    documents = [(parse_html(html), file_name) for file_name, html in pages]
+
+  timings = {"parse_html": round((perf_counter() - started) / (iterations * len(pages)) * 1e6, 2)}
+
+  if (page_type == "anime"):
+    timings.update(time_fields(ANIME_FIELDS, documents, iterations))
+  elif (page_type == "reviews"):
+    reviews = [(review,) for document, _ in documents for review in review_elements(document)]
+    timings.update(time_fields(REVIEW_FIELDS, reviews, iterations))
+  else:
+    rows = [(row,) for document, _ in documents for row in ranking_rows(document)]
+    timings.update(time_fields(RANKING_FIELDS, rows, iterations))
+
+  return timings
+
+def bench_memory(pages, extract):
+  """Bytes kept per extracted record and peak allocation while extracting one page"""
+  tracemalloc.start()
+
+  try:
+    baseline = tracemalloc.get_traced_memory()[0]
+    peak = 0
+    records = []
+
+    for file_name, html in pages:
+      tracemalloc.reset_peak()
+      before = tracemalloc.get_traced_memory()[0]
+      records.extend(extract(html, file_name))
+      peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+
+    # The DOM has parent links, so unreachable trees linger until the cycle collector runs
+    gc.collect()
+    kept = tracemalloc.get_traced_memory()[0] - baseline
+  finally:
+    tracemalloc.stop()
+
+  return {
+    "bytes_per_record": round(kept / len(records)) if records else 0,
+    "peak_bytes_per_page": peak
+  }
+
+class QuietHandler(SimpleHTTPRequestHandler):
+  def log_message(self, format, *args):
+    pass
+
+def start_fixture_server():
+  server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=FIXTURES_FOLDER))
+  Thread(target=server.serve_forever, daemon=True).start()
+  return server, f"http://127.0.0.1:{server.server_port}"
+
+def bench_http(base_url, pages, extract, iterations):
+  """Fetch + extract through the pooled keep-alive fetcher the HTTP engine uses"""
+  fetcher = HttpFetcher()
+  started = perf_counter()
+
+  try:
+    for _ in range(iterations):
+      for file_name, _ in pages:
+        url = f"{base_url}/{file_name}"
+        extract(fetcher.get(url).text, url)
+  finally:
+    fetcher.close()
+
+  elapsed = perf_counter() - started
+  return {"pages_per_second": rate(len(pages) * iterations, elapsed)}
+
+def bench_async(base_url, pages, extract, iterations, concurrency):
+  """Fetch + extract through the asyncio crawler with the rate limiter out of the way"""
+  crawler = AsyncCrawler(concurrency, rate=1e9, burst=concurrency)
+  urls = [f"{base_url}/{file_name}?i={i}" for i in range(iterations) for file_name, _ in pages]
+
+  async def handler(crawler, url):
+    response = await crawler.fetch(url)
+    yield extract(response.text, url)
+
+  started = perf_counter()
+  errors = [value for event, _, value in crawler.run(urls, handler) if event == "error"]
+  elapsed = perf_counter() - started
+  crawler.close()
+
+  if (errors):
+    raise RuntimeError(f"Async crawler failed on fixture pages: {errors[0]}")
+
+  latency = crawler.stats.summary()
+  return {"pages_per_second": rate(len(urls), elapsed), "latency_p50": latency["latency_p50"], "latency_p95": latency["latency_p95"]}
+
+def bench_selenium(base_url, fixtures, iterations, browser_profile):
+  """Navigation and extraction times of the browser engines, separately per review extraction mode"""
+  from selenium import webdriver
+  from selenium.webdriver.support.wait import WebDriverWait
+  from browser import browser_options
+  from mal_anime_scraper import extract_details_selenium
+  from mal_comment_scraper import extract_review_fields, EXTRACTION_MODES
+
+  driver = webdriver.Firefox(options=browser_options(browser_profile, headless=True))
+  page_wait = WebDriverWait(driver, 10)
+  results = {}
+
+  try:
+    started = perf_counter()
+
+    for _ in range(iterations):
+      for file_name, _ in fixtures["anime"]:
+        extract_details_selenium(driver, page_wait, f"{base_url}/{file_name}")
+
+    elapsed = perf_counter() - started
+    results["anime"] = {"pages_per_second": rate(len(fixtures["anime"]) * iterations, elapsed)}
+
+    for mode in EXTRACTION_MODES:
+      navigation = extraction = 0.0
+
+      for _ in range(iterations):
+        for file_name, _ in fixtures["reviews"]:
+          started = perf_counter()
+          driver.get(f"{base_url}/{file_name}")
+          first_comment = driver.find_element(By.CSS_SELECTOR, ".review-element.js-review-element")
+          navigation += perf_counter() - started
+
+          started = perf_counter()
+          extract_review_fields(driver, first_comment, mode)
+          extraction += perf_counter() - started
+
+      page_count = len(fixtures["reviews"]) * iterations
+      results[f"reviews_{mode}"] = {
+        "navigation_ms_per_page": round(navigation / page_count * 1000, 3),
+        "extraction_ms_per_page": round(extraction / page_count * 1000, 3)
+      }
+  finally:
+    driver.quit()
+
+  return results
+
+def git_revision():
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_FOLDER, capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def flatten(results, prefix=""):
+  metrics = {}
+
+  for name, value in results.items():
+    if (isinstance(value, dict)):
+      metrics.update(flatten(value, f"{prefix}{name}."))
+    elif (isinstance(value, (int, float))):
+      metrics[f"{prefix}{name}"] = value
+
+  return metrics
+
+def compare(previous, current, threshold):
+  """Prints every metric that got more than threshold percent worse or better than in previous"""
+  before = flatten(previous["results"])
+  after = flatten(current["results"])
+  regressions = 0
+
+  rich_print(f"\nCompared to {previous['meta'].get('revision') or 'previous run'} ({previous['meta']['timestamp']}):", color=ANSI_BRIGHT_BLUE)
+
+  for name in sorted(before.keys() & after.keys()):
+    if (not before[name]):
+      continue
+
+    change = (after[name] - before[name]) / before[name] * 100
+    is_better = (change > 0) == name.endswith(HIGHER_IS_BETTER)
+
+    if (abs(change) < threshold):
+      continue
+
+    regressions += not is_better
+    rich_print(f"  {name}: {before[name]} -> {after[name]} ({change:+.1f}%)", color=ANSI_BRIGHT_GREEN if is_better else ANSI_BRIGHT_RED)
+
+  if (regressions):
+    rich_print(f"{regressions} metrics regressed by more than {threshold}%", color=ANSI_BRIGHT_RED, bold=True)
+  else:
+    rich_print(f"No regressions above {threshold}%", color=ANSI_BRIGHT_GREEN)
+
+  return regressions
+
+def print_results(results):
+  for section, page_types in results.items():
+    rich_print(f"\n{section}", color=ANSI_BRIGHT_BLUE, bold=True)
+
+    for page_type, metrics in page_types.items():
+      print(f"  {page_type:<18} " + ", ".join(f"{name} {value}" for name, value in metrics.items()))
+
+def main():
+  parser = ArgumentParser(description="Benchmarks the scrapers' extraction on saved MAL pages, without touching the network.")
+  parser.add_argument("-n", "--iterations", type=int, default=DEFAULT_ITERATIONS, help=f"How many times every fixture page is extracted. The default value is {DEFAULT_ITERATIONS}.")
+  parser.add_argument("-o", "--output", help=f"Results file (JSON). Defaults to {RESULTS_FOLDER}/bench_<timestamp>.json.")
+  parser.add_argument("--compare", metavar="RESULTS_FILE", help="A previous results file to compare against. Exits with status 1 when a metric regressed.")
+  parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Percent change reported by --compare. The default value is {DEFAULT_THRESHOLD}.")
+  parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight for the async crawler benchmark. The default value is 8.")
+  parser.add_argument("--selenium", action="store_true", help="Also benchmarks the browser engines (needs Firefox and geckodriver).")
+  parser.add_argument("--browser-profile", default="lean", help="Browser profile used with --selenium. The default value is lean.")
+
+  args = parser.parse_args()
+  fixtures = load_fixtures()
+  results = {"parse": {}, "fields_us": {}, "memory": {}, "http": {}, "async": {}}
+  server, base_url = start_fixture_server()
+
+  try:
+    for page_type in PAGE_TYPES:
+      pages = fixtures[page_type]
+      extract = EXTRACTORS[page_type]
+
+      rich_print(f"Benchmarking {len(pages)} {page_type} pages...", color=ANSI_BRIGHT_YELLOW)
+
+      results["parse"][page_type] = bench_parse(pages, extract, args.iterations)
+      results["fields_us"][page_type] = bench_fields(page_type, pages, args.iterations)
+      results["memory"][page_type] = bench_memory(pages, extract)
+      results["http"][page_type] = bench_http(base_url, pages, extract, args.iterations)
+      results["async"][page_type] = bench_async(base_url, pages, extract, args.iterations, args.concurrency)
+
+    if (args.selenium):
+      rich_print("Benchmarking browser engines...", color=ANSI_BRIGHT_YELLOW)
+      results["selenium"] = bench_selenium(base_url, fixtures, max(1, args.iterations // 10), args.browser_profile)
+  finally:
+    server.shutdown()
+
+  report = {
+    "meta": {
+      "timestamp": formatted_timestamp(),
+      "revision": git_revision(),
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "iterations": args.iterations,
+      "fixtures": {page_type: [file_name for file_name, _ in pages] for page_type, pages in fixtures.items()}
+    },
+    "results": results
+  }
+
+  print_results(results)
+
+  output = args.output or f"{RESULTS_FOLDER}/bench_{report['meta']['timestamp']}.json"
+  os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+  with open(output, "w") as f:
+    dump(report, f, indent=2)
+
+  rich_print(f"\nResults written to {output}", color=ANSI_BRIGHT_GREEN)
+
+  if (args.compare):
+    with open(args.compare, "r") as f:
+      previous = load(f)
+
+    if (compare(previous, report, args.threshold)):
+      return 1
+
+  return 0
+
+if __name__ == "__main__":
+  exit_code = main()
+  sys.exit(exit_code)
@@ -0,0 +1,236 @@
+from json import dumps
+from urllib.parse import quote
+from selenium import webdriver
+from selenium.webdriver.firefox.options import Options
+from metrics import metrics
+from navigation import AdaptiveTimeouts, navigate, start_navigation, wait_until_ready
+from page_cache import page_type
+
+BROWSER_PROFILES = ["lean", "full"]
+DEFAULT_BROWSER_PROFILE = "lean"
+DEFAULT_TAB_COUNT = 1
+WINDOW_WIDTH = 1280
+WINDOW_HEIGHT = 800
+
+# Ad, analytics and tracking hosts MAL pages pull in. Subdomains are blocked too.
+BLOCKED_HOSTS = [
+  "doubleclick.net",
+  "googlesyndication.com",
+  "googletagservices.com",
+  "googletagmanager.com",
+  "google-analytics.com",
+  "adservice.google.com",
+  "amazon-adsystem.com",
+  "adnxs.com",
+  "criteo.com",
+  "criteo.net",
+  "pubmatic.com",
+  "rubiconproject.com",
+  "openx.net",
+  "casalemedia.com",
+  "indexww.com",
+  "smartadserver.com",
+  "taboola.com",
+  "outbrain.com",
+  "moatads.com",
+  "scorecardresearch.com",
+  "quantserve.com",
+  "quantcount.com",
+  "facebook.net",
+  "platform.twitter.com",
+  "hotjar.com",
+  "chartbeat.com",
+  "cloudflareinsights.com"
+]
+
+# Nothing listens on the discard port, so blocked requests fail immediately
+BLOCKED_HOST_PROXY = "PROXY 127.0.0.1:9"
+
+LEAN_PREFERENCES = {
+  # Images and media are never needed, their urls are read from src/data-src
+  "permissions.default.image": 2,
+  "media.autoplay.default": 5,
+  "media.autoplay.blocking_policy": 2,
+  "media.play-stand-alone": False,
+  # Fonts
+  "gfx.downloadable_fonts.enabled": False,
+  "browser.display.use_document_fonts": 0,
+  # Prefetching and speculative connections
+  "network.prefetch-next": False,
+  "network.dns.disablePrefetch": True,
+  "network.predictor.enabled": False,
+  "network.http.speculative-parallel-limit": 0,
+  "browser.urlbar.speculativeConnect.enabled": False,
+  # Animations
+  "ui.prefersReducedMotion": 1,
+  "toolkit.cosmeticAnimations.enabled": False,
+  "image.animation_mode": "none",
+  # Built-in tracking protection on top of the blocked hosts
+  "privacy.trackingprotection.enabled": True,
+  "privacy.trackingprotection.socialtracking.enabled": True,
+  "privacy.trackingprotection.cryptomining.enabled": True,
+  "privacy.trackingprotection.fingerprinting.enabled": True,
+  # Less background work and memory per browser
+  "browser.cache.memory.capacity": 65536,
+  "browser.sessionhistory.max_entries": 2,
+  "browser.sessionhistory.max_total_viewers": 0,
+  "dom.ipc.processCount": 1,
+  "app.update.enabled": False,
+  "extensions.update.enabled": False,
+  "datareporting.healthreport.uploadEnabled": False,
+  "toolkit.telemetry.enabled": False
+}
+
+def blocked_hosts_pac(hosts=BLOCKED_HOSTS) -> str:
+  """Proxy auto-config script sending requests to hosts (and their subdomains) nowhere"""
+  return f"""function FindProxyForURL(url, host) {{
+  var blocked = {dumps(hosts)};
+  for (var i = 0; i < blocked.length; i++) {{
+    if (host == blocked[i] || dnsDomainIs(host, "." + blocked[i])) {{
+      return "{BLOCKED_HOST_PROXY}";
+    }}
+  }}
+  return "DIRECT";
+}}"""
+
+def can_prefetch(url, cache=None, backoff=None, retry=None) -> bool:
+  """Whether loading url ahead is worth it: the cache has no fresh copy and no captcha backoff or open circuit breaker holds page loads back"""
+  if (cache and cache.is_fresh(url)):
+    return False
+
+  return not ((backoff and backoff.remaining()) or (retry and retry.remaining()))
+
+def browser_options(profile=DEFAULT_BROWSER_PROFILE, headless=False) -> Options:
+  """Firefox options shared by the scrapers.
+
+  "full" loads pages like a regular browser. "lean" doesn't block on page loads at all
+  (navigation.navigate waits for the content it needs instead) and doesn't download
+  images, media, web fonts, ads or trackers, which none of the scraped fields depend on.
+  """
+  options = Options()
+  options.add_argument(f"--width={WINDOW_WIDTH}")
+  options.add_argument(f"--height={WINDOW_HEIGHT}")
+
+  if (headless):
+    options.add_argument("--headless")
+
+  if (profile == "lean"):
+    options.page_load_strategy = "none"
+
+    for name, value in LEAN_PREFERENCES.items():
+      options.set_preference(name, value)
+
+    options.set_preference("network.proxy.type", 2)
+    options.set_preference("network.proxy.autoconfig_url", "data:application/x-ns-proxy-autoconfig," + quote(blocked_hosts_pac()))
+
+  return options
+
+class BrowserSession:
+  """The Firefox instance of one worker, launched on first use.
+
+  When the browser crashes or its driver stops answering, restart() drops it and
+  the next start() launches a fresh one, so one dead browser costs a retry instead
+  of every page the worker has left. The navigation timeouts it learned are kept.
+
+  With tabs > 1, prefetch() starts loading up to tabs - 1 pages in background tabs
+  while the current one is read, and open() switches to a page's tab once it's ready
+  instead of loading it again. That needs the lean profile, with any other page load
+  strategy driver.get waits for the page and tabs is 1.
+  """
+
+  def __init__(self, options, tabs=1):
+    self.options = options
+    self.tabs = max(1, tabs) if options.page_load_strategy == "none" else 1
+    self.timeouts = AdaptiveTimeouts()
+    self.driver = None
+    self._reset_tabs()
+
+  def _reset_tabs(self):
+    # Window handle of the page being read, tabs with nothing worth keeping and url -> (tab, kind, token, started) of the pages loading ahead
+    self._current_tab = None
+    self._free_tabs = []
+    self._prefetched = {}
+
+  def start(self):
+    if (self.driver is None):
+      self.driver = webdriver.Firefox(options=self.options)
+      self._current_tab = self.driver.current_window_handle
+
+    return self.driver
+
+  def open(self, url, kind=None):
+    """Shows url in the current tab once it's ready (see navigation.navigate) and returns the driver"""
+    driver = self.start()
+    prefetched = self._prefetched.pop(url, None)
+
+    if (prefetched is None):
+      if (self.tabs > 1):
+        driver.switch_to.window(self._current_tab)
+
+      navigate(driver, url, self.timeouts, kind)
+      return driver
+
+    tab, kind, token, started = prefetched
+    self._free_tabs.append(self._current_tab)
+    self._current_tab = tab
+    driver.switch_to.window(tab)
+    metrics.count("prefetches")
+
+    # Its ready time includes however long it waited for its turn, so it isn't a sample for the timeouts
+    wait_until_ready(driver, kind, self.timeouts, token, started, observe=False)
+    return driver
+
+  def prefetch(self, url, kind=None) -> bool:
+    """Starts loading url in a background tab for a later open(url). Returns False when there's no tab left for it."""
+    if (url in self._prefetched):
+      return True
+
+    if (self.tabs == 1 or (not self._free_tabs and len(self._prefetched) + 1 >= self.tabs)):
+      return False
+
+    driver = self.start()
+    tab = None
+
+    try:
+      if (self._free_tabs):
+        tab = self._free_tabs.pop()
+        driver.switch_to.window(tab)
+      else:
+        driver.switch_to.new_window("tab")
+        tab = driver.current_window_handle
+
+      token, started = start_navigation(driver, url)
+      driver.switch_to.window(self._current_tab)
+    except Exception:
+      # open() loads the page itself then, and runs into a dead browser if that's what this was
+      if (tab):
+        self._free_tabs.append(tab)
+
+      return False
+
+    self._prefetched[url] = (tab, kind or page_type(url), token, started)
+    return True
+
+  def discard(self, url):
+    """Frees the tab of a prefetched page that won't be opened after all"""
+    prefetched = self._prefetched.pop(url, None)
+
+    if (prefetched):
+      self._free_tabs.append(prefetched[0])
+
+  def restart(self):
+    self.quit()
+    metrics.count("restarts")
+
+  def quit(self):
+    if (self.driver is None):
+      return
+
+    try:
+      self.driver.quit()
+    except Exception:
+      # A crashed browser can't be asked to quit, its process is already gone
+      pass
+
+    self.driver = None
+    self._reset_tabs()
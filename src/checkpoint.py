@@ -0,0 +1,125 @@
+import os
+from json import dumps, loads, load
+from records import json_default
+
+JOURNAL_FILE_NAME = "journal.jsonl"
+URLS_FILE_NAME = "urls.json"
+
+class Journal:
+  """Append-only completion journal kept in a scraper's state folder.
+
+  Every record, review page checkpoint and finished URL is written as one JSON line
+  the moment the parent receives it, so a crashed or captcha-locked run can be
+  resumed from the state folder without scraping finished URLs again. Every resumed
+  run starts with a "resume" line: records an earlier run wrote after their item's
+  last checkpoint are scraped again, so they are never kept.
+  """
+
+  def __init__(self, state_folder_name):
+    self.path = f"{state_folder_name}/{JOURNAL_FILE_NAME}"
+    self.finished = set()
+    self.pages = {}
+    self.record_count = 0
+    self._replayed_lines = 0
+
+    if (os.path.exists(self.path)):
+      self._replay()
+
+    self.file = open(self.path, "a", encoding="utf-8")
+
+    # Starts on a fresh line if the previous run was cut off mid-write
+    if (self.file.tell() and not _ends_with_newline(self.path)):
+      self.file.write("\n")
+
+    if (self.file.tell()):
+      self._write("resume", None)
+
+  def _entries(self):
+    with open(self.path, "r", encoding="utf-8") as f:
+      for line_number, line in enumerate(f):
+        try:
+          yield line_number, loads(line)
+        except ValueError:
+          # The last line may be cut off if the previous run died mid-write
+          continue
+
+  def _replay(self):
+    # Records only count once the page they came from was checkpointed (or the item finished),
+    # anything after that is scraped again and would otherwise be duplicated
+    uncommitted = {}
+
+    for line_number, entry in self._entries():
+      entry_type = entry["type"]
+      item = entry["item"]
+      self._replayed_lines = line_number + 1
+
+      if (entry_type == "record"):
+        uncommitted[item] = uncommitted.get(item, 0) + 1
+      elif (entry_type == "resume"):
+        uncommitted.clear()
+      elif (entry_type in ("page", "done")):
+        self.record_count += uncommitted.pop(item, 0)
+
+        if (entry_type == "page"):
+          self.pages[item] = entry["value"]
+        else:
+          self.finished.add(item)
+          self.pages.pop(item, None)
+
+  def iter_records(self, with_items=False, record_type=None):
+    """Streams the records kept from previous runs, as their item's checkpoints come by.
+    Only the records of pages not checkpointed yet are held in memory.
+
+    Records are read back as dicts, or as record_type (a records.Record class) to match
+    the ones a live run produces. With with_items, yields (item, record) tuples instead.
+    """
+    to_record = record_type.from_dict if record_type else (lambda value: value)
+    uncommitted = {}
+
+    for line_number, entry in self._entries():
+      if (line_number >= self._replayed_lines):
+        break
+
+      entry_type = entry["type"]
+      item = entry["item"]
+
+      if (entry_type == "record"):
+        uncommitted.setdefault(item, []).append(to_record(entry["value"]))
+      elif (entry_type == "resume"):
+        uncommitted.clear()
+      elif (entry_type in ("page", "done")):
+        for value in uncommitted.pop(item, []):
+          yield (item, value) if with_items else value
+
+  def _write(self, entry_type, item, value=None):
+    self.file.write(dumps({"type": entry_type, "item": item, "value": value}, default=json_default) + "\n")
+    self.file.flush()
+
+  def record(self, item, value):
+    self._write("record", item, value)
+
+  def page(self, item, value):
+    """Stores how far the pagination of item got, so a resumed run continues from there"""
+    self._write("page", item, value)
+    self.pages[item] = value
+
+  def done(self, item):
+    self._write("done", item)
+    os.fsync(self.file.fileno())
+    self.finished.add(item)
+    self.pages.pop(item, None)
+
+  def pending(self, items):
+    return [item for item in items if item not in self.finished]
+
+  def close(self):
+    self.file.close()
+
+def _ends_with_newline(path):
+  with open(path, "rb") as f:
+    f.seek(-1, os.SEEK_END)
+    return f.read(1) == b"\n"
+
+def load_state_urls(state_folder_name):
+  with open(f"{state_folder_name}/{URLS_FILE_NAME}", "r") as f:
+    return load(f)
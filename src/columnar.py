@@ -0,0 +1,189 @@
+import os
+from array import array
+from importlib import import_module
+
+COLUMNAR_FORMATS = ["parquet", "npz"]
+# Strings repeated across reviews, stored once per file and referenced by index
+DICTIONARY_COLUMNS = ["page_url", "anime", "username", "avatar"]
+INTEGER_COLUMNS = {"timestamp": "q", "feelings": "b"}
+TEXT_COLUMN = "review_text"
+REVIEW_COLUMNS = ["page_url", "anime", "username", "avatar", "timestamp", "feelings", "review_text"]
+# Reviews per Parquet row group, also how many are buffered before being written
+ROW_GROUP_SIZE = 100_000
+FORMAT_MODULES = {"parquet": ["pyarrow", "pyarrow.parquet"], "npz": ["numpy"]}
+
+def _require(module_name, output_format):
+  try:
+    return import_module(module_name)
+  except ImportError:
+    package = module_name.split(".")[0]
+    raise ImportError(f"The \"{output_format}\" format needs {package}, install it with \"python -m pip install {package}\"") from None
+
+def check_dependencies(output_format):
+  """Raises ImportError early if the library output_format is written with isn't installed"""
+  for module_name in FORMAT_MODULES[output_format]:
+    _require(module_name, output_format)
+
+class _Dictionary:
+  __slots__ = ("codes", "index", "values")
+
+  def __init__(self):
+    self.codes = array("i")
+    self.index = {}
+    self.values = []
+
+  def add(self, value):
+    code = self.index.get(value)
+
+    if (code is None):
+      code = self.index[value] = len(self.values)
+      self.values.append(value)
+
+    self.codes.append(code)
+
+class ColumnarWriter:
+  """Writes reviews column by column instead of one JSON object each.
+
+  page_url, anime, username and avatar are dictionary-encoded, timestamp and feelings
+  are typed integer columns and review_text is a compressed string column. Missing
+  dictionary values (None, e.g. no avatar) are read back as None in both formats.
+  "parquet" (needs pyarrow) is written in row groups of ROW_GROUP_SIZE reviews.
+  "npz" (needs numpy) keeps the encoded columns in compact arrays until close().
+  Same interface as output.RecordWriter.
+  """
+
+  def __init__(self, path, output_format):
+    self.path = path
+    self.output_format = output_format
+    self.count = 0
+    self.parquet_writer = None
+
+    if (output_format == "parquet"):
+      self.pa = _require("pyarrow", output_format)
+      self.pq = _require("pyarrow.parquet", output_format)
+    else:
+      self.np = _require("numpy", output_format)
+
+    self._reset()
+
+  def _reset(self):
+    self.dictionaries = {name: _Dictionary() for name in DICTIONARY_COLUMNS}
+    self.integers = {name: array(typecode) for name, typecode in INTEGER_COLUMNS.items()}
+    self.text = bytearray()
+    self.text_offsets = array("q", [0])
+
+  def write(self, record):
+    for name, dictionary in self.dictionaries.items():
+      dictionary.add(record[name])
+
+    for name, column in self.integers.items():
+      column.append(record[name])
+
+    self.text += record[TEXT_COLUMN].encode("utf-8")
+    self.text_offsets.append(len(self.text))
+    self.count += 1
+
+    if (self.output_format == "parquet" and len(self.text_offsets) > ROW_GROUP_SIZE):
+      self._write_row_group()
+
+  def write_all(self, records):
+    for record in records:
+      self.write(record)
+
+  def _write_row_group(self):
+    pa = self.pa
+    row_count = len(self.text_offsets) - 1
+    columns = {}
+
+    for name, dictionary in self.dictionaries.items():
+      null_code = dictionary.index.get(None)
+      codes = dictionary.codes
+
+      # Parquet can't write a null inside the dictionary, missing values are null codes instead
+      if (null_code is not None):
+        codes = [None if code == null_code else code for code in codes]
+
+      values = [value or "" for value in dictionary.values]
+      columns[name] = pa.DictionaryArray.from_arrays(pa.array(codes, pa.int32()), pa.array(values, pa.string()))
+
+    columns["timestamp"] = pa.array(self.integers["timestamp"], pa.int64())
+    columns["feelings"] = pa.array(self.integers["feelings"], pa.int8())
+    columns[TEXT_COLUMN] = pa.LargeStringArray.from_buffers(row_count, pa.py_buffer(self.text_offsets), pa.py_buffer(bytes(self.text)))
+    table = pa.table([columns[name] for name in REVIEW_COLUMNS], names=REVIEW_COLUMNS)
+
+    if (self.parquet_writer is None):
+      self.parquet_writer = self.pq.ParquetWriter(self.path, table.schema, compression="zstd")
+
+    self.parquet_writer.write_table(table)
+    self._reset()
+
+  def _write_npz(self):
+    np = self.np
+    columns = {}
+
+    # Strings are stored as one UTF-8 buffer plus offsets, so the file loads without pickle.
+    # Missing values (None) are stored empty and flagged in nulls, like Parquet keeps them null
+    for name, dictionary in self.dictionaries.items():
+      encoded = [(value or "").encode("utf-8") for value in dictionary.values]
+      columns[f"{name}.codes"] = np.frombuffer(dictionary.codes, np.int32)
+      columns[f"{name}.data"] = np.frombuffer(b"".join(encoded), np.uint8)
+      columns[f"{name}.offsets"] = np.cumsum([0] + [len(value) for value in encoded], dtype=np.int64)
+      columns[f"{name}.nulls"] = np.array([value is None for value in dictionary.values], np.bool_)
+
+    for name, column in self.integers.items():
+      columns[name] = np.frombuffer(column, np.int64 if column.typecode == "q" else np.int8)
+
+    columns[f"{TEXT_COLUMN}.data"] = np.frombuffer(bytes(self.text), np.uint8)
+    columns[f"{TEXT_COLUMN}.offsets"] = np.frombuffer(self.text_offsets, np.int64)
+
+    # savez_compressed appends .npz to paths without it
+    with open(self.path, "wb") as f:
+      np.savez_compressed(f, **columns)
+
+  def close(self):
+    if (self.output_format == "npz"):
+      self._write_npz()
+    elif (self.count == 0 or len(self.text_offsets) > 1):
+      self._write_row_group()
+
+    if (self.parquet_writer):
+      self.parquet_writer.close()
+
+    return os.path.getsize(self.path)
+
+def _split_strings(data, offsets):
+  data = data.tobytes()
+  return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+def read_columns(path) -> dict[str, list]:
+  """Loads a columnar review export into {column name: list of values}, with dictionary columns decoded"""
+  if (path.endswith(".parquet")):
+    return _require("pyarrow.parquet", "parquet").read_table(path).to_pydict()
+
+  np = _require("numpy", "npz")
+  columns = {}
+
+  with np.load(path) as npz:
+    for name in DICTIONARY_COLUMNS:
+      values = _split_strings(npz[f"{name}.data"], npz[f"{name}.offsets"].tolist())
+
+      # Files written before nulls were kept don't have them
+      if (f"{name}.nulls" in npz):
+        values = [None if is_null else value for value, is_null in zip(values, npz[f"{name}.nulls"].tolist())]
+
+      columns[name] = [values[code] for code in npz[f"{name}.codes"].tolist()]
+
+    for name in INTEGER_COLUMNS:
+      columns[name] = npz[name].tolist()
+
+    columns[TEXT_COLUMN] = _split_strings(npz[f"{TEXT_COLUMN}.data"], npz[f"{TEXT_COLUMN}.offsets"].tolist())
+
+  return {name: columns[name] for name in REVIEW_COLUMNS}
+
+def iter_columnar_records(path):
+  """The reviews of a columnar export as the same dicts the JSON exports hold"""
+  columns = read_columns(path)
+  yield from (dict(zip(REVIEW_COLUMNS, row)) for row in zip(*(columns[name] for name in REVIEW_COLUMNS)))
+
+def is_columnar_file(path) -> bool:
+  return path.endswith((".parquet", ".npz"))
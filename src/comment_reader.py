@@ -0,0 +1,99 @@
+from json import JSONDecoder, JSONDecodeError, loads
+from columnar import is_columnar_file, iter_columnar_records
+
+READ_CHUNK_SIZE = 1 << 20
+WHITESPACE = " \t\r\n"
+
+def _iter_json_array(f):
+  decoder = JSONDecoder()
+  buffer = ""
+  position = 0
+  is_eof = False
+  started = False
+
+  while (True):
+    while (position < len(buffer) and buffer[position] in WHITESPACE + ("," if started else "")):
+      position += 1
+
+    if (position >= len(buffer)):
+      if (is_eof):
+        raise ValueError("Unexpected end of file inside JSON array")
+
+      chunk = f.read(READ_CHUNK_SIZE)
+      is_eof = not chunk
+      buffer = buffer[position:] + chunk
+      position = 0
+      continue
+
+    if (not started):
+      if (buffer[position] != "["):
+        raise ValueError("Expected a JSON array")
+
+      started = True
+      position += 1
+      continue
+
+    if (buffer[position] == "]"):
+      return
+
+    try:
+      value, end = decoder.raw_decode(buffer, position)
+    except JSONDecodeError:
+      # The element continues past the end of the buffer
+      if (is_eof):
+        raise
+
+      chunk = f.read(READ_CHUNK_SIZE)
+      is_eof = not chunk
+      buffer = buffer[position:] + chunk
+      position = 0
+      continue
+
+    # Older anime detail exports are nested one list per worker chunk
+    if (isinstance(value, list)):
+      yield from value
+    else:
+      yield value
+
+    position = end
+
+    if (position >= READ_CHUNK_SIZE):
+      buffer = buffer[position:]
+      position = 0
+
+def iter_records(path):
+  """Streams the records of a scraper export, either a JSON array or JSON Lines, in constant memory.
+  Columnar review exports (.parquet/.npz) are loaded whole, they're small enough by design.
+  """
+  if (is_columnar_file(path)):
+    yield from iter_columnar_records(path)
+    return
+
+  with open(path, "r", encoding="utf-8") as f:
+    first_char = ""
+
+    while (not first_char.strip()):
+      first_char = f.read(1)
+
+      if (not first_char):
+        return
+
+    f.seek(0)
+
+    if (first_char == "["):
+      yield from _iter_json_array(f)
+      return
+
+    for line in f:
+      if (line.strip()):
+        yield loads(line)
+
+def count_anime_pages(path, key="page_url") -> dict[str, int]:
+  """Returns the unique anime urls of a comment export in order of first appearance, with their review counts"""
+  review_counts = {}
+
+  for record in iter_records(path):
+    url = record[key]
+    review_counts[url] = review_counts.get(url, 0) + 1
+
+  return review_counts
@@ -0,0 +1,215 @@
+import asyncio
+from collections import deque
+from queue import Queue
+from threading import Thread
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from functools import partial
+from http_fetch import HttpFetcher, cached_response
+from metrics import metrics
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_RATE = 4.0
+DEFAULT_BURST = 8
+LATENCY_SAMPLE_SIZE = 10000
+
+class TokenBucket:
+  """Allows rate requests per second on average and up to burst requests at once"""
+
+  def __init__(self, rate: float, burst: int):
+    self.rate = rate
+    self.capacity = burst
+    self.tokens = float(burst)
+    self.updated = monotonic()
+    self.paused_until = 0.0
+    self.lock = asyncio.Lock()
+
+  def pause(self, seconds):
+    self.paused_until = max(self.paused_until, monotonic() + seconds)
+    self.tokens = 0.0
+
+  async def acquire(self):
+    async with self.lock:
+      while (True):
+        now = monotonic()
+
+        if (now < self.paused_until):
+          await asyncio.sleep(self.paused_until - now)
+          continue
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if (self.tokens >= 1):
+          self.tokens -= 1
+          return
+
+        await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class CrawlStats:
+  def __init__(self):
+    self.started = monotonic()
+    self.requests = 0
+    self.cache_hits = 0
+    self.errors = 0
+    self.bytes = 0
+    # Rolling window so long crawls don't grow the sample forever
+    self.latencies = deque(maxlen=LATENCY_SAMPLE_SIZE)
+
+  def record(self, latency, size, from_cache=False):
+    self.requests += 1
+    self.bytes += size
+
+    if (from_cache):
+      self.cache_hits += 1
+      return
+
+    self.latencies.append(latency)
+
+  def percentile(self, p):
+    if (not self.latencies):
+      return 0.0
+
+    ordered = sorted(self.latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+  def summary(self):
+    elapsed = monotonic() - self.started
+
+    return {
+      "requests": self.requests,
+      "cache_hits": self.cache_hits,
+      "errors": self.errors,
+      "bytes": self.bytes,
+      "elapsed_seconds": round(elapsed, 2),
+      "pages_per_second": round(self.requests / elapsed, 2) if elapsed else 0.0,
+      "latency_p50": round(self.percentile(50), 3),
+      "latency_p95": round(self.percentile(95), 3),
+      "latency_max": round(max(self.latencies, default=0.0), 3)
+    }
+
+  def __str__(self):
+    s = self.summary()
+    return f"{s['requests']} requests ({s['cache_hits']} from cache, {s['errors']} errors) in {s['elapsed_seconds']}s, {s['pages_per_second']} pages/s, latency p50 {s['latency_p50']}s / p95 {s['latency_p95']}s"
+
+class AsyncCrawler:
+  """Asyncio crawl core shared by the scrapers.
+
+  concurrency bounds the requests in flight, independent of how many processes run.
+  Every host gets its own TokenBucket, so requests to myanimelist.net stay under
+  rate per second while other hosts (e.g. the image CDN) aren't held back. Requests
+  go through a pooled keep-alive HttpFetcher on a thread pool of the same size.
+  """
+
+  def __init__(self, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, burst=DEFAULT_BURST, cache=None):
+    self.concurrency = concurrency
+    self.rate = rate
+    self.burst = burst
+    self.fetcher = HttpFetcher(max_connections_per_host=concurrency, cache=cache)
+    self.stats = CrawlStats()
+    self.buckets = {}
+    self._executor = None
+    self._semaphore = None
+
+  def bucket(self, url):
+    host = urlsplit(url).netloc
+
+    if (host not in self.buckets):
+      self.buckets[host] = TokenBucket(self.rate, self.burst)
+
+    return self.buckets[host]
+
+  def pause_host(self, url, seconds):
+    """Stops every request to the host of url for seconds (e.g. after a captcha)"""
+    self.bucket(url).pause(seconds)
+
+  async def fetch(self, url):
+    loop = asyncio.get_running_loop()
+
+    async with self._semaphore:
+      # Fresh cached pages don't cost a request, so they skip the rate limiter.
+      # The lookup reads SQLite and unzips the page, so it stays off the event loop too
+      entry = await loop.run_in_executor(self._executor, self.fetcher.cached, url)
+
+      if (entry and entry.is_fresh):
+        self.stats.record(0.0, len(entry.body), from_cache=True)
+        return cached_response(entry)
+
+      # Time spent held back by the rate limiter
+      with metrics.time("wait"):
+        await self.bucket(url).acquire()
+
+      started = monotonic()
+
+      try:
+        response = await loop.run_in_executor(self._executor, partial(self.fetcher.get, url, cache_entry=entry))
+      except Exception:
+        self.stats.errors += 1
+        raise
+
+      metrics.observe("navigation", monotonic() - started)
+      self.stats.record(monotonic() - started, len(response.body))
+      return response
+
+  async def _crawl(self, items, handler, events):
+    # Buckets and the semaphore belong to this event loop
+    self._semaphore = asyncio.Semaphore(self.concurrency)
+    self.buckets = {}
+    queue = asyncio.Queue()
+
+    for item in items:
+      queue.put_nowait(item)
+
+    async def consume():
+      while (not queue.empty()):
+        item = queue.get_nowait()
+
+        try:
+          async for value in handler(self, item):
+            events.put(("result", item, value))
+        except Exception as e:
+          events.put(("error", item, str(e)))
+          continue
+
+        events.put(("done", item, None))
+
+    await asyncio.gather(*(consume() for _ in range(min(self.concurrency, queue.qsize()) or 1)))
+
+  def run(self, items, handler):
+    """Crawls items with handler(crawler, item), an async generator, yielding the same
+    (event, item, value) tuples as work_queue.run_work_queue as soon as they happen"""
+    events = Queue()
+    self._executor = ThreadPoolExecutor(self.concurrency)
+    loop = asyncio.new_event_loop()
+    crawl = loop.create_task(self._crawl(list(items), handler, events))
+
+    def run_loop():
+      try:
+        loop.run_until_complete(crawl)
+      except asyncio.CancelledError:
+        pass
+      finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+        events.put(None)
+
+    thread = Thread(target=run_loop, daemon=True)
+    thread.start()
+
+    try:
+      for event in iter(events.get, None):
+        yield event
+    finally:
+      # Stops the crawl if the caller gave up early (an exception or closing the generator)
+      try:
+        loop.call_soon_threadsafe(crawl.cancel)
+      except RuntimeError:
+        # The loop already finished and closed
+        pass
+
+      thread.join()
+      self._executor.shutdown(cancel_futures=True)
+
+  def close(self):
+    self.fetcher.close()
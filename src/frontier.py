@@ -0,0 +1,259 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from json import dumps, loads
+from socket import gethostname
+from threading import Thread, Event
+from time import time, sleep
+from records import json_default
+from work_queue import worker_lookahead, prefetch_item
+
+DEFAULT_FRONTIER_PATH = "temp/frontier.sqlite"
+DEFAULT_BATCH_SIZE = 4
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+# How often a node renews its leases, as a fraction of the lease length
+HEARTBEAT_FRACTION = 1 / 3
+IDLE_POLL_SECONDS = 2
+STATUSES = ["pending", "leased", "done", "failed"]
+
+def node_name() -> str:
+  return f"{gethostname()}-{os.getpid()}"
+
+class Frontier:
+  """URL frontier shared by crawl nodes on any number of machines through one SQLite file.
+
+  Items (anime review urls, anime urls, usernames...) are added per kind and leased
+  to nodes in batches. A node keeps its leases alive with heartbeats; when a node
+  dies, its leases expire and the items go to the next node asking for work, up to
+  max_attempts times. Finished items and their results are committed in one
+  transaction, so an item's results are stored exactly once however many nodes
+  ended up scraping it. Results stay in the file, a sink can always start over from the first one.
+
+  The file has to be on a filesystem with working POSIX locks (local disk or NFSv4),
+  every process and thread opens its own Frontier.
+  """
+
+  def __init__(self, path=DEFAULT_FRONTIER_PATH, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    self.path = path
+    self.max_attempts = max_attempts
+
+    if (os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Rollback journal instead of WAL, WAL needs shared memory which network filesystems don't have
+    self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+    self.db.executescript("""
+      CREATE TABLE IF NOT EXISTS items (
+        kind TEXT NOT NULL,
+        item TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        lease_owner TEXT,
+        lease_expires REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        PRIMARY KEY (kind, item)
+      );
+      CREATE INDEX IF NOT EXISTS items_status ON items (status, kind);
+      CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        item TEXT NOT NULL,
+        value TEXT NOT NULL
+      );
+      CREATE TABLE IF NOT EXISTS nodes (
+        node TEXT PRIMARY KEY,
+        heartbeat_at REAL NOT NULL,
+        finished INTEGER NOT NULL DEFAULT 0
+      );
+    """)
+
+  @contextmanager
+  def _transaction(self):
+    # IMMEDIATE takes the write lock up front, so two nodes never lease the same rows
+    self.db.execute("BEGIN IMMEDIATE")
+
+    try:
+      yield self.db
+    except BaseException:
+      self.db.execute("ROLLBACK")
+      raise
+
+    self.db.execute("COMMIT")
+
+  def add(self, kind, items) -> int:
+    """Adds items that were never added before, returns how many were new"""
+    with self._transaction() as db:
+      before = db.total_changes
+      db.executemany("INSERT OR IGNORE INTO items (kind, item) VALUES (?, ?)", ((kind, item) for item in items))
+      return db.total_changes - before
+
+  def lease(self, node, kinds, batch_size=DEFAULT_BATCH_SIZE, lease_seconds=DEFAULT_LEASE_SECONDS) -> list[tuple[str, str]]:
+    """Leases up to batch_size pending (or expired) items of kinds to node, returns (kind, item) pairs"""
+    now = time()
+    placeholders = ", ".join("?" * len(kinds))
+
+    with self._transaction() as db:
+      # Items whose node died on them too often are given up on
+      db.execute(f"""UPDATE items SET status = 'failed', lease_owner = NULL, error = 'Lease expired ' || attempts || ' times'
+        WHERE status = 'leased' AND lease_expires < ? AND attempts >= ? AND kind IN ({placeholders})""", (now, self.max_attempts, *kinds))
+
+      rows = db.execute(f"""SELECT kind, item FROM items
+        WHERE kind IN ({placeholders}) AND (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+        ORDER BY rowid LIMIT ?""", (*kinds, now, batch_size)).fetchall()
+
+      db.executemany("UPDATE items SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE kind = ? AND item = ?",
+        ((node, now + lease_seconds, kind, item) for kind, item in rows))
+      db.execute("INSERT INTO nodes (node, heartbeat_at) VALUES (?, ?) ON CONFLICT (node) DO UPDATE SET heartbeat_at = excluded.heartbeat_at", (node, now))
+
+    return rows
+
+  def heartbeat(self, node, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Extends every lease node holds"""
+    now = time()
+
+    with self._transaction() as db:
+      db.execute("UPDATE items SET lease_expires = ? WHERE status = 'leased' AND lease_owner = ?", (now + lease_seconds, node))
+      db.execute("INSERT INTO nodes (node, heartbeat_at) VALUES (?, ?) ON CONFLICT (node) DO UPDATE SET heartbeat_at = excluded.heartbeat_at", (node, now))
+
+  def complete(self, node, kind, item, values, follow_ups=()) -> bool:
+    """Stores the results of item, adds its follow_ups ((kind, item) pairs never added before) and marks it done,
+    all in one transaction. Returns False (and drops both) if another node finished it first."""
+    with self._transaction() as db:
+      row = db.execute("SELECT status FROM items WHERE kind = ? AND item = ?", (kind, item)).fetchone()
+
+      if (row is None or row[0] == "done"):
+        return False
+
+      db.executemany("INSERT INTO results (kind, item, value) VALUES (?, ?, ?)", ((kind, item, dumps(value, default=json_default)) for value in values))
+      # Added before the item is done, so the frontier is never drained while follow-ups are still to come
+      db.executemany("INSERT OR IGNORE INTO items (kind, item) VALUES (?, ?)", follow_ups)
+      db.execute("UPDATE items SET status = 'done', lease_owner = NULL, lease_expires = NULL, error = NULL WHERE kind = ? AND item = ?", (kind, item))
+      db.execute("UPDATE nodes SET finished = finished + 1 WHERE node = ?", (node,))
+
+    return True
+
+  def fail(self, node, kind, item, error):
+    """Gives item back for another attempt, or marks it failed after max_attempts"""
+    with self._transaction() as db:
+      db.execute("""UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, lease_owner = NULL, lease_expires = NULL, error = ?
+        WHERE kind = ? AND item = ? AND status = 'leased' AND lease_owner = ?""", (self.max_attempts, error, kind, item, node))
+
+  def release(self, node):
+    """Hands back the leases of a node that's shutting down, without counting them as attempts"""
+    with self._transaction() as db:
+      db.execute("UPDATE items SET status = 'pending', lease_owner = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0) WHERE status = 'leased' AND lease_owner = ?", (node,))
+
+  def results(self, after_id=0, limit=1000):
+    """(id, kind, item, value) of the results stored after after_id"""
+    rows = self.db.execute("SELECT id, kind, item, value FROM results WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)).fetchall()
+    return [(result_id, kind, item, loads(value)) for result_id, kind, item, value in rows]
+
+  def is_drained(self, kinds=None) -> bool:
+    """True when no item (of kinds) is pending or leased"""
+    counts = self.counts()
+    return not any(counts[kind]["pending"] + counts[kind]["leased"] for kind in counts if kinds is None or kind in kinds)
+
+  def counts(self) -> dict[str, dict[str, int]]:
+    counts = {}
+
+    for kind, status, count in self.db.execute("SELECT kind, status, COUNT(*) FROM items GROUP BY kind, status"):
+      counts.setdefault(kind, dict.fromkeys(STATUSES, 0))[status] = count
+
+    return counts
+
+  def failures(self, kind):
+    return self.db.execute("SELECT item, error FROM items WHERE kind = ? AND status = 'failed'", (kind,)).fetchall()
+
+  def nodes(self):
+    return self.db.execute("SELECT node, heartbeat_at, finished FROM nodes ORDER BY node").fetchall()
+
+  def close(self):
+    self.db.close()
+
+class Heartbeat:
+  """Renews the leases of node from a background thread, with its own connection"""
+
+  def __init__(self, path, node, lease_seconds=DEFAULT_LEASE_SECONDS):
+    self.path = path
+    self.node = node
+    self.lease_seconds = lease_seconds
+    self._stopped = Event()
+    self._thread = Thread(target=self._loop, daemon=True)
+    self._thread.start()
+
+  def _loop(self):
+    frontier = Frontier(self.path)
+
+    while (not self._stopped.wait(self.lease_seconds * HEARTBEAT_FRACTION)):
+      frontier.heartbeat(self.node, self.lease_seconds)
+
+    frontier.close()
+
+  def close(self):
+    self._stopped.set()
+    self._thread.join()
+
+def run_node(path, worker_factories, batch_size=DEFAULT_BATCH_SIZE, lease_seconds=DEFAULT_LEASE_SECONDS, keep_polling=False, node=None, log=print, route=None):
+  """Works through the frontier at path until it's drained (or forever with keep_polling).
+
+  worker_factories maps every kind this node handles to a factory of work_queue style
+  workers (process(item) yielding results, close()). Workers are created on first use
+  and kept for the whole run. Workers with a lookahead get prefetch(item) for the next
+  items of their kind in the batch. route(kind, item, value) returns the (kind, item)
+  follow-ups of a result, added along with the item's completion.
+  Returns how many items this node finished.
+  """
+  node = node or node_name()
+  frontier = Frontier(path)
+  heartbeat = Heartbeat(path, node, lease_seconds)
+  workers = {}
+  finished_count = 0
+  kinds = list(worker_factories)
+
+  try:
+    while (True):
+      batch = frontier.lease(node, kinds, batch_size, lease_seconds)
+
+      if (not batch):
+        if (not keep_polling and frontier.is_drained(kinds)):
+          break
+
+        # Everything left is leased by other nodes, their leases may still expire
+        sleep(IDLE_POLL_SECONDS)
+        continue
+
+      prefetched = set()
+
+      for i, (kind, item) in enumerate(batch):
+        if (kind not in workers):
+          workers[kind] = worker_factories[kind]()
+
+        worker = workers[kind]
+        upcoming = [j for j in range(i + 1, len(batch)) if batch[j][0] == kind][:worker_lookahead(worker)]
+
+        for j in upcoming:
+          if (j not in prefetched):
+            prefetched.add(j)
+            prefetch_item(worker, batch[j][1])
+
+        try:
+          values = list(worker.process(item))
+        except Exception as e:
+          frontier.fail(node, kind, item, str(e))
+          log(f"[{node}] FAILED ON {kind} \"{item}\": {e}")
+          continue
+
+        follow_ups = [follow_up for value in values for follow_up in route(kind, item, value)] if route else []
+
+        if (frontier.complete(node, kind, item, values, follow_ups)):
+          finished_count += 1
+  finally:
+    heartbeat.close()
+    frontier.release(node)
+    frontier.close()
+
+    for worker in workers.values():
+      worker.close()
+
+  return finished_count
@@ -0,0 +1,243 @@
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+
+VOID_TAGS = {
+  "area", "base", "br", "col", "embed", "hr", "img", "input",
+  "link", "meta", "param", "source", "track", "wbr"
+}
+
+# Tags that implicitly close an open tag of the same name (e.g. <p><p>, <li><li>)
+SELF_NESTING_CLOSERS = {"p", "li", "tr", "td", "th", "option"}
+
+SKIPPED_TEXT_TAGS = {"script", "style", "noscript", "template"}
+
+_WHITESPACE = re.compile(r"[ \t\r\n\f]+")
+_SELECTOR_TOKEN = re.compile(r"""
+  (?P<tag>[a-zA-Z][\w-]*|\*)
+  |\.(?P<cls>[\w-]+)
+  |\#(?P<id>[\w-]+)
+  |\[(?P<attr>[\w-]+)(?:(?P<op>[~^$*]?=)["']?(?P<value>[^"'\]]*)["']?)?\]
+  |:(?P<pseudo>first-child|last-child)
+""", re.VERBOSE)
+
+class Node:
+  __slots__ = ("tag", "attrs", "children", "parent")
+
+  def __init__(self, tag, attrs=None, parent=None):
+    self.tag = tag
+    self.attrs = attrs or {}
+    self.children = []
+    self.parent = parent
+
+  def get(self, name, default=None):
+    return self.attrs.get(name, default)
+
+  @property
+  def classes(self):
+    return self.attrs.get("class", "").split()
+
+  @property
+  def elements(self):
+    return [c for c in self.children if isinstance(c, Node)]
+
+  def iter(self):
+    # Document order without a generator per level, deep pages made the nested yield from slow
+    stack = [iter(self.children)]
+
+    while (stack):
+      for child in stack[-1]:
+        if (isinstance(child, Node)):
+          yield child
+          stack.append(iter(child.children))
+          break
+      else:
+        stack.pop()
+
+  def text_content(self):
+    """Raw concatenated text of the subtree (like the DOM textContent property)"""
+    parts = []
+    self._collect_text(parts, raw=True, skip_classes=())
+    return "".join(parts)
+
+  def text(self, skip_classes=()):
+    """Approximates Selenium's WebElement.text: collapsed whitespace, <br> as newlines and no script/style text"""
+    parts = []
+    self._collect_text(parts, raw=False, skip_classes=skip_classes)
+    lines = [_WHITESPACE.sub(" ", line).strip() for line in "".join(parts).split("\n")]
+    return "\n".join(lines).strip()
+
+  def _collect_text(self, parts, raw, skip_classes):
+    for child in self.children:
+      if (isinstance(child, str)):
+        parts.append(child if raw else child.replace("\n", " "))
+      elif (child.tag == "br"):
+        parts.append("\n")
+      elif (not raw and (child.tag in SKIPPED_TEXT_TAGS or any(c in skip_classes for c in child.classes))):
+        continue
+      else:
+        child._collect_text(parts, raw, skip_classes)
+
+  def iter_select(self, selector):
+    """Yields the nodes select returns, in the same order, so callers can stop at the first ones"""
+    seen = set()
+
+    for group in selector.split(","):
+      steps = _parse_selector(group)
+
+      for node in self.iter():
+        if (id(node) not in seen and _matches_chain(node, steps, len(steps) - 1)):
+          seen.add(id(node))
+          yield node
+
+  def select(self, selector):
+    return list(self.iter_select(selector))
+
+  def select_one(self, selector):
+    # Stops walking the document at the first match
+    return next(self.iter_select(selector), None)
+
+  def __repr__(self):
+    return f"<Node {self.tag} {self.attrs}>"
+
+class _TreeBuilder(HTMLParser):
+  def __init__(self):
+    super().__init__(convert_charrefs=True)
+    self.root = Node("#document")
+    self.current = self.root
+
+  def handle_starttag(self, tag, attrs):
+    if (tag in SELF_NESTING_CLOSERS and self.current.tag == tag):
+      self.current = self.current.parent
+
+    node = Node(tag, {k: (v if v is not None else "") for k, v in attrs}, self.current)
+    self.current.children.append(node)
+
+    if (tag not in VOID_TAGS):
+      self.current = node
+
+  def handle_startendtag(self, tag, attrs):
+    node = Node(tag, {k: (v if v is not None else "") for k, v in attrs}, self.current)
+    self.current.children.append(node)
+
+  def handle_endtag(self, tag):
+    node = self.current
+
+    while (node is not self.root and node.tag != tag):
+      node = node.parent
+
+    # Stray closing tags are ignored instead of unwinding the whole tree
+    if (node is not self.root):
+      self.current = node.parent
+
+  def handle_data(self, data):
+    self.current.children.append(data)
+
+def parse_html(html: str) -> Node:
+  builder = _TreeBuilder()
+  builder.feed(html)
+  builder.close()
+  return builder.root
+
+# The scrapers use a handful of selectors over and over
+@lru_cache(maxsize=256)
+def _parse_selector(selector):
+  steps = []
+  combinator = " "
+
+  for token in selector.replace(">", " > ").split():
+    if (token == ">"):
+      combinator = ">"
+      continue
+
+    conditions = []
+    position = 0
+
+    while (position < len(token)):
+      match = _SELECTOR_TOKEN.match(token, position)
+
+      if (not match):
+        raise ValueError(f"Unsupported selector \"{selector}\"")
+
+      conditions.append(_compile_condition(match))
+      position = match.end()
+
+    steps.append((combinator, tuple(conditions)))
+    combinator = " "
+
+  return tuple(steps)
+
+def _compile_condition(match):
+  """(kind, name, op, value) of one selector token, so matching doesn't go through the regex groups"""
+  if (match.group("tag")):
+    return ("tag", match.group("tag").lower(), None, None)
+  elif (match.group("cls")):
+    return ("cls", match.group("cls"), None, None)
+  elif (match.group("id")):
+    return ("id", match.group("id"), None, None)
+  elif (match.group("attr")):
+    return ("attr", match.group("attr"), match.group("op"), match.group("value"))
+
+  return ("pseudo", match.group("pseudo"), None, None)
+
+def _matches_compound(node, conditions):
+  classes = None
+
+  for kind, name, op, expected in conditions:
+    if (kind == "tag"):
+      if (name != "*" and node.tag != name):
+        return False
+    elif (kind == "cls"):
+      if (classes is None):
+        classes = node.classes
+
+      if (name not in classes):
+        return False
+    elif (kind == "id"):
+      if (node.attrs.get("id") != name):
+        return False
+    elif (kind == "attr"):
+      actual = node.attrs.get(name)
+
+      if (actual is None):
+        return False
+      if (op == "=" and actual != expected):
+        return False
+      if (op == "~=" and expected not in actual.split()):
+        return False
+      if (op == "^=" and not actual.startswith(expected)):
+        return False
+      if (op == "$=" and not actual.endswith(expected)):
+        return False
+      if (op == "*=" and expected not in actual):
+        return False
+    elif (kind == "pseudo"):
+      siblings = node.parent.elements if node.parent else [node]
+
+      if (name == "first-child" and siblings[0] is not node):
+        return False
+      if (name == "last-child" and siblings[-1] is not node):
+        return False
+
+  return True
+
+def _matches_chain(node, steps, index):
+  combinator, conditions = steps[index]
+
+  if (not _matches_compound(node, conditions)):
+    return False
+
+  if (index == 0):
+    return True
+
+  parent = node.parent
+
+  if (combinator == ">"):
+    return parent is not None and parent.tag != "#document" and _matches_chain(parent, steps, index - 1)
+
+  while (parent is not None and parent.tag != "#document"):
+    if (_matches_chain(parent, steps, index - 1)):
+      return True
+    parent = parent.parent
+
+  return False
@@ -0,0 +1,170 @@
+import gzip
+import zlib
+import http.client
+from queue import LifoQueue, Empty
+from threading import Lock
+from urllib.parse import urlsplit, urljoin
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0"
+DEFAULT_TIMEOUT = 15
+MAX_CONNECTIONS_PER_HOST = 8
+MAX_REDIRECTS = 5
+
+class HttpResponse:
+  __slots__ = ("url", "status", "headers", "body")
+
+  def __init__(self, url, status, headers, body):
+    self.url = url
+    self.status = status
+    self.headers = headers
+    self.body = body
+
+  @property
+  def text(self):
+    charset = "utf-8"
+    content_type = self.headers.get("content-type", "")
+
+    if ("charset=" in content_type):
+      charset = content_type.split("charset=")[-1].split(";")[0].strip()
+
+    return self.body.decode(charset, errors="replace")
+
+# Default of HttpFetcher.get(cache_entry=...), meaning the cache wasn't checked yet
+_LOOKUP = object()
+
+def cached_response(entry):
+  return HttpResponse(entry.url, 200, {"x-cache": "hit"}, entry.body)
+
+class HttpFetcher:
+  """Keep-alive HTTP client with a small per-host connection pool.
+
+  Connections are reused across requests, so a worker pays the TCP/TLS
+  handshake once per host instead of once per page. Safe to share between threads.
+  """
+
+  def __init__(self, timeout=DEFAULT_TIMEOUT, max_connections_per_host=MAX_CONNECTIONS_PER_HOST, headers=None, cache=None):
+    self.timeout = timeout
+    self.cache = cache
+    self.max_connections_per_host = max_connections_per_host
+    self.headers = {
+      "User-Agent": DEFAULT_USER_AGENT,
+      "Accept": "text/html,application/xhtml+xml,*/*;q=0.8",
+      "Accept-Language": "en-US,en;q=0.5",
+      "Accept-Encoding": "gzip, deflate",
+      "Connection": "keep-alive",
+      **(headers or {})
+    }
+    self._pools = {}
+    self._pools_lock = Lock()
+
+  def _pool(self, scheme, netloc):
+    key = (scheme, netloc)
+
+    with self._pools_lock:
+      if (key not in self._pools):
+        self._pools[key] = LifoQueue()
+      return self._pools[key]
+
+  def _acquire(self, scheme, netloc):
+    try:
+      return self._pool(scheme, netloc).get_nowait()
+    except Empty:
+      if (scheme == "https"):
+        return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+      return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+  def _release(self, scheme, netloc, connection):
+    pool = self._pool(scheme, netloc)
+
+    if (pool.qsize() < self.max_connections_per_host):
+      pool.put(connection)
+    else:
+      connection.close()
+
+  def _request_once(self, method, url, headers):
+    parts = urlsplit(url)
+    path = parts.path or "/"
+
+    if (parts.query):
+      path += "?" + parts.query
+
+    # A pooled connection may have been closed by the server while idle, so retry once on a fresh one
+    for attempt in range(2):
+      connection = self._acquire(parts.scheme, parts.netloc)
+
+      try:
+        connection.request(method, path, headers={**self.headers, **headers})
+        response = connection.getresponse()
+        body = response.read()
+      except (http.client.RemoteDisconnected, http.client.BadStatusLine, BrokenPipeError, ConnectionResetError):
+        connection.close()
+
+        if (attempt == 1):
+          raise
+        continue
+      except Exception:
+        connection.close()
+        raise
+
+      response_headers = {k.lower(): v for k, v in response.getheaders()}
+
+      if (response.will_close):
+        connection.close()
+      else:
+        self._release(parts.scheme, parts.netloc, connection)
+
+      encoding = response_headers.get("content-encoding", "")
+
+      if (encoding == "gzip"):
+        body = gzip.decompress(body)
+      elif (encoding == "deflate"):
+        body = zlib.decompress(body)
+
+      return HttpResponse(url, response.status, response_headers, body)
+
+  def cached(self, url):
+    """Returns the cache entry of url (fresh or stale) or None"""
+    return self.cache.get(url) if self.cache else None
+
+  def get(self, url, headers=None, cache_entry=_LOOKUP):
+    """GETs url, following redirects. With a PageCache, fresh pages are served from disk and stale ones revalidated.
+
+    Pass the result of cached(url) as cache_entry if it was already looked up.
+    """
+    headers = dict(headers or {})
+    entry = self.cached(url) if cache_entry is _LOOKUP else cache_entry
+
+    if (entry and entry.is_fresh):
+      return cached_response(entry)
+
+    if (entry and entry.etag):
+      headers["If-None-Match"] = entry.etag
+    if (entry and entry.last_modified):
+      headers["If-Modified-Since"] = entry.last_modified
+
+    request_url = url
+
+    for _ in range(MAX_REDIRECTS + 1):
+      response = self._request_once("GET", request_url, headers)
+
+      if (response.status in (301, 302, 303, 307, 308) and "location" in response.headers):
+        request_url = urljoin(request_url, response.headers["location"])
+        continue
+
+      if (response.status == 304 and entry):
+        self.cache.revalidated(url)
+        return HttpResponse(url, 200, {"x-cache": "revalidated"}, entry.body)
+
+      if (response.status == 200 and self.cache):
+        self.cache.put(url, response.body, response.headers.get("etag"), response.headers.get("last-modified"))
+
+      return response
+
+    raise http.client.HTTPException(f"Too many redirects for \"{url}\"")
+
+  def close(self):
+    with self._pools_lock:
+      for pool in self._pools.values():
+        while (not pool.empty()):
+          pool.get_nowait().close()
+      self._pools.clear()
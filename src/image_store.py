@@ -0,0 +1,106 @@
+import os
+from hashlib import sha256
+from json import dumps, loads
+from urllib.parse import urlsplit
+
+DEFAULT_IMAGE_FOLDER = "temp/images"
+MANIFEST_FILE_NAME = "manifest.jsonl"
+CONTENT_TYPE_EXTENSIONS = {
+  "image/jpeg": ".jpg",
+  "image/png": ".png",
+  "image/gif": ".gif",
+  "image/webp": ".webp",
+  "image/avif": ".avif"
+}
+
+def image_extension(url, content_type=None) -> str:
+  if (content_type):
+    extension = CONTENT_TYPE_EXTENSIONS.get(content_type.split(";")[0].strip().lower())
+
+    if (extension):
+      return extension
+
+  extension = os.path.splitext(urlsplit(url).path)[1].lower()
+  return extension if extension in CONTENT_TYPE_EXTENSIONS.values() or extension == ".jpeg" else ""
+
+class ImageStore:
+  """Content-addressed image folder with a resumable manifest.
+
+  Images are stored once per content hash in sharded folders (ab/cd/<sha256>.jpg),
+  however many urls serve the same bytes. Every url is appended to manifest.jsonl
+  with its hash and path (or the HTTP status it failed with), so an interrupted
+  download continues where it stopped and a url is never fetched twice.
+  """
+
+  def __init__(self, folder=DEFAULT_IMAGE_FOLDER):
+    self.folder = folder
+    self.manifest_path = f"{folder}/{MANIFEST_FILE_NAME}"
+    self.urls = {}
+    self.paths = {}
+
+    os.makedirs(folder, exist_ok=True)
+
+    if (os.path.exists(self.manifest_path)):
+      self._replay()
+
+    self.manifest = open(self.manifest_path, "a", encoding="utf-8")
+
+    # Starts on a fresh line if the previous run was cut off mid-write
+    if (self.manifest.tell() and not _ends_with_newline(self.manifest_path)):
+      self.manifest.write("\n")
+
+  def _replay(self):
+    with open(self.manifest_path, "r", encoding="utf-8") as f:
+      for line in f:
+        try:
+          entry = loads(line)
+        except ValueError:
+          # The last line may be cut off if the previous run died mid-write
+          continue
+
+        self.urls[entry["url"]] = entry
+
+        if (entry.get("sha256")):
+          self.paths[entry["sha256"]] = entry["path"]
+
+  def __contains__(self, url):
+    return url in self.urls
+
+  def _append(self, entry):
+    self.manifest.write(dumps(entry) + "\n")
+    self.manifest.flush()
+    self.urls[entry["url"]] = entry
+
+  def put(self, url, body, content_type=None):
+    """Stores body for url. Returns (manifest entry, True if the same bytes were already stored)."""
+    digest = sha256(body).hexdigest()
+    path = self.paths.get(digest)
+    is_duplicate = path is not None and os.path.exists(f"{self.folder}/{path}")
+
+    if (not is_duplicate):
+      path = f"{digest[:2]}/{digest[2:4]}/{digest}{image_extension(url, content_type)}"
+      full_path = f"{self.folder}/{path}"
+      os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+      # Written to a temporary file first so a crash never leaves half an image behind
+      with open(f"{full_path}.tmp", "wb") as f:
+        f.write(body)
+
+      os.replace(f"{full_path}.tmp", full_path)
+      self.paths[digest] = path
+
+    entry = {"url": url, "sha256": digest, "path": path, "size": len(body)}
+    self._append(entry)
+    return entry, is_duplicate
+
+  def failed(self, url, status):
+    """Records a url the server has no image for (e.g. 404), so it isn't requested again"""
+    self._append({"url": url, "status": status})
+
+  def close(self):
+    self.manifest.close()
+
+def _ends_with_newline(path):
+  with open(path, "rb") as f:
+    f.seek(-1, os.SEEK_END)
+    return f.read(1) == b"\n"
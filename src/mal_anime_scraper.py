@@ -1,19 +1,37 @@
 import os
+import asyncio
 from util import *
 from argparse import ArgumentParser
-from selenium import webdriver
-from multiprocessing import Pool
 from functools import partial
-from json import load, dump, dumps
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from json import load, dump
 from selenium.webdriver.common.by import By
+from http_fetch import HttpFetcher
+from mal_parser import ParseError, CaptchaError, HttpStatusError, extract_anime_details
+from work_queue import run_work_queue
+from metrics import metrics, MetricsExporter, DEFAULT_SNAPSHOT_INTERVAL
+from crawler import AsyncCrawler, DEFAULT_CONCURRENCY, DEFAULT_RATE, DEFAULT_BURST
+from browser import browser_options, can_prefetch, BrowserSession, BROWSER_PROFILES, DEFAULT_BROWSER_PROFILE, DEFAULT_TAB_COUNT
+from navigation import wait_until_ready
+from checkpoint import Journal, URLS_FILE_NAME, load_state_urls
+from comment_reader import count_anime_pages, iter_records
+from mal_comment_scraper import RankingLoader, iter_ranking_entries, DEFAULT_ANIME_PAGE_URLS, DEFAULT_SCRAPE_LIMIT, DEFAULT_ANIME_PAGINATION_LIMIT
+from page_cache import PageCache, DEFAULT_CACHE_FOLDER, DEFAULT_CACHE_MAX_MB, read_cache_stats, format_cache_stats
+from output import RecordWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+from storage import Database, DEFAULT_DATABASE_PATH, anime_id
+from records import AnimeDetails, RankingEntry
+from retry import RetryEngine, CircuitBreaker, classify
 
-ASYNC_WORKER_COUNT = 4
+DEFAULT_WORKER_COUNT = 4
 REVIEWS_MAX_PAGES = 4
 STATE_FOLDER = "temp/anime_details"
 STORE_NUMBERS_AS_STRINGS = False
+DEAD_LETTERS_FILE = f"{STATE_FOLDER}/dead_letters.jsonl"
+ENGINES = ["http", "selenium", "async"]
+DEFAULT_ENGINE = "http"
+DETAIL_MODES = ["full", "light"]
+DEFAULT_DETAIL_MODE = "full"
+# The ranking rows of a --ranking run, kept in its state folder for light mode on --resume
+RANKING_FILE_NAME = "ranking.jsonl"
 
 def create_state_folder():
    if (not os.path.exists("temp")):
@@ -24,12 +42,6 @@ def create_state_folder():
 
    return folder_name
 
-def default_options():
-   options = Options()
-   options.add_argument("--width=1280")
-   options.add_argument("--height=800")
-   return options
-
 def save_urls(state_folder_name, urls):
    state_name = f"{state_folder_name}/urls.json"
    
@@ -38,97 +50,359 @@ def save_urls(state_folder_name, urls):
 
    return state_name
 
-def scrape_details(chunk, is_verbose: bool):
-   driver = webdriver.Firefox(options=default_options())
-   page_wait = WebDriverWait(driver, 5)
-   cursor = 0
-   retry_count = 0
+def save_ranking_entries(state_folder_name, ranking_entries):
+   writer = RecordWriter(f"{state_folder_name}/{RANKING_FILE_NAME}", "jsonl")
+   writer.write_all(ranking_entries)
+   writer.close()
 
-   scraped_anime_data = []
-   
-   while (cursor < len(chunk)):
-      anime_page = chunk[cursor]
+def load_ranking_entries(state_folder_name):
+   """The ranking rows saved by save_ranking_entries, or an empty list if the run didn't read a ranking"""
+   path = f"{state_folder_name}/{RANKING_FILE_NAME}"
+
+   if (not os.path.exists(path)):
+      return []
+
+   return [RankingEntry.from_dict(record) for record in iter_records(path)]
+
+def extract_details_selenium(browser, anime_page, backoff=None):
+   driver = browser.open(anime_page, "anime")
+
+   # A captcha counts as a ready page, the details only show up once it's solved
+   if (check_captcha(driver, backoff)):
+      wait_until_ready(driver, "anime", browser.timeouts)
+
+   with metrics.time("extraction"):
+      return read_details_selenium(driver, driver.find_element(By.CLASS_NAME, "title-name"))
+
+def read_details_selenium(driver, title):
+   anime_name = title.text
+   secondary_title = driver.find_elements(By.CLASS_NAME, "title-english")
+   anime_image = driver.find_elements(By.CSS_SELECTOR, ".leftside img")
+   anime_genres = map(lambda e: e.get_attribute("textContent"), driver.find_elements(By.CSS_SELECTOR, "span[itemprop=\"genre\"]"))
+
+   return {
+      "anime": anime_name,
+      "english_name": secondary_title[0].text if secondary_title else None,
+      "cover": element_image_url(anime_image[0]) if anime_image else "",
+      "reviews": driver.find_element(By.CLASS_NAME, "score").get_attribute("data-user").split(" ")[0],
+      "score": driver.find_element(By.CLASS_NAME, "score-label").text,
+      "ranking": driver.find_element(By.CSS_SELECTOR, ".numbers.ranked").text[8:],
+      "popularity": driver.find_element(By.CSS_SELECTOR, ".numbers.popularity").text[12:],
+      "members": driver.find_element(By.CSS_SELECTOR, ".numbers.members").text[8:],
+      "synopsis": driver.find_element(By.CSS_SELECTOR, "p[itemprop=\"description\"]").text.replace("\n", " ").replace("[Written by MAL Rewrite]", ""),
+      "genres": list(anime_genres)
+   }
+
+def extract_details_http(fetcher, anime_page):
+   with metrics.time("navigation"):
+      response = fetcher.get(anime_page)
+
+   if (response.status != 200):
+      raise HttpStatusError(response.status, anime_page)
+
+   with metrics.time("extraction"):
+      return extract_anime_details(response.text, anime_page)
+
+def build_anime_record(anime_page, details):
+   score = details["score"]
+   score_review_count = details["reviews"]
+   anime_numbers = details["members"]
+   anime_rank = details["ranking"]
+   anime_popularity = details["popularity"]
+
+   if (not STORE_NUMBERS_AS_STRINGS):
+      score = float(score)
+      score_review_count = int(score_review_count.replace(",", ""))
+      anime_numbers = int(anime_numbers.replace(",", ""))
+      anime_rank = int(anime_rank.replace(",", ""))
+      anime_popularity = int(anime_popularity.replace(",", ""))
 
+   return AnimeDetails(
+      anime=details["anime"],
+      english_name=details["english_name"],
+      cover=details["cover"],
+      anime_url=anime_page,
+      score=score,
+      reviews=score_review_count,
+      members=anime_numbers,
+      ranking=anime_rank,
+      popularity=anime_popularity,
+      synopsis=details["synopsis"],
+      genres=details["genres"]
+   )
+
+def build_light_anime_record(entry, previous):
+   """The anime record of a RankingEntry. Score, rank, members and name are the ranking row's,
+   the fields ranking rows don't have come from the anime's previous record."""
+   return AnimeDetails(
+      anime=entry.anime,
+      english_name=previous["english_name"],
+      cover=previous["cover"],
+      anime_url=entry.anime_url,
+      score=previous["score"] if entry.score is None else entry.score,
+      reviews=previous["reviews"],
+      members=previous["members"] if entry.members is None else entry.members,
+      ranking=previous["ranking"] if entry.rank is None else entry.rank,
+      popularity=previous["popularity"],
+      synopsis=previous["synopsis"],
+      genres=previous["genres"]
+   )
+
+def load_previous_details(paths, database=None):
+   """The latest anime record of every anime id, from the database and then earlier exports (later files win)"""
+   previous = {}
+   sources = [database.iter_records("anime")] if database else []
+   sources += [iter_records(path) for path in paths]
+
+   for records in sources:
+      for record in records:
+         try:
+            previous[anime_id(record["anime_url"])] = record
+         except (KeyError, TypeError, ValueError):
+            continue
+
+   return previous
+
+def discover_ranking_entries(source_list, scrape_limit, pagination_limit, is_verbose, cache_folder=None, cache_max_bytes=None, browser_profile=DEFAULT_BROWSER_PROFILE):
+   """The RankingEntry of every anime on the ranking pages of source_list, 50 per page load"""
+   cache = PageCache(cache_folder, cache_max_bytes) if cache_folder else None
+   loader = RankingLoader(cache, browser_options(browser_profile), is_verbose)
+
+   try:
+      return list(iter_ranking_entries(loader, source_list, scrape_limit, pagination_limit, is_verbose))
+   finally:
+      loader.close()
+
+      if (cache):
+         cache.close()
+
+async def crawl_anime_details(crawler, anime_page, is_verbose=False, retry=None):
+   """Async crawler handler for one anime page. Pages still failing after their retries are left to the browser workers."""
+   attempts = (retry or RetryEngine()).begin(anime_page)
+
+   while (True):
       try:
-         driver.get(anime_page)
-         page_wait.until(EC.url_to_be(anime_page))
+         response = await crawler.fetch(anime_page)
+
+         if (response.status != 200):
+            raise HttpStatusError(response.status, anime_page)
+
+         with metrics.time("extraction"):
+            details = extract_anime_details(response.text, anime_page)
+         break
+      except Exception as e:
+         if (isinstance(e, CaptchaError)):
+            metrics.count("captchas")
+            rich_print(f"Captcha served for \"{anime_page}\". Pausing requests to the site for {CAPTCHA_BACKOFF_SECONDS}s...", color=ANSI_BRIGHT_YELLOW)
+            crawler.pause_host(anime_page, CAPTCHA_BACKOFF_SECONDS)
+
+         if (crawler.fetcher.cache):
+            crawler.fetcher.cache.invalidate(anime_page)
+
+         delay = attempts.failed(e)
+
+         if (attempts.engine.remaining()):
+            crawler.pause_host(anime_page, attempts.engine.remaining())
 
          if (is_verbose):
+            rich_print(f"ERROR FACED WHILE PARSING \"{anime_page}\" ({attempts.kind}): \"{e}\". Retrying in {delay:.1f}s...", color=ANSI_BRIGHT_YELLOW)
+
+         await asyncio.sleep(delay)
+
+   attempts.engine.succeeded()
+   metrics.count("pages")
+   metrics.count("records")
+   yield build_anime_record(anime_page, details)
+
+class AnimeDetailsWorker:
+   """Scrapes anime detail pages for one work queue process, keeping its HTTP pool and browser between pages.
+   With the selenium engine and tabs > 1, the next anime pages in the queue load in background tabs."""
+
+   def __init__(self, is_verbose: bool, engine: str = DEFAULT_ENGINE, backoff=None, cache_folder=None, cache_max_bytes=None, browser_profile=DEFAULT_BROWSER_PROFILE, retry=None, tabs=DEFAULT_TAB_COUNT):
+      self.is_verbose = is_verbose
+      self.backoff = backoff
+      self.retry = retry or RetryEngine()
+      self.cache = PageCache(cache_folder, cache_max_bytes) if cache_folder else None
+      self.fetcher = HttpFetcher(cache=self.cache) if engine == "http" else None
+      # Only started once a page needs the browser
+      self.browser = BrowserSession(browser_options(browser_profile), tabs)
+      # With the HTTP engine the browser is only a fallback, pages aren't worth loading in it ahead
+      self.lookahead = self.browser.tabs - 1 if engine == "selenium" else 0
+
+   def prefetch(self, anime_page):
+      if (can_prefetch(anime_page, self.cache, self.backoff, self.retry)):
+         self.browser.prefetch(anime_page, "anime")
+
+   def scrape_details(self, anime_page):
+      details = None
+
+      # The HTTP engine reads through the cache itself, the browser engine only needs it for fresh copies
+      if (self.cache and not self.fetcher):
+         html = self.cache.get_fresh_text(anime_page)
+
+         if (html is not None):
+            try:
+               with metrics.time("extraction"):
+                  return extract_anime_details(html, anime_page)
+            except ParseError:
+               self.cache.invalidate(anime_page)
+
+      if (self.backoff):
+         self.backoff.wait()
+
+      if (self.fetcher):
+         try:
+            details = extract_details_http(self.fetcher, anime_page)
+
+            if (self.backoff):
+               self.backoff.reset()
+         except Exception as e:
+            if (isinstance(e, CaptchaError)):
+               metrics.count("captchas")
+
+            if (isinstance(e, CaptchaError) and self.backoff):
+               delay = self.backoff.trigger()
+               rich_print(f"Captcha served for \"{anime_page}\". Pausing all workers for {delay}s...", color=ANSI_BRIGHT_YELLOW)
+
+            # Never keep a captcha or broken page in the cache
+            if (self.cache):
+               self.cache.invalidate(anime_page)
+
+            # A page that doesn't exist won't show up in the browser either
+            if (classify(e) == "missing"):
+               raise
+
+            # Captchas and pages the parser doesn't understand are handed to the browser
+            if (self.is_verbose):
+               rich_print(f"HTTP ENGINE FAILED FOR \"{anime_page}\": \"{e}\". Falling back to Selenium...", color=ANSI_BRIGHT_PURPLE)
+
+      if (details is None):
+         if (self.backoff):
+            self.backoff.wait()
+
+         details = extract_details_selenium(self.browser, anime_page, self.backoff)
+
+         if (self.cache):
+            self.cache.put(anime_page, self.browser.driver.page_source)
+
+         if (self.is_verbose):
             rich_print(f"URL CHANGED DETECTED: {anime_page}", color=ANSI_BRIGHT_PURPLE)
 
-         anime_name = page_wait.until(EC.presence_of_element_located((By.CLASS_NAME, "title-name"))).text
-         secondary_title = driver.find_elements(By.CLASS_NAME, "title-english")
-         anime_image = driver.find_elements(By.CSS_SELECTOR, ".leftside img.lazyloaded")
-         score_review_count = driver.find_element(By.CLASS_NAME, "score").get_attribute("data-user").split(" ")[0]
-         score = driver.find_element(By.CLASS_NAME, "score-label").text
-         anime_rank = driver.find_element(By.CSS_SELECTOR, ".numbers.ranked").text[8:]
-         anime_popularity = driver.find_element(By.CSS_SELECTOR, ".numbers.popularity").text[12:]
-         anime_numbers = driver.find_element(By.CSS_SELECTOR, ".numbers.members").text[8:]
-         synopsis = driver.find_element(By.CSS_SELECTOR, "p[itemprop=\"description\"]").text.replace("\n", " ").replace("[Written by MAL Rewrite]", "")
-         anime_genres = map(lambda e: e.get_attribute("textContent"), driver.find_elements(By.CSS_SELECTOR, "span[itemprop=\"genre\"]"))
-
-         if (secondary_title):
-            secondary_title = secondary_title[0].text
-         else:
-            secondary_title = None
-         
-         anime_image = (anime_image and anime_image[0].get_attribute("src") or "")
-      except Exception as e:
-         retry_count += 1
-
-         if (retry_count >= 3):
-            retry_count = 0
-            cursor += 1
-            rich_print(f"RETRY COUNT REACHED FOR PAGE \"{anime_page}\". Skipping...", color=ANSI_BRIGHT_YELLOW)
-         else:
-            if (is_verbose):
-               rich_print(f"ERROR FACED WHILE PARSING \"{anime_page}\": \"{e}\". Retrying...", color=ANSI_BRIGHT_YELLOW)
-            else:
-               rich_print(f"ERROR FACED WHILE PARSING \"{anime_page}\". Retrying...", color=ANSI_BRIGHT_YELLOW)
+      return details
+
+   def process(self, anime_page):
+      attempts = self.retry.begin(anime_page)
+
+      try:
+         while (True):
+            self.retry.wait()
+
+            try:
+               details = self.scrape_details(anime_page)
+               break
+            except Exception as e:
+               if (classify(e) == "driver"):
+                  rich_print(f"Browser died while loading \"{anime_page}\". Restarting it...", color=ANSI_BRIGHT_YELLOW)
+                  self.browser.restart()
+
+               # Raises once out of retries. Not marked as finished in the journal, so a resumed run tries this page again
+               delay = attempts.failed(e)
 
+               if (self.is_verbose):
+                  rich_print(f"ERROR FACED WHILE PARSING \"{anime_page}\" ({attempts.kind}): \"{e}\". Retrying in {delay:.1f}s...", color=ANSI_BRIGHT_YELLOW)
+               else:
+                  rich_print(f"ERROR FACED WHILE PARSING \"{anime_page}\" ({attempts.kind}). Retrying in {delay:.1f}s...", color=ANSI_BRIGHT_YELLOW)
+
+               sleep(delay)
+      finally:
+         # Loaded ahead by prefetch, but served from the cache or never loaded in the end
+         self.browser.discard(anime_page)
+
+      self.retry.succeeded()
+      metrics.count("pages")
+      metrics.count("records")
+      yield build_anime_record(anime_page, details)
+
+   def close(self):
+      self.browser.quit()
+      self.retry.close()
+
+      if (self.fetcher):
+         self.fetcher.close()
+
+      if (self.cache):
+         self.cache.close()
+
+def crawl_with_browser_fallback(crawler, anime_pages, is_verbose, worker_count, cache_folder=None, cache_max_bytes=None, browser_profile=DEFAULT_BROWSER_PROFILE, retry=None, tabs=DEFAULT_TAB_COUNT):
+   """Crawls anime_pages with the async crawler, then scrapes the pages it failed on with browser workers.
+   Only the browser workers write to retry's dead-letter file, a page isn't given up on before they tried it."""
+   failed_pages = []
+   retry = retry or RetryEngine()
+   crawl_retry = RetryEngine(retry.policies, retry.breaker)
+
+   for event, anime_page, value in crawler.run(anime_pages, partial(crawl_anime_details, is_verbose=is_verbose, retry=crawl_retry)):
+      if (event == "error"):
+         failed_pages.append(anime_page)
+
+         if (is_verbose):
+            rich_print(f"ASYNC CRAWLER FAILED ON \"{anime_page}\": {value}. Queued for the browser workers.", color=ANSI_BRIGHT_PURPLE)
          continue
-         
-      rich_print(f"[{cursor + 1} / {len(chunk)}] {anime_name} ({score} @ {score_review_count} reviews) #{anime_rank}", color=ANSI_BRIGHT_BLUE, bold=True)
-
-      if (not STORE_NUMBERS_AS_STRINGS):
-         score = float(score)
-         score_review_count = int(score_review_count.replace(",", ""))
-         anime_numbers = int(anime_numbers.replace(",", ""))
-         anime_rank = int(anime_rank.replace(",", ""))
-         anime_popularity = int(anime_popularity.replace(",", ""))
-
-      scraped_anime_data.append({
-         "anime": anime_name,
-         "english_name": secondary_title,
-         "cover": anime_image,
-         "anime_url": anime_page,
-         "score": score,
-         "reviews": score_review_count,
-         "members": anime_numbers,
-         "ranking": anime_rank,
-         "popularity": anime_popularity,
-         "synopsis": synopsis,
-         "genres": list(anime_genres)
-      })
-
-      retry_count = 0
-      cursor += 1
-   
-   driver.quit()
-   return scraped_anime_data
+
+      yield event, anime_page, value
+
+   if (failed_pages):
+      rich_print(f"Retrying {len(failed_pages)} pages with browser workers...", color=ANSI_BRIGHT_YELLOW)
+      worker_factory = partial(AnimeDetailsWorker, is_verbose=is_verbose, engine="selenium", backoff=CaptchaBackoff(), cache_folder=cache_folder, cache_max_bytes=cache_max_bytes, browser_profile=browser_profile, retry=retry, tabs=tabs)
+      yield from run_work_queue(failed_pages, worker_factory, worker_count)
 
 def main():
    parser = ArgumentParser(description="Scrapes anime details from MyAnimeList given a list of scraped comments or a list of anime urls using Selenium.", epilog="[TEST]")
-   parser.add_argument("input_file", nargs="?", help="The scraped MAL comments file to extract the anime urls from.")
+   parser.add_argument("input_file", nargs="?", help="The scraped MAL comments file (JSON array or JSON Lines) to extract the anime urls from.")
    parser.add_argument("-o", "--output", required=True, help="Output file path.")
+   parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT, help=f"Output file format. \"json\" is a pretty-printed array and \"jsonl\" has one record per line. Both are written incrementally as records come in. The default value is {DEFAULT_OUTPUT_FORMAT}.")
+   parser.add_argument("--database", nargs="?", const=DEFAULT_DATABASE_PATH, metavar="DATABASE_FILE", help=f"Also upserts every record into the SQLite database (default file {DEFAULT_DATABASE_PATH}), see storage.py.")
    parser.add_argument("-u", "--urls", help="An optional exported file of MAL urls to scrape. Overrides input file.")
+   parser.add_argument("--ranking", action="store_true", help="Takes the anime to scrape from ranking pages (-s) instead of an input file, reading each anime's rank, score and members off the ranking rows on the way.")
+   parser.add_argument("-s", "--source-urls", help="With --ranking, a JSON file of the ranking pages to read. The top anime rankings by default.")
+   parser.add_argument("-l", "--scrape-limit", type=int, default=DEFAULT_SCRAPE_LIMIT, help=f"With --ranking, the max number of anime to take from the ranking pages. The default value is {DEFAULT_SCRAPE_LIMIT}.")
+   parser.add_argument("-p", "--pagination-limit", type=int, default=DEFAULT_ANIME_PAGINATION_LIMIT, help=f"With --ranking, the number of pages of each ranking to read. The default value is {DEFAULT_ANIME_PAGINATION_LIMIT}.")
+   parser.add_argument("--ranking-output", metavar="FILE", help="With --ranking, also writes the ranking rows (rank, score, members, type, episodes, thumbnail) to FILE in --format.")
+   parser.add_argument("--detail-mode", choices=DETAIL_MODES, default=DEFAULT_DETAIL_MODE, help=f"\"full\" visits every anime page. \"light\" (needs --ranking) refreshes anime that have a previous record (--database, --previous-details) from their ranking row alone, keeping their synopsis, genres, English title, reviews and popularity, and only visits the pages of new anime. The default value is {DEFAULT_DETAIL_MODE}.")
+   parser.add_argument("--previous-details", nargs="+", default=[], metavar="FILE", help="Earlier anime details exports light mode takes the fields ranking rows lack from. Later files win over earlier ones and over --database.")
+   parser.add_argument("--sort-by-reviews", action="store_true", help="Scrape the anime pages with the most reviews in the input file first.")
+   parser.add_argument("--review-counts", metavar="FILE", help="Writes the number of reviews per anime url found in the input file to FILE.")
+   parser.add_argument("-e", "--engine", choices=ENGINES, default=DEFAULT_ENGINE, help=f"How anime pages are fetched. \"http\" parses the server rendered HTML and only starts a browser for captchas or unparseable pages. \"async\" fetches pages with the asyncio crawler (--concurrency, --rate, --burst) and hands pages it couldn't scrape to browser workers. The default value is {DEFAULT_ENGINE}.")
+   parser.add_argument("--browser-profile", choices=BROWSER_PROFILES, default=DEFAULT_BROWSER_PROFILE, help=f"Profile of the browsers started for the selenium engine and fallbacks. \"lean\" doesn't wait for page loads (only for the elements a page needs) and blocks images, media, web fonts, ads and trackers. \"full\" loads pages like a regular browser. The default value is {DEFAULT_BROWSER_PROFILE}.")
+   parser.add_argument("--tabs", type=int, default=DEFAULT_TAB_COUNT, help=f"Tabs per browser with the selenium engine (and the async engine's browser fallback). The next anime pages in a worker's queue load in the other tabs while the current one is read. Needs the lean browser profile. The default value is {DEFAULT_TAB_COUNT}.")
+   parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help=f"Max requests in flight with the async engine. The default value is {DEFAULT_CONCURRENCY}.")
+   parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help=f"Average requests per second per host with the async engine. The default value is {DEFAULT_RATE}.")
+   parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help=f"Max requests per host sent at once with the async engine. The default value is {DEFAULT_BURST}.")
+   parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_FOLDER, metavar="CACHE_FOLDER", help=f"Reads anime pages through an on-disk page cache (default folder {DEFAULT_CACHE_FOLDER}). Fresh pages are parsed from disk and stale ones are revalidated with ETag/Last-Modified.")
+   parser.add_argument("--cache-max-size", type=int, default=DEFAULT_CACHE_MAX_MB, help=f"Size budget of the page cache in MB. Least recently used pages are evicted above it. The default value is {DEFAULT_CACHE_MAX_MB}.")
+   parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKER_COUNT, help=f"The number of worker processes pulling anime pages from the shared queue. The default value is {DEFAULT_WORKER_COUNT}.")
+   parser.add_argument("--dead-letters", default=DEAD_LETTERS_FILE, metavar="DEAD_LETTER_FILE", help=f"Anime pages that ran out of retries are appended to this JSON Lines file. \"python retry.py DEAD_LETTER_FILE\" turns it into a list for -u. The default value is {DEAD_LETTERS_FILE}.")
+   parser.add_argument("--resume", metavar="STATE_FOLDER", help=f"Resumes an interrupted run from its state folder (e.g. {STATE_FOLDER}/state_<timestamp>). Finished pages are skipped and already scraped records are kept.")
+   parser.add_argument("--metrics-file", metavar="FILE", help="Writes a JSON snapshot of the run's stage timings and per-worker counters to FILE every --metrics-interval seconds.")
+   parser.add_argument("--metrics-interval", type=float, default=DEFAULT_SNAPSHOT_INTERVAL, help=f"Seconds between metrics snapshots. The default value is {DEFAULT_SNAPSHOT_INTERVAL}.")
+   parser.add_argument("--metrics-port", type=int, metavar="PORT", help="Serves the metrics in Prometheus text format on http://127.0.0.1:PORT/metrics while the scraper runs.")
    parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output.")
 
    args = parser.parse_args()
    is_verbose = args.verbose
 
-   if (not args.urls and not args.input_file):
-      rich_print("ERROR: Input file or url list (-u) not specified.", color=ANSI_BRIGHT_RED)
+   if (args.resume and not os.path.exists(f"{args.resume}/{URLS_FILE_NAME}")):
+      rich_print("ERROR: State folder to resume from does not exist or has no url list.", color=ANSI_BRIGHT_RED)
+      return
+   elif (args.resume and args.detail_mode == "light" and not os.path.exists(f"{args.resume}/{RANKING_FILE_NAME}")):
+      rich_print("ERROR: The light detail mode needs --ranking, and the run to resume didn't read a ranking.", color=ANSI_BRIGHT_RED)
+      return
+   elif (args.resume):
+      pass
+   elif (not args.urls and not args.input_file and not args.ranking):
+      rich_print("ERROR: Input file, url list (-u) or --ranking not specified.", color=ANSI_BRIGHT_RED)
+      return
+   elif (args.detail_mode == "light" and not args.ranking):
+      rich_print("ERROR: The light detail mode needs --ranking.", color=ANSI_BRIGHT_RED)
       return
    elif (not args.urls and args.input_file and not os.path.exists(args.input_file)):
       rich_print("ERROR: Input file specified does not exist.", color=ANSI_BRIGHT_RED)
@@ -137,48 +411,161 @@ def main():
       rich_print("ERROR: URL file specified does not exist.", color=ANSI_BRIGHT_RED)
       return
 
-   state_folder_name = create_state_folder()
-   
    unique_anime_pages = []
+   ranking_entries = []
+   cache_max_bytes = args.cache_max_size * 1024 * 1024
 
    if (is_verbose):
       rich_print(f"{args}", color=ANSI_BRIGHT_PURPLE)
 
-   if (args.urls):
-      try:
-         with open(args.urls, "r") as f:
-            unique_anime_pages = load(f, encoding="utf-8")
-      except Exception as e:
-         rich_print("Error while parsing URL file. Corrupted or invalid file.", color=ANSI_BRIGHT_RED)
+   if (args.resume):
+      state_folder_name = args.resume
+      unique_anime_pages = load_state_urls(state_folder_name)
+      ranking_entries = load_ranking_entries(state_folder_name)
    else:
-      with open(args.input_file, "r") as f:
-         scraped_data = load(f)
+      state_folder_name = create_state_folder()
+
+      if (args.urls):
+         try:
+            with open(args.urls, "r", encoding="utf-8") as f:
+               unique_anime_pages = load(f)
+         except Exception as e:
+            rich_print("Error while parsing URL file. Corrupted or invalid file.", color=ANSI_BRIGHT_RED)
+      elif (args.ranking):
+         source_list = DEFAULT_ANIME_PAGE_URLS
+
+         if (args.source_urls):
+            with open(args.source_urls, "r") as f:
+               source_list = load(f)
+
+         ranking_entries = discover_ranking_entries(source_list, args.scrape_limit, args.pagination_limit, is_verbose, args.cache, cache_max_bytes, args.browser_profile)
+         unique_anime_pages = [entry.anime_url for entry in ranking_entries]
+         save_ranking_entries(state_folder_name, ranking_entries)
 
-         for comment in scraped_data:
-            if (comment["page_url"] not in unique_anime_pages):
-               unique_anime_pages.append(comment["page_url"])
+         if (args.ranking_output):
+            ranking_writer = RecordWriter(args.ranking_output, args.format)
+            ranking_writer.write_all(ranking_entries)
+            ranking_writer.close()
+      else:
+         review_counts = count_anime_pages(args.input_file)
+         unique_anime_pages = list(review_counts.keys())
+
+         if (args.sort_by_reviews):
+            unique_anime_pages.sort(key=lambda page: review_counts[page], reverse=True)
+
+         if (args.review_counts):
+            with open(args.review_counts, "w") as f:
+               dump(review_counts, f, indent=2)
 
       save_urls(state_folder_name, unique_anime_pages)
    
+   cache_stats_before = read_cache_stats(args.cache) if args.cache else None
+   journal = Journal(state_folder_name)
+   pending_anime_pages = journal.pending(unique_anime_pages)
+   writer = RecordWriter(args.output, args.format)
+   database = Database(args.database) if args.database else None
+
+   for record in journal.iter_records(record_type=AnimeDetails):
+      writer.write(record)
+
+      if (database):
+         database.write("anime", record)
+
+   finished_count = len(unique_anime_pages) - len(pending_anime_pages)
+
    rich_print(f"FOUND {len(unique_anime_pages)} anime pages to scrape.", color=ANSI_BRIGHT_YELLOW)
-   
-   scraped_anime_data = []
-   func = partial(scrape_details, is_verbose=is_verbose)
-   chunks = chunkify(unique_anime_pages, ASYNC_WORKER_COUNT)
 
-   with Pool(ASYNC_WORKER_COUNT) as pool:
-      scraped_anime_data = pool.map(func, chunks)
+   if (finished_count):
+      rich_print(f"RESUMING {state_folder_name}: {finished_count} pages already finished, {len(pending_anime_pages)} left.", color=ANSI_BRIGHT_YELLOW)
+
+   if (args.detail_mode == "light" and ranking_entries):
+      previous_details = load_previous_details(args.previous_details, database)
+      pending = set(pending_anime_pages)
+      light_pages = set()
+
+      for entry in ranking_entries:
+         previous = previous_details.get(anime_id(entry.anime_url))
+
+         if (previous is None or entry.anime_url not in pending):
+            continue
+
+         record = build_light_anime_record(entry, previous)
+
+         with metrics.time("serialization"):
+            journal.record(entry.anime_url, record)
+            journal.done(entry.anime_url)
+            writer.write(record)
+
+            if (database):
+               database.write("anime", record)
+
+         metrics.count("records")
+         light_pages.add(entry.anime_url)
+
+      pending_anime_pages = [page for page in pending_anime_pages if page not in light_pages]
+      rich_print(f"LIGHT MODE: {len(light_pages)} anime refreshed from their ranking rows, {len(pending_anime_pages)} new anime pages to visit.", color=ANSI_BRIGHT_YELLOW)
+      finished_count += len(light_pages)
+
+   crawler = None
+   retry = RetryEngine(breaker=CircuitBreaker(), dead_letter_path=args.dead_letters)
+   failed_count = 0
+
+   if (args.engine == "async"):
+      crawler = AsyncCrawler(args.concurrency, args.rate, args.burst, PageCache(args.cache, cache_max_bytes) if args.cache else None)
+      events = crawl_with_browser_fallback(crawler, pending_anime_pages, is_verbose, args.workers, args.cache, cache_max_bytes, args.browser_profile, retry, args.tabs)
+   else:
+      worker_factory = partial(AnimeDetailsWorker, is_verbose=is_verbose, engine=args.engine, backoff=CaptchaBackoff(), cache_folder=args.cache, cache_max_bytes=cache_max_bytes, browser_profile=args.browser_profile, retry=retry, tabs=args.tabs)
+      events = run_work_queue(pending_anime_pages, worker_factory, args.workers)
+
+   exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_interval, args.metrics_port)
+
+   for event, anime_page, value in events:
+      if (event == "result"):
+         with metrics.time("serialization"):
+            journal.record(anime_page, value)
+            writer.write(value)
+
+            if (database):
+               database.write("anime", value)
+
+         rich_print(f"[{finished_count + 1} / {len(unique_anime_pages)}] {value['anime']} ({value['score']} @ {value['reviews']} reviews) #{value['ranking']}", color=ANSI_BRIGHT_BLUE, bold=True)
+      elif (event == "done"):
+         journal.done(anime_page)
+      elif (event == "error"):
+         failed_count += 1
+         rich_print(f"FAILED ON PAGE \"{anime_page}\": {value}", color=ANSI_BRIGHT_YELLOW)
+
+      if (event != "result"):
+         finished_count += 1
+
+   journal.close()
+   retry.close()
+
+   if (failed_count):
+      rich_print(f"{failed_count} anime pages failed. They're retried with --resume {state_folder_name}, and the ones that ran out of retries are listed in {args.dead_letters}.", color=ANSI_BRIGHT_YELLOW)
+
+   if (crawler):
+      crawler.close()
+
+      if (crawler.fetcher.cache):
+         crawler.fetcher.cache.close()
+
+      rich_print(f"Crawler: {crawler.stats}", color=ANSI_BRIGHT_CYAN)
+
+   if (args.cache):
+      rich_print(format_cache_stats(cache_stats_before, read_cache_stats(args.cache)), color=ANSI_BRIGHT_CYAN)
 
-   rich_print(f"\nExporting...", color=ANSI_BRIGHT_YELLOW)
-   
    file_name = os.path.basename(args.output)
-   serialized_json = dumps(scraped_anime_data, indent=2)
-   size_bytes = len(serialized_json)
-   
-   with open(args.output, "w") as f:
-      f.write(serialized_json)
 
-   rich_print(f"\nExported {file_name} (Size {get_size_displayable(size_bytes)})", color=ANSI_BRIGHT_GREEN)
+   with metrics.time("serialization"):
+      size_bytes = writer.close()
+
+      if (database):
+         database.close()
+
+   exporter.close()
+   rich_print(f"\n{metrics.summary_table()}", color=ANSI_BRIGHT_CYAN)
+   rich_print(f"\nExported {file_name} ({writer.count} records, Size {get_size_displayable(size_bytes)})", color=ANSI_BRIGHT_GREEN)
 
 if __name__ == "__main__":
-   main()
\ No newline at end of file
+   main()
@@ -0,0 +1,236 @@
+import os
+import multiprocessing
+from util import *
+from functools import partial
+from json import load
+from sys import exit
+from time import time, sleep
+from argparse import ArgumentParser
+from browser import browser_options, BROWSER_PROFILES, DEFAULT_BROWSER_PROFILE, DEFAULT_TAB_COUNT
+from page_cache import PageCache, DEFAULT_CACHE_FOLDER, DEFAULT_CACHE_MAX_MB
+from frontier import Frontier, run_node, node_name, DEFAULT_FRONTIER_PATH, DEFAULT_BATCH_SIZE, DEFAULT_LEASE_SECONDS, IDLE_POLL_SECONDS
+from output import RecordWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+from storage import Database, DEFAULT_DATABASE_PATH
+from comment_reader import iter_records
+from mal_comment_scraper import ReviewWorker, RankingLoader, iter_source_urls, DEFAULT_ANIME_PAGE_URLS, DEFAULT_SCRAPE_LIMIT, DEFAULT_ANIME_PAGINATION_LIMIT, DEFAULT_DISCOVERY_WORKER_COUNT, DEFAULT_REVIEW_PAGINATION_LIMIT, EXTRACTION_MODES, DEFAULT_EXTRACTION_MODE
+from mal_anime_scraper import AnimeDetailsWorker, ENGINES as DETAIL_ENGINES, DEFAULT_ENGINE as DEFAULT_DETAIL_ENGINE
+from mal_user_scraper import UserProfileWorker
+from mal_pipeline import route
+from seen_set import DEFAULT_SEEN_SET_PATH, DEFAULT_TTL_DAYS, DAY
+from retry import RetryEngine, CircuitBreaker
+
+DEFAULT_OUTPUT_FOLDER = "temp/cluster"
+KINDS = ["reviews", "details", "users"]
+# Output file of every kind's results
+OUTPUT_NAMES = {"reviews": "reviews", "details": "anime_details", "users": "user_profiles"}
+DATABASE_TABLES = {"reviews": "reviews", "details": "anime", "users": "users"}
+# Which field of an export record becomes an item of each kind when seeding from exports, the first one it has.
+# Reviews keep their anime in page_url, anime details and ranking entries in anime_url
+SEED_FIELDS = {"reviews": ["page_url", "anime_url"], "details": ["anime_url", "page_url"], "users": ["username"]}
+
+class ClusterReviewWorker(ReviewWorker):
+  """Review worker yielding only records. Pagination checkpoints don't outlive a lease, a re-leased anime starts over."""
+
+  def process(self, page_url):
+    for value in super().process(page_url):
+      if (value[0] == "record"):
+        yield value
+
+def review_item(url: str) -> str:
+  return url if url.endswith("/reviews") else url.rstrip("/") + "/reviews"
+
+def seed_field(kind, record):
+  for field in SEED_FIELDS[kind]:
+    if (field in record):
+      return record[field]
+
+  raise ValueError(f"Can't seed {kind} from a record without any of {', '.join(SEED_FIELDS[kind])}")
+
+def seed_items(kind, paths):
+  """Items of kind from JSON lists of urls/usernames or from scraper exports"""
+  for path in paths:
+    for record in iter_records(path):
+      item = seed_field(kind, record) if isinstance(record, dict) else record
+      yield review_item(item) if kind == "reviews" else item
+
+def worker_factories(args):
+  options = browser_options(args.browser_profile, args.headless)
+  cache_max_bytes = args.cache_max_size * 1024 * 1024
+  backoff = CaptchaBackoff()
+  # No dead-letter files, items out of retries fail in the frontier, see status -v
+  retry = RetryEngine(breaker=CircuitBreaker())
+  factories = {
+    "reviews": partial(ClusterReviewWorker, options=options, review_page_limit=args.review_pagination_limit, is_verbose=args.verbose, extraction_mode=args.extraction, backoff=backoff, cache_folder=args.cache, cache_max_bytes=cache_max_bytes, retry=retry, tabs=args.tabs),
+    "details": partial(AnimeDetailsWorker, is_verbose=args.verbose, engine=args.detail_engine, backoff=backoff, cache_folder=args.cache, cache_max_bytes=cache_max_bytes, browser_profile=args.browser_profile, retry=retry, tabs=args.tabs),
+    "users": partial(UserProfileWorker, is_verbose=args.verbose, seen_set_path=args.seen_set, ttl=args.ttl_days * DAY, backoff=backoff, cache_folder=args.cache, cache_max_bytes=cache_max_bytes, retry=retry)
+  }
+
+  return {kind: factories[kind] for kind in args.kinds}
+
+def feed_route(feed_kinds, kind, item, value):
+  """Follow-up items of a result (see mal_pipeline.route), only of the kinds in feed_kinds"""
+  return [(next_kind, next_item) for next_kind, next_item in route(kind, item, value) if next_kind in feed_kinds]
+
+def _node_main(frontier_path, factories, batch_size, lease_seconds, keep_polling, node, feed_kinds=()):
+  finished_count = run_node(frontier_path, factories, batch_size, lease_seconds, keep_polling, node, log=lambda message: rich_print(message, color=ANSI_BRIGHT_RED), route=partial(feed_route, feed_kinds))
+  rich_print(f"[{node}] Finished {finished_count} items.", color=ANSI_BRIGHT_GREEN)
+
+def work(args):
+  """Runs --processes crawl nodes on this machine until the frontier is drained"""
+  factories = worker_factories(args)
+  host_node = node_name()
+  processes = [multiprocessing.Process(target=_node_main, args=(args.frontier, factories, args.batch_size, args.lease_seconds, args.keep_polling, f"{host_node}-{i}", args.feed)) for i in range(max(1, args.processes))]
+
+  rich_print(f"Starting {len(processes)} nodes for {', '.join(args.kinds)} on {args.frontier}.", color=ANSI_BRIGHT_BLUE)
+
+  for process in processes:
+    process.start()
+
+  for process in processes:
+    process.join()
+
+  return 0
+
+def sink(args):
+  """Streams every result of the frontier into the output folder (and database)"""
+  frontier = Frontier(args.frontier)
+  os.makedirs(args.output_folder, exist_ok=True)
+  writers = {kind: RecordWriter(f"{args.output_folder}/{name}.{args.format}", args.format) for kind, name in OUTPUT_NAMES.items()}
+  database = Database(args.database) if args.database else None
+  last_id = 0
+
+  while (True):
+    # Checked before reading the results, so the results of the last items done are always read after it
+    is_drained = frontier.is_drained()
+    results = frontier.results(last_id)
+
+    if (not results):
+      if (not args.follow and is_drained):
+        break
+
+      sleep(IDLE_POLL_SECONDS)
+      continue
+
+    for result_id, kind, item, value in results:
+      last_id = result_id
+      record = value[1] if kind == "reviews" else value
+      writers[kind].write(record)
+
+      if (database):
+        database.write(DATABASE_TABLES[kind], record)
+
+    rich_print(f"Sink at result #{last_id}: {', '.join(f'{writer.count} {kind}' for kind, writer in writers.items())}.", color=ANSI_BRIGHT_BLUE)
+
+  for kind, writer in writers.items():
+    size_bytes = writer.close()
+    rich_print(f"Exported {OUTPUT_NAMES[kind]}.{args.format} ({writer.count} records, Size {get_size_displayable(size_bytes)})", color=ANSI_BRIGHT_GREEN)
+
+  if (database):
+    database.close()
+
+  frontier.close()
+  return 0
+
+def seed(args):
+  for path in args.input:
+    if (not os.path.exists(path)):
+      rich_print(f"Error: Input file \"{path}\" not found.", color=ANSI_BRIGHT_RED)
+      return 1
+
+  frontier = Frontier(args.frontier)
+
+  try:
+    added_count = frontier.add(args.kind, seed_items(args.kind, args.input))
+  except ValueError as e:
+    rich_print(f"Error: {e}", color=ANSI_BRIGHT_RED)
+    return 1
+  finally:
+    frontier.close()
+
+  rich_print(f"Added {added_count} new {args.kind} items.", color=ANSI_BRIGHT_GREEN)
+  return 0
+
+def discover(args):
+  source_list = DEFAULT_ANIME_PAGE_URLS
+
+  if (args.source_urls):
+    with open(args.source_urls, "r") as f:
+      source_list = load(f)
+
+  # Over HTTP only, a coordinator doesn't need a browser
+  loader = RankingLoader(PageCache(args.cache) if args.cache else None)
+  frontier = Frontier(args.frontier)
+  added_count = frontier.add("reviews", iter_source_urls(loader, source_list, args.scrape_limit, args.pagination_limit, args.verbose, args.discovery_workers))
+  loader.close()
+  frontier.close()
+
+  rich_print(f"Added {added_count} new reviews items.", color=ANSI_BRIGHT_GREEN)
+  return 0
+
+def status(args):
+  frontier = Frontier(args.frontier)
+
+  for kind, counts in sorted(frontier.counts().items()):
+    rich_print(f"{kind:<10}" + "".join(f"{name:>10} {count:<8}" for name, count in counts.items()), color=ANSI_BRIGHT_BLUE)
+
+    if (args.verbose):
+      for item, error in frontier.failures(kind):
+        rich_print(f"  FAILED \"{item}\": {error}", color=ANSI_BRIGHT_RED)
+
+  for node, heartbeat_at, finished_count in frontier.nodes():
+    rich_print(f"{node:<32} last heartbeat {time() - heartbeat_at:>8.1f}s ago, {finished_count} items finished", color=ANSI_BRIGHT_CYAN)
+
+  frontier.close()
+  return 0
+
+def main():
+  parser = ArgumentParser(description="Runs a crawl across several machines through a lease-based frontier in a shared SQLite file. Nodes lease batches of review, anime and user items, and one sink collects the results.")
+  parser.add_argument("frontier", nargs="?", default=DEFAULT_FRONTIER_PATH, help=f"Frontier file, on a disk every node can reach. The default value is {DEFAULT_FRONTIER_PATH}.")
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  seed_parser = commands.add_parser("seed", help="Adds items from JSON lists (anime urls or usernames) or scraper exports.")
+  seed_parser.add_argument("kind", choices=KINDS)
+  seed_parser.add_argument("input", nargs="+")
+
+  discover_parser = commands.add_parser("discover", help="Reads the ranking pages and adds every anime as a reviews item.")
+  discover_parser.add_argument("-s", "--source-urls", help="A JSON file with the ranking page urls to discover anime from. Defaults to the top anime rankings.")
+  discover_parser.add_argument("-l", "--scrape-limit", type=int, default=DEFAULT_SCRAPE_LIMIT, help=f"The default value is {DEFAULT_SCRAPE_LIMIT}.")
+  discover_parser.add_argument("-p", "--pagination-limit", type=int, default=DEFAULT_ANIME_PAGINATION_LIMIT, help=f"The default value is {DEFAULT_ANIME_PAGINATION_LIMIT}.")
+  discover_parser.add_argument("--discovery-workers", type=int, default=DEFAULT_DISCOVERY_WORKER_COUNT, help=f"The default value is {DEFAULT_DISCOVERY_WORKER_COUNT}.")
+  discover_parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_FOLDER, metavar="CACHE_FOLDER")
+  discover_parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output.")
+
+  work_parser = commands.add_parser("work", help="Runs crawl nodes on this machine until the frontier is drained.")
+  work_parser.add_argument("--kinds", nargs="+", choices=KINDS, default=KINDS, help="Item kinds this machine works on. Defaults to all of them.")
+  work_parser.add_argument("--processes", type=int, default=4, help="Node processes on this machine, each with its own browser/HTTP pool. The default value is 4.")
+  work_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help=f"Items leased at once. The default value is {DEFAULT_BATCH_SIZE}.")
+  work_parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS, help=f"How long a lease lasts without a heartbeat. Items of a dead node go back to the others after this. The default value is {DEFAULT_LEASE_SECONDS}.")
+  work_parser.add_argument("--keep-polling", action="store_true", help="Keeps waiting for new items instead of exiting once the frontier is drained.")
+  work_parser.add_argument("--feed", nargs="*", choices=["details", "users"], default=["details"], help="Item kinds added for every anime and user seen in a review, together with the review item's completion. Every machine should use the same kinds. The default value is details.")
+  work_parser.add_argument("-r", "--review-pagination-limit", type=int, default=DEFAULT_REVIEW_PAGINATION_LIMIT, help=f"The default value is {DEFAULT_REVIEW_PAGINATION_LIMIT}.")
+  work_parser.add_argument("-x", "--extraction", choices=EXTRACTION_MODES, default=DEFAULT_EXTRACTION_MODE, help=f"The default value is {DEFAULT_EXTRACTION_MODE}.")
+  work_parser.add_argument("-e", "--detail-engine", choices=[engine for engine in DETAIL_ENGINES if engine != "async"], default=DEFAULT_DETAIL_ENGINE, help=f"The default value is {DEFAULT_DETAIL_ENGINE}.")
+  work_parser.add_argument("--seen-set", default=DEFAULT_SEEN_SET_PATH, metavar="SEEN_SET_FILE", help=f"The default value is {DEFAULT_SEEN_SET_PATH}.")
+  work_parser.add_argument("--ttl-days", type=float, default=DEFAULT_TTL_DAYS, help=f"The default value is {DEFAULT_TTL_DAYS}.")
+  work_parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_FOLDER, metavar="CACHE_FOLDER")
+  work_parser.add_argument("--cache-max-size", type=int, default=DEFAULT_CACHE_MAX_MB, help=f"The default value is {DEFAULT_CACHE_MAX_MB}.")
+  work_parser.add_argument("--browser-profile", choices=BROWSER_PROFILES, default=DEFAULT_BROWSER_PROFILE, help=f"The default value is {DEFAULT_BROWSER_PROFILE}.")
+  work_parser.add_argument("--headless", action="store_true")
+  work_parser.add_argument("--tabs", type=int, default=DEFAULT_TAB_COUNT, help=f"Tabs per browser, loading the next items of a leased batch in the background. Needs the lean browser profile. The default value is {DEFAULT_TAB_COUNT}.")
+  work_parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output.")
+
+  sink_parser = commands.add_parser("sink", help="Writes every result to the output folder until the frontier is drained.")
+  sink_parser.add_argument("-o", "--output-folder", default=DEFAULT_OUTPUT_FOLDER, help=f"The default value is {DEFAULT_OUTPUT_FOLDER}.")
+  sink_parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT, help=f"The default value is {DEFAULT_OUTPUT_FORMAT}.")
+  sink_parser.add_argument("--database", nargs="?", const=DEFAULT_DATABASE_PATH, metavar="DATABASE_FILE")
+  sink_parser.add_argument("--follow", action="store_true", help="Keeps waiting for results instead of exiting once the frontier is drained.")
+
+  status_parser = commands.add_parser("status", help="Prints item counts per kind and status, and the last heartbeat of every node.")
+  status_parser.add_argument("-v", "--verbose", action="store_true", help="Also lists the failed items with their last error.")
+
+  args = parser.parse_args()
+  return {"seed": seed, "discover": discover, "work": work, "sink": sink, "status": status}[args.command](args)
+
+if __name__ == "__main__":
+  exit_code = main()
+  exit(exit_code)
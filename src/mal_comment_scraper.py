@@ -1,25 +1,52 @@
 import os
+import asyncio
 from util import *
-from selenium import webdriver
 from datetime import datetime
-from multiprocessing import Pool
 from functools import partial
-from json import dumps, dump, load
+from copy import deepcopy
+from json import dump, load
 from sys import exit
 from argparse import ArgumentParser
-from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
+from threading import Lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from http_fetch import HttpFetcher
+from mal_parser import ParseError, CaptchaError, HttpStatusError, extract_reviews, extract_review_page, extract_ranking_entries
+from page_cache import PageCache, DEFAULT_CACHE_FOLDER, DEFAULT_CACHE_MAX_MB, read_cache_stats, format_cache_stats
+from work_queue import run_work_queue
+from metrics import metrics, MetricsExporter, DEFAULT_SNAPSHOT_INTERVAL
+from crawler import AsyncCrawler, DEFAULT_CONCURRENCY, DEFAULT_RATE, DEFAULT_BURST
+from browser import browser_options, can_prefetch, BrowserSession, BROWSER_PROFILES, DEFAULT_BROWSER_PROFILE, DEFAULT_TAB_COUNT
+from navigation import navigate, wait_until_ready
+from checkpoint import Journal, URLS_FILE_NAME, load_state_urls
+from output import open_writer, REVIEW_OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+from columnar import COLUMNAR_FORMATS, check_dependencies
+from storage import Database, DEFAULT_DATABASE_PATH
+from records import Review, RankingEntry
+from retry import RetryEngine, RetryExhausted, CircuitBreaker, classify
 
 REPLACE_NEWLINES_WITH_SPACES = True
 STATE_FOLDER = "temp/review_scraper"
 DEFAULT_ANIME_PAGINATION_LIMIT = 4
+DEFAULT_DISCOVERY_WORKER_COUNT = 4
+# Entries per topanime.php page, the "limit" query parameter is an offset in steps of this
+RANKING_PAGE_SIZE = 50
 DEFAULT_SCRAPE_LIMIT = 200
 DEFAULT_REVIEW_PAGINATION_LIMIT = 2
-MAX_WORKER_COUNT = 4
+DEFAULT_WORKER_COUNT = 4
 SIZE_DECIMAL_COUNT = 2
-MAX_RETRY_COUNT = 3
+ENGINES = ["selenium", "async"]
+DEFAULT_ENGINE = "selenium"
+EXTRACTION_MODES = ["script", "source", "elements"]
+DEFAULT_EXTRACTION_MODE = "script"
+HIGH_WATER_MARKS_FILE = f"{STATE_FOLDER}/high_water_marks.json"
+DEAD_LETTERS_FILE = f"{STATE_FOLDER}/dead_letters.jsonl"
+# Incremental runs need the newest reviews first to be able to stop at the first one already seen
+INCREMENTAL_REVIEW_SORT = "sort=recent"
 
 RECOMMENDATION_SCORES = {
     "Recommended": 3,
@@ -75,185 +102,638 @@ def to_timestamp(s: str):
 
     return (int(year), month_index, int(day))
 
-def load_source_urls(driver, source_list: list[str], scrape_limit: int, anime_pagination_limit, is_verbose: bool):
-  source_wait = WebDriverWait(driver, 8)
+def anime_url_from_reviews_url(url):
+  parts = urlsplit(url)
+  path = parts.path
+
+  if (path.endswith("/reviews")):
+    path = path[:-len("reviews")]
+
+  return urlunsplit((parts.scheme, parts.netloc, path, "", ""))
+
+def load_high_water_marks(path):
+  if (not os.path.exists(path)):
+    return {}
+
+  with open(path, "r") as f:
+    return load(f)
+
+def save_high_water_marks(path, high_water_marks):
+  # Replaced atomically so a crash mid-write can't lose the marks of every anime
+  with open(f"{path}.tmp", "w") as f:
+    dump(high_water_marks, f)
+
+  os.replace(f"{path}.tmp", path)
+
+def is_seen_review(review, high_water_mark):
+  """True if the review is at or below the newest review stored for its anime"""
+  if (review["timestamp"] != high_water_mark["timestamp"]):
+    return review["timestamp"] < high_water_mark["timestamp"]
+
+  return review["username"] in high_water_mark["usernames"]
+
+def update_high_water_mark(high_water_marks, key, review):
+  """Keeps the newest review timestamp under key, with the usernames that reviewed on that day"""
+  merge_high_water_mark(high_water_marks, key, {"timestamp": review["timestamp"], "usernames": [review["username"]]})
+
+def merge_high_water_mark(high_water_marks, key, new_mark):
+  high_water_mark = high_water_marks.get(key)
+
+  if (high_water_mark is None or new_mark["timestamp"] > high_water_mark["timestamp"]):
+    high_water_marks[key] = {"timestamp": new_mark["timestamp"], "usernames": list(new_mark["usernames"])}
+  elif (new_mark["timestamp"] == high_water_mark["timestamp"]):
+    high_water_mark["usernames"].extend(u for u in new_mark["usernames"] if u not in high_water_mark["usernames"])
+
+def ranking_page_url(page, offset):
+  if (offset == 0):
+    return page
+
+  return page + ("&" if "?" in page else "?") + f"limit={offset}"
+
+def ranking_number(text, cast):
+  """A number of a ranking row, None for the "-", "N/A" or "?" of anime that haven't aired"""
+  try:
+    return cast(text.replace(",", ""))
+  except (AttributeError, ValueError):
+    return None
+
+def build_ranking_entry(page_url, fields):
+  return RankingEntry(
+    anime=fields["anime"],
+    anime_url=urljoin(page_url, fields["anime_url"]),
+    rank=ranking_number(fields["rank"], int),
+    score=ranking_number(fields["score"], float),
+    members=ranking_number(fields["members"], int),
+    media_type=fields["media_type"],
+    episodes=ranking_number(fields["episodes"], int),
+    thumbnail=fields["thumbnail"]
+  )
+
+def load_ranking_entries(driver, timeouts, url, cache=None):
+  """Returns a RankingEntry for every entry of a ranking page, read from the page cache when it has a fresh copy"""
+  if (cache):
+    html = cache.get_fresh_text(url)
+
+    if (html is not None):
+      try:
+        return [build_ranking_entry(url, fields) for fields in extract_ranking_entries(html)]
+      except ParseError:
+        cache.invalidate(url)
+
+  navigate(driver, url, timeouts, "ranking")
+
+  # The whole table in one round-trip, instead of a few per row
+  with metrics.time("extraction"):
+    html = driver.page_source
+    entries = [build_ranking_entry(url, fields) for fields in extract_ranking_entries(html)]
+  cookies_prompt = driver.find_elements(By.CSS_SELECTOR, "#accept-btn")
+
+  if (cookies_prompt):
+    print("FOUND THAT PIECE OF SHIT COOKIES PROMPT. NUKING...")
+    cookies_prompt[0].click()
+    WebDriverWait(driver, timeouts.timeout("ranking")).until(EC.staleness_of(cookies_prompt[0]))
+
+  if (cache and entries):
+    cache.put(url, html)
+
+  return entries
+
+def ranking_page_urls(source_list, anime_pagination_limit):
+  """Every ranking page to read, as (source index, ranking page url), in rank order"""
+  return [(i, ranking_page_url(page, RANKING_PAGE_SIZE * j)) for i, page in enumerate(source_list) for j in range(anime_pagination_limit)]
+
+def fetch_ranking_entries(fetcher, url):
+  with metrics.time("navigation"):
+    response = fetcher.get(url)
+
+  if (response.status != 200):
+    raise HttpStatusError(response.status, url)
+
+  html = response.text
+
+  with metrics.time("extraction"):
+    entries = [build_ranking_entry(url, fields) for fields in extract_ranking_entries(html)]
+
+  # An empty page past the end of a ranking still has the table, a consent wall or redesign doesn't
+  if (not entries and "top-ranking-table" not in html):
+    raise ParseError(f"No ranking table on \"{url}\"")
+
+  return entries
+
+class RankingLoader:
+  """Loads ranking pages over HTTP from any number of threads. Captchas and pages the
+  parser doesn't understand go through one shared browser (with options), started on first use."""
+
+  def __init__(self, cache=None, options=None, is_verbose=False):
+    self.cache = cache
+    self.fetcher = HttpFetcher(cache=cache)
+    self.browser = BrowserSession(options) if options else None
+    self.is_verbose = is_verbose
+    self.lock = Lock()
+
+  def load(self, url):
+    try:
+      return fetch_ranking_entries(self.fetcher, url)
+    except Exception as e:
+      if (self.cache):
+        self.cache.invalidate(url)
+
+      if (not self.browser):
+        raise
+
+      if (self.is_verbose):
+        rich_print(f"HTTP FAILED FOR RANKING PAGE \"{url}\": \"{e}\". Falling back to Selenium...", color=ANSI_BRIGHT_PURPLE)
+
+    with self.lock:
+      return load_ranking_entries(self.browser.start(), self.browser.timeouts, url, self.cache)
+
+  def close(self):
+    self.fetcher.close()
+
+    if (self.browser):
+      self.browser.quit()
+
+def load_source_urls(loader, source_list: list[str], scrape_limit: int, anime_pagination_limit, is_verbose: bool, worker_count=DEFAULT_DISCOVERY_WORKER_COUNT):
+  return list(iter_source_urls(loader, source_list, scrape_limit, anime_pagination_limit, is_verbose, worker_count))
+
+def iter_source_urls(loader, source_list: list[str], scrape_limit: int, anime_pagination_limit, is_verbose: bool, worker_count=DEFAULT_DISCOVERY_WORKER_COUNT):
+  """Yields the review page url of every ranked anime, see iter_ranking_entries"""
+  for entry in iter_ranking_entries(loader, source_list, scrape_limit, anime_pagination_limit, is_verbose, worker_count):
+    yield entry.anime_url + "/reviews"
+
+def iter_ranking_entries(loader, source_list: list[str], scrape_limit: int, anime_pagination_limit, is_verbose: bool, worker_count=DEFAULT_DISCOVERY_WORKER_COUNT):
+  """Yields the RankingEntry of every ranked anime in rank order, deduplicated and up to scrape_limit.
+
+  All ranking pages are known up front, so worker_count of them are loaded at once with
+  loader.load. Results are still merged in order, and no new page is requested once
+  scrape_limit is reached or after a source ran out of entries.
+  """
+  page_urls = deque(ranking_page_urls(source_list, anime_pagination_limit))
+  exhausted_sources = set()
   anime_pages_checked = set()
-  anime_pages = []
+  anime_page_count = 0
+  in_flight = deque()
 
-  for page in source_list:
-    if (len(anime_pages) >= scrape_limit):
-      rich_print(f"Reached scrape limit ({scrape_limit}). Skipping...", color=ANSI_BRIGHT_YELLOW)
-      break
+  with ThreadPoolExecutor(max(1, worker_count)) as executor:
+    def submit_more():
+      while (page_urls and len(in_flight) < max(1, worker_count) and anime_page_count < scrape_limit):
+        source_index, url = page_urls.popleft()
 
-    driver.get(page)
-    source_wait.until(EC.url_to_be(page))
+        if (source_index not in exhausted_sources):
+          in_flight.append((source_index, url, executor.submit(loader.load, url)))
 
-    for j in range(anime_pagination_limit):
-      page_link_elements = driver.find_elements(By.CSS_SELECTOR, ".anime_ranking_h3 > a.hoverinfo_trigger")
-      
-      for link_element in page_link_elements:
-        page_link = link_element.get_attribute("href")
+    try:
+      submit_more()
 
-        if (page_link in anime_pages_checked):
+      while (in_flight):
+        source_index, url, future = in_flight.popleft()
+
+        if (is_verbose):
+          rich_print(f"Reading ranking page \"{url}\"", color=ANSI_BRIGHT_PURPLE)
+
+        try:
+          entries = future.result()
+        except Exception as e:
+          rich_print(f"ERROR WHILE LOADING RANKING PAGE \"{url}\": {e}. Skipping...", color=ANSI_BRIGHT_RED)
+          submit_more()
           continue
-      
-        if (len(anime_pages) >= scrape_limit):
-          rich_print(f"Reached scrape limit ({scrape_limit}). Skipping {page_link}...", color=ANSI_BRIGHT_YELLOW)
+
+        # A short page is the end of its ranking, later offsets would be empty
+        if (len(entries) < RANKING_PAGE_SIZE):
+          exhausted_sources.add(source_index)
+
+        for entry in entries:
+          page_link = entry.anime_url
+          anime_name = entry.anime
+
+          if (page_link in anime_pages_checked):
+            continue
+
+          if (anime_page_count >= scrape_limit):
+            rich_print(f"Reached scrape limit ({scrape_limit}). Skipping {page_link}...", color=ANSI_BRIGHT_YELLOW)
+            break
+
+          anime_pages_checked.add(page_link)
+          anime_page_count += 1
+
+          if (is_verbose):
+            print(f"Adding anime page: \"{anime_name}\" ({page_link}) ({anime_page_count} / {scrape_limit})")
+          else:
+            print(f"Adding anime page: \"{anime_name}\" ({anime_page_count} / {scrape_limit})")
+
+          yield entry
+
+        if (anime_page_count >= scrape_limit):
+          rich_print(f"Reached scrape limit ({scrape_limit}). Skipping the remaining ranking pages...", color=ANSI_BRIGHT_YELLOW)
           break
-        
-        anime_name = link_element.text
-        
-        anime_pages_checked.add(page_link)
-        anime_pages.append(page_link + "/reviews")
 
-        if (is_verbose):
-          print(f"Adding anime page: \"{anime_name}\" ({page_link}) ({len(anime_pages)} / {scrape_limit})")
-        else:
-          print(f"Adding anime page: \"{anime_name}\" ({len(anime_pages)} / {scrape_limit})")
-      
-      cookies_prompt = driver.find_elements(By.CSS_SELECTOR, "#accept-btn")
+        submit_more()
+    finally:
+      for _, _, future in in_flight:
+        future.cancel()
+
+# Pulls every review on the page in one WebDriver round-trip instead of ~6 calls per review
+REVIEW_EXTRACTION_SCRIPT = """
+return Array.from(document.querySelectorAll(".review-element.js-review-element")).map(function (review) {
+  var content = review.querySelector(".text");
+  var hidden = content && content.querySelector(".js-hidden");
+  var username = review.querySelector(".username > a");
+  var updated = review.querySelector(".update_at");
+  var verdict = review.querySelector(".tags > .tag:first-child");
+  var avatar = review.querySelector(".thumb img");
+
+  if (!content || !username || !updated || !verdict) {
+    throw new Error("Incomplete review element");
+  }
+
+  return {
+    username: username.innerText,
+    updated: updated.innerText,
+    verdict: verdict.innerText,
+    text: content.innerText,
+    hidden: hidden ? hidden.textContent : null,
+    avatar: avatar ? (avatar.getAttribute("data-src") || avatar.getAttribute("src") || "") : ""
+  };
+});
+"""
+
+def extract_review_fields_elements(first_comment):
+  all_comments = first_comment.find_elements(By.XPATH, "following-sibling::*[contains(@class, 'review-element') and contains(@class, 'js-review-element')]")
+  reviews = []
+
+  for comment in [first_comment, *all_comments]:
+    review_content = comment.find_element(By.CSS_SELECTOR, ".text")
+    review_content_rest = review_content.find_elements(By.CSS_SELECTOR, ".js-hidden")
+
+    reviews.append({
+      "username": comment.find_element(By.CSS_SELECTOR, ".username > a").text,
+      "updated": comment.find_element(By.CLASS_NAME, "update_at").text,
+      "verdict": comment.find_element(By.CSS_SELECTOR, ".tags > .tag:first-child").text,
+      "text": review_content.text,
+      "hidden": review_content_rest[0].get_attribute("textContent") if review_content_rest else None,
+      "avatar": element_image_url(comment.find_element(By.CSS_SELECTOR, ".thumb img"))
+    })
+
+  return reviews
+
+def extract_review_fields(driver, first_comment, extraction_mode):
+  if (extraction_mode == "script"):
+    return driver.execute_script(REVIEW_EXTRACTION_SCRIPT)
+  elif (extraction_mode == "source"):
+    return extract_reviews(driver.page_source)
+
+  return extract_review_fields_elements(first_comment)
+
+def build_review(page_url, anime_name, fields):
+  timestamp = to_timestamp(fields["updated"])
+  review_text = fields["text"][:-3]
+
+  if (fields["hidden"]):
+    review_text += fields["hidden"]
+
+  if (REPLACE_NEWLINES_WITH_SPACES):
+    review_text = review_text.replace("\n", " ")
+
+  return Review(
+    page_url=page_url,
+    anime=anime_name,
+    username=fields["username"],
+    avatar=fields["avatar"],
+    timestamp=int(datetime(timestamp[0], timestamp[1], timestamp[2]).timestamp()),
+    feelings=RECOMMENDATION_SCORES[fields["verdict"]],
+    review_text=review_text
+  )
+
+def load_review_page(browser, url, extraction_mode, cache=None, backoff=None, prefetch_next=False):
+  """Returns (anime name, loaded url, review fields, next review page url or None) for one review page.
+
+  Served from the page cache when it has a fresh copy, otherwise loaded in the browser session (and then cached).
+  With prefetch_next, the next review page starts loading in a background tab before this one is read.
+  """
+  if (cache):
+    html = cache.get_fresh_text(url)
+
+    if (html is not None):
+      try:
+        with metrics.time("extraction"):
+          anime_name, comments, next_page_url = extract_review_page(html)
 
-      if (cookies_prompt):
-        print("FOUND THAT PIECE OF SHIT COOKIES PROMPT. NUKING...")
-        cookies_prompt[0].click()
-        source_wait.until(EC.staleness_of(cookies_prompt[0]))
-      
-      if (j < anime_pagination_limit - 1):
-        new_offset = 50 * (j + 1)
-        new_url = page
+        return anime_name, url, comments, next_page_url and urljoin(url, next_page_url)
+      except ParseError:
+        cache.invalidate(url)
 
-        if ("?" in new_url):
-          new_url += f"&limit={new_offset}"
-        else:
-          new_url += f"?limit={new_offset}"
+  if (backoff):
+    backoff.wait()
+
+  driver = browser.open(url, "reviews")
+
+  # A captcha counts as a ready page, the reviews only show up once it's solved
+  if (check_captcha(driver, backoff)):
+    wait_until_ready(driver, "reviews", browser.timeouts)
+
+  with metrics.time("extraction"):
+    more_reviews_btn = driver.find_elements(By.CSS_SELECTOR, ".ga-click[data-ga-click-type=\"review-more-reviews\"]")
+    next_page_url = more_reviews_btn[0].get_attribute("href") if more_reviews_btn else None
 
-        if (is_verbose):
-          rich_print(f"Going to page offset {new_offset}. New URL is \"{new_url}\"", color=ANSI_BRIGHT_PURPLE)
-        
-        driver.get(new_url)
-        source_wait.until(EC.url_to_be(new_url))
-    
-  return anime_pages
+  if (prefetch_next and next_page_url and can_prefetch(next_page_url, cache, backoff)):
+    browser.prefetch(next_page_url, "reviews")
+
+  with metrics.time("extraction"):
+    title = driver.find_element(By.CSS_SELECTOR, ".title-name")
+    comment_elements = driver.find_elements(By.CSS_SELECTOR, ".review-element.js-review-element")
+    anime_name = title.text
+    # An anime without reviews is an empty page (and the last one), like over HTTP
+    comments = extract_review_fields(driver, comment_elements[0], extraction_mode) if comment_elements else []
+
+  if (cache):
+    cache.put(url, driver.page_source)
+
+  return anime_name, driver.current_url, comments, next_page_url
+
+def first_review_page_url(page_url, resume=None, high_water_marks=None):
+  """The review page ReviewPagination starts at"""
+  if (resume):
+    return resume["next"]
+
+  if (high_water_marks is not None):
+    return page_url + ("&" if "?" in page_url else "?") + INCREMENTAL_REVIEW_SORT
+
+  return page_url
+
+class ReviewPagination:
+  """Pagination state of one anime's reviews, shared by the browser workers and the async crawler.
+
+  current_url is the next review page to load. Every loaded page goes through handle_page,
+  which returns the ("record", review) and ("page", checkpoint) events for it. A checkpoint
+  passed back as resume continues the pagination from there. With high_water_marks
+  (anime url -> newest review seen), reviews are read newest first and the pagination
+  stops at the first review that was already seen, so only new reviews are returned.
+  finished turns True at the page limit, the last page or the first seen review.
+  Failed page loads go through handle_error, which retries every page on its own.
+  """
+
+  def __init__(self, page_url, review_page_limit, resume=None, high_water_marks=None, retry=None):
+    self.review_page_limit = review_page_limit
+    self.high_water_marks = high_water_marks
+    self.high_water_mark = None
+    self.item = page_url
+    self.retry = retry or RetryEngine()
+    self.attempts = None
+    self.page_index = 0
+    self.current_url = first_review_page_url(page_url, resume, high_water_marks)
+    self.page_url = page_url
+    self.anime_name = None
+
+    if (resume):
+      self.anime_name = resume["anime"]
+      self.page_url = resume["page_url"]
+      self.page_index = resume["page"]
+
+      print(f"\n Resuming reviews for anime page \"{self.anime_name}\" at page {self.page_index + 1}\n")
+
+      if (high_water_marks is not None):
+        self.high_water_mark = high_water_marks.get(self.page_url)
+
+    self.finished = self.page_index >= review_page_limit
+
+  def handle_page(self, loaded_anime_name, loaded_url, comments, next_page_url):
+    self.retry.succeeded()
+    self.attempts = None
+    anime_name = self.anime_name or loaded_anime_name
+    page_url = self.page_url if self.anime_name else anime_url_from_reviews_url(loaded_url)
+    high_water_mark = self.high_water_mark
+
+    if (self.anime_name is None and self.high_water_marks is not None):
+      high_water_mark = self.high_water_marks.get(page_url)
+
+    reviews = [build_review(page_url, anime_name, fields) for fields in comments]
+    reached_seen_reviews = False
+
+    if (high_water_mark):
+      new_review_count = next((i for i, review in enumerate(reviews) if is_seen_review(review, high_water_mark)), len(reviews))
+      reached_seen_reviews = new_review_count < len(reviews)
+      reviews = reviews[:new_review_count]
+      comments = comments[:new_review_count]
+
+    if (self.anime_name is None):
+      print(f"\n Checking reviews for anime page \"{anime_name}\"\n")
+
+    self.anime_name = anime_name
+    self.page_url = page_url
+    self.high_water_mark = high_water_mark
+
+    metrics.count("pages")
+    metrics.count("records", len(reviews))
+    rich_print(f"Found {len(comments)} {'new ' if high_water_mark else ''}comments for {anime_name} (page {self.page_index + 1})", color=ANSI_YELLOW)
+
+    events = []
+
+    for comment_idx, review in enumerate(reviews):
+      review_text = review["review_text"]
+      preview_content = ' '.join(review_text.split(" ")[:10]).replace("\n", "")
+      ellipsis = (len(preview_content) < len(review_text) and "..." or "")
+
+      print(f"{ANSI_BRIGHT_GREEN}{anime_name} {ANSI_BRIGHT_BLUE}[{comment_idx + 1} / {len(reviews)}]{ANSI_DEFAULT} {review['username']} ({comments[comment_idx]['verdict']}): \"{preview_content}{ellipsis}\"")
+
+      events.append(("record", review))
+
+    if (reached_seen_reviews):
+      rich_print(f"Reached reviews already scraped for {anime_name}. Going to the next entry.", color=ANSI_BRIGHT_YELLOW)
+      self.finished = True
+    elif (self.page_index < self.review_page_limit - 1):
+      if (not next_page_url):
+        rich_print(f"No next page for reviews found. Going to the next entry.", color=ANSI_BRIGHT_YELLOW)
+        self.finished = True
+      else:
+        rich_print(f"Going to page {next_page_url}", color=ANSI_BRIGHT_YELLOW)
+
+        events.append(("page", {"anime": anime_name, "page_url": page_url, "page": self.page_index + 1, "next": next_page_url}))
+        self.current_url = next_page_url
 
-def scrape_pages(anime_pages, options, review_page_limit, is_verbose):
-  driver = webdriver.Firefox(options=options)
-  page_wait = WebDriverWait(driver, 10)
+    self.page_index += 1
 
-  scraped_reviews = []
-  cursor = 0
+    if (self.page_index >= self.review_page_limit):
+      self.finished = True
 
-  while (cursor < len(anime_pages)):
-    page_url = anime_pages[cursor]
+    return events
 
-    driver.get(page_url)
-    page_wait.until(EC.url_to_be(page_url))
+  def handle_error(self, e, is_verbose):
+    """Returns how many seconds to wait before loading current_url again.
 
-    check_captcha(driver)
+    Raises RetryExhausted once the page is out of retries. The anime then ends as
+    a failed item instead of a finished one, so a resumed run continues at this page.
+    """
+    if (self.attempts is None or self.attempts.url != self.current_url):
+      self.attempts = self.retry.begin(self.item, self.current_url)
 
-    retry_count = 0
-    anime_name = page_wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".title-name"))).text
-    page_url = driver.current_url.rstrip("reviews")
+    try:
+      delay = self.attempts.failed(e)
+    except RetryExhausted:
+      rich_print(f"RETRY COUNT EXCEEDED FOR PAGE \"{self.current_url}\". Giving up on the anime.", color=ANSI_BRIGHT_RED)
+      raise
 
-    print(f"\n [{cursor+1} / {len(anime_pages)}] Checking reviews for anime page \"{anime_name}\"\n")
+    if (is_verbose):
+      rich_print(f"\nERROR WHILE TRYING TO SCRAPE \"{self.current_url}\" ({self.attempts.kind}). Error: {e}. Retrying in {delay:.1f}s...\n", color=ANSI_BRIGHT_RED)
+    else:
+      rich_print(f"ERROR WHILE TRYING TO SCRAPE \"{self.current_url}\" ({self.attempts.kind}). Retrying in {delay:.1f}s...", color=ANSI_BRIGHT_RED)
+
+    return delay
+
+def scrape_pages(browser, page_url, review_page_limit, is_verbose, extraction_mode=DEFAULT_EXTRACTION_MODE, resume=None, backoff=None, cache=None, high_water_marks=None, retry=None):
+  """Scrapes up to review_page_limit pages of reviews for one anime in the browser session, see ReviewPagination for the events yielded"""
+  pagination = ReviewPagination(page_url, review_page_limit, resume, high_water_marks, retry)
+  first_url = pagination.current_url
+  next_page_url = None
+
+  try:
+    while (not pagination.finished):
+      pagination.retry.wait()
 
-    for j in range(review_page_limit):
       try:
-        check_captcha(driver)
-
-        first_comment = page_wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".review-element.js-review-element")))
-        all_comments = first_comment.find_elements(By.XPATH, "following-sibling::*[contains(@class, 'review-element') and contains(@class, 'js-review-element')]")
-        comments = [first_comment, *all_comments]
-
-        rich_print(f"Found {len(comments)} comments for {anime_name} (page {j+1})", color=ANSI_YELLOW)
-
-        for comment_idx, comment in enumerate(comments):
-            username = comment.find_element(By.CSS_SELECTOR, ".username > a").text
-            timestamp = to_timestamp(comment.find_element(By.CLASS_NAME, "update_at").text)
-            recommendation_verdict = comment.find_element(By.CSS_SELECTOR, ".tags > .tag:first-child").text
-            review_content = comment.find_element(By.CSS_SELECTOR, ".text")
-            review_content_rest = review_content.find_elements(By.CSS_SELECTOR, ".js-hidden")
-            user_profile_picture = comment.find_element(By.CSS_SELECTOR, ".thumb img.lazyloaded").get_attribute("src")
-
-            review_text = review_content.text[:-3]
-
-            if (review_content_rest):
-              review_text += review_content_rest[0].get_attribute("textContent")
-              
-            if (REPLACE_NEWLINES_WITH_SPACES):
-              review_text = review_text.replace("\n", " ")
-            
-            preview_content = ' '.join(review_text.split(" ")[:10]).replace("\n", "")
-            
-            print(f"{ANSI_BRIGHT_GREEN}{anime_name} {ANSI_BRIGHT_BLUE}[{comment_idx + 1} / {len(comments)}]{ANSI_DEFAULT} {username} ({recommendation_verdict}): \"{preview_content + (len(preview_content) < len(review_text) and "..." or "")}\"")
-
-            scraped_reviews.append({
-              'page_url': page_url,
-              'anime': anime_name,
-              'username': username,
-              'avatar': user_profile_picture,
-              'timestamp': int(datetime(timestamp[0], timestamp[1], timestamp[2]).timestamp()),
-              'feelings': RECOMMENDATION_SCORES[recommendation_verdict],
-              'review_text': review_text
-            })
+        page = load_review_page(browser, pagination.current_url, extraction_mode, cache, backoff, pagination.page_index < review_page_limit - 1)
+        next_page_url = page[3]
+        events = pagination.handle_page(*page)
       except Exception as e:
-        retry_count += 1
+        if (classify(e) == "driver"):
+          rich_print(f"Browser died while loading \"{pagination.current_url}\". Restarting it...", color=ANSI_BRIGHT_YELLOW)
+          browser.restart()
 
-        if (retry_count > MAX_RETRY_COUNT):
-          print(f"RETRY COUNT EXCEEDED FOR PAGE \"{page_url}\". Skipping...")
-          break
-          
-        if (is_verbose):
-          rich_print(f"\nERROR WHILE TRYING TO SCRAPE \"{page_url}\". Error: {e}. Retrying ({retry_count} / {MAX_RETRY_COUNT})...\n", color=ANSI_BRIGHT_RED)
-        else:
-          rich_print(f"ERROR WHILE TRYING TO SCRAPE \"{page_url}\". Retrying ({retry_count} / {MAX_RETRY_COUNT})...", color=ANSI_BRIGHT_RED)
+        sleep(pagination.handle_error(e, is_verbose))
         continue
 
-      if (j < review_page_limit - 1):
-        more_reviews_btn = driver.find_elements(By.CSS_SELECTOR, ".ga-click[data-ga-click-type=\"review-more-reviews\"]")
+      yield from events
+  finally:
+    # Pages loaded ahead (by ReviewWorker.prefetch or for the next page) that the pagination didn't get to
+    browser.discard(first_url)
+    browser.discard(next_page_url)
 
-        if (not more_reviews_btn):
-          rich_print(f"No next page for reviews found. Going to the next entry.", color=ANSI_BRIGHT_YELLOW)
-          break
+async def crawl_reviews(crawler, page_url, review_page_limit, is_verbose, resume_pages=None, high_water_marks=None, retry=None):
+  """Async crawler counterpart of scrape_pages, reading review pages over HTTP"""
+  pagination = ReviewPagination(page_url, review_page_limit, (resume_pages or {}).get(page_url), high_water_marks, retry)
 
-        next_page_url = more_reviews_btn[0].get_attribute("href")
+  while (not pagination.finished):
+    url = pagination.current_url
 
-        rich_print(f"Going to page {next_page_url}", color=ANSI_BRIGHT_YELLOW)
+    try:
+      response = await crawler.fetch(url)
 
-        driver.get(next_page_url)
-        WebDriverWait(driver, 10).until(EC.url_to_be(next_page_url))
-    
-    cursor += 1
-    
-  driver.quit()
-  return scraped_reviews
+      if (response.status != 200):
+        raise HttpStatusError(response.status, url)
+
+      with metrics.time("extraction"):
+        anime_name, comments, next_page_url = extract_review_page(response.text)
+
+      events = pagination.handle_page(anime_name, url, comments, next_page_url and urljoin(url, next_page_url))
+    except Exception as e:
+      if (isinstance(e, CaptchaError)):
+        metrics.count("captchas")
+        rich_print(f"Captcha served for \"{url}\". Pausing requests to the site for {CAPTCHA_BACKOFF_SECONDS}s...", color=ANSI_BRIGHT_YELLOW)
+        crawler.pause_host(url, CAPTCHA_BACKOFF_SECONDS)
+
+      if (crawler.fetcher.cache):
+        crawler.fetcher.cache.invalidate(url)
+
+      delay = pagination.handle_error(e, is_verbose)
+
+      # An open circuit breaker holds back every request to the site, not just this anime's
+      if (pagination.retry.remaining()):
+        crawler.pause_host(url, pagination.retry.remaining())
+
+      await asyncio.sleep(delay)
+      continue
+
+    for event in events:
+      yield event
+
+class ReviewWorker:
+  """Owns one Firefox instance for a work queue process and scrapes the anime pages it pulls.
+  With tabs > 1, the first review pages of the next anime in the queue load in background tabs."""
+
+  def __init__(self, options, review_page_limit, is_verbose, extraction_mode=DEFAULT_EXTRACTION_MODE, resume_pages=None, backoff=None, cache_folder=None, cache_max_bytes=None, high_water_marks=None, retry=None, tabs=DEFAULT_TAB_COUNT):
+    self.resume_pages = resume_pages or {}
+    self.high_water_marks = high_water_marks
+    self.backoff = backoff
+    self.retry = retry or RetryEngine()
+    self.cache = PageCache(cache_folder, cache_max_bytes) if cache_folder else None
+    self.browser = BrowserSession(options, tabs)
+    self.browser.start()
+    self.lookahead = self.browser.tabs - 1
+    self.review_page_limit = review_page_limit
+    self.is_verbose = is_verbose
+    self.extraction_mode = extraction_mode
+
+  def prefetch(self, page_url):
+    url = first_review_page_url(page_url, self.resume_pages.get(page_url), self.high_water_marks)
+
+    if (can_prefetch(url, self.cache, self.backoff, self.retry)):
+      self.browser.prefetch(url, "reviews")
+
+  def process(self, page_url):
+    yield from scrape_pages(self.browser, page_url, self.review_page_limit, self.is_verbose, self.extraction_mode, self.resume_pages.get(page_url), self.backoff, self.cache, self.high_water_marks, self.retry)
+
+  def close(self):
+    self.browser.quit()
+    self.retry.close()
+
+    if (self.cache):
+      self.cache.close()
     
 def main():
   parser = ArgumentParser(description="Scrapes the comments from MyAnimeList from a list of source urls using Selenium.", epilog="[TEST]")
   parser.add_argument("-s", "--source-urls", help="The source urls file to scrape anime pages from.")
   parser.add_argument("-o", "--output", required=True, help="Output file path.")
+  parser.add_argument("-f", "--format", choices=REVIEW_OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT, help=f"Output file format. \"json\" is a pretty-printed array and \"jsonl\" has one review per line. Both are written incrementally as reviews come in. \"parquet\" (needs pyarrow) and \"npz\" (needs numpy) are compact columnar files for analysis, see columnar.py. The default value is {DEFAULT_OUTPUT_FORMAT}.")
+  parser.add_argument("--database", nargs="?", const=DEFAULT_DATABASE_PATH, metavar="DATABASE_FILE", help=f"Also upserts every review into the SQLite database (default file {DEFAULT_DATABASE_PATH}), see storage.py.")
   parser.add_argument("-t", "--target-urls", help="An optional exported file of MAL anime pages to scrape. Will automatically append /reviews to the anime pages if it doesn't end like so. Overrides --source_urls.")
   parser.add_argument("-l", "--scrape-limit", type=int, default=DEFAULT_SCRAPE_LIMIT, help=f"The max number of anime pages to scrape. All other pages are skipped. The default value is {DEFAULT_SCRAPE_LIMIT}.")
   parser.add_argument("-p", "--pagination-limit", type=int, default=DEFAULT_ANIME_PAGINATION_LIMIT, help=f"The number of pages of anime urls to scrape from the source urls. The default value is {DEFAULT_ANIME_PAGINATION_LIMIT}.")
+  parser.add_argument("-d", "--discovery-workers", type=int, default=DEFAULT_DISCOVERY_WORKER_COUNT, help=f"How many ranking pages are loaded at once during discovery. The default value is {DEFAULT_DISCOVERY_WORKER_COUNT}.")
   parser.add_argument("-r", "--review-pagination-limit", type=int, default=DEFAULT_REVIEW_PAGINATION_LIMIT, help=f"The number of pages of reviews to scrape from the anime pages. The default value is {DEFAULT_REVIEW_PAGINATION_LIMIT}.")
+  parser.add_argument("-e", "--engine", choices=ENGINES, default=DEFAULT_ENGINE, help=f"How review pages are scraped. \"selenium\" runs one browser per worker process, \"async\" fetches and parses pages over HTTP with the asyncio crawler (--concurrency, --rate, --burst). The default value is {DEFAULT_ENGINE}.")
+  parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help=f"Max requests in flight with the async engine. The default value is {DEFAULT_CONCURRENCY}.")
+  parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help=f"Average requests per second per host with the async engine. The default value is {DEFAULT_RATE}.")
+  parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help=f"Max requests per host sent at once with the async engine. The default value is {DEFAULT_BURST}.")
+  parser.add_argument("-x", "--extraction", choices=EXTRACTION_MODES, default=DEFAULT_EXTRACTION_MODE, help=f"How reviews are read from each page. \"script\" pulls every review in one execute_script call, \"source\" parses one page_source snapshot in Python and \"elements\" queries each field through WebDriver. The default value is {DEFAULT_EXTRACTION_MODE}.")
+  parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKER_COUNT, help=f"The number of browser worker processes pulling anime pages from the shared queue. The default value is {DEFAULT_WORKER_COUNT}.")
+  parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_FOLDER, metavar="CACHE_FOLDER", help=f"Reads ranking and review pages through an on-disk page cache (default folder {DEFAULT_CACHE_FOLDER}). Pages still within their TTL are parsed from disk instead of being loaded again.")
+  parser.add_argument("--cache-max-size", type=int, default=DEFAULT_CACHE_MAX_MB, help=f"Size budget of the page cache in MB. Least recently used pages are evicted above it. The default value is {DEFAULT_CACHE_MAX_MB}.")
+  parser.add_argument("--incremental", nargs="?", const=HIGH_WATER_MARKS_FILE, metavar="MARKS_FILE", help=f"Only scrapes reviews newer than the newest review seen for each anime in earlier incremental runs, stopping pagination at the first known review. The marks are kept in MARKS_FILE (default {HIGH_WATER_MARKS_FILE}).")
+  parser.add_argument("--browser-profile", choices=BROWSER_PROFILES, default=DEFAULT_BROWSER_PROFILE, help=f"\"lean\" doesn't wait for page loads (only for the elements a page needs) and blocks images, media, web fonts, ads and trackers. \"full\" loads pages like a regular browser. The default value is {DEFAULT_BROWSER_PROFILE}.")
   parser.add_argument("--headless", action="store_true", help="Runs the browser in headless mode.")
+  parser.add_argument("--tabs", type=int, default=DEFAULT_TAB_COUNT, help=f"Tabs per browser worker. The next review page and the next anime in the worker's queue load in the other tabs while the current page is read. Needs the lean browser profile. The default value is {DEFAULT_TAB_COUNT}.")
+  parser.add_argument("--dead-letters", default=DEAD_LETTERS_FILE, metavar="DEAD_LETTER_FILE", help=f"Anime whose review pages ran out of retries are appended to this JSON Lines file. \"python retry.py DEAD_LETTER_FILE\" turns it into a list for -t. The default value is {DEAD_LETTERS_FILE}.")
+  parser.add_argument("--resume", metavar="STATE_FOLDER", help=f"Resumes an interrupted run from its state folder (e.g. {STATE_FOLDER}/state_<timestamp>). Finished anime pages are skipped, unfinished review pagination continues where it stopped and already scraped reviews are kept.")
+  parser.add_argument("--metrics-file", metavar="FILE", help="Writes a JSON snapshot of the run's stage timings and per-worker counters to FILE every --metrics-interval seconds.")
+  parser.add_argument("--metrics-interval", type=float, default=DEFAULT_SNAPSHOT_INTERVAL, help=f"Seconds between metrics snapshots. The default value is {DEFAULT_SNAPSHOT_INTERVAL}.")
+  parser.add_argument("--metrics-port", type=int, metavar="PORT", help="Serves the metrics in Prometheus text format on http://127.0.0.1:PORT/metrics while the scraper runs.")
   parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output.")
 
   args = parser.parse_args()
   is_verbose = args.verbose
 
-  options = Options()
-  options.add_argument("--width=1280")
-  options.add_argument("--height=800")
-
-  if (args.headless):
-    options.add_argument("--headless")
+  options = browser_options(args.browser_profile, args.headless)
 
   if (is_verbose):
     rich_print(f"{args}", color=ANSI_BRIGHT_PURPLE)
 
+  if (args.format in COLUMNAR_FORMATS):
+    try:
+      check_dependencies(args.format)
+    except ImportError as e:
+      rich_print(f"Error: {e}.", color=ANSI_BRIGHT_RED)
+      return 1
+
   anime_pages = []
+  cache_max_bytes = args.cache_max_size * 1024 * 1024
+  cache_stats_before = read_cache_stats(args.cache) if args.cache else None
+
+  if (args.resume):
+    if (not os.path.exists(f"{args.resume}/{URLS_FILE_NAME}")):
+      rich_print(f"Error: State folder \"{args.resume}\" does not exist or has no url list.", color=ANSI_BRIGHT_RED)
+      return 1
 
-  if (args.target_urls):
+    anime_pages = load_state_urls(args.resume)
+  elif (args.target_urls):
     if (not os.path.exists(args.target_urls)):
       rich_print(f"Error: Target file \"{args.target_urls}\" not found.", color=ANSI_BRIGHT_RED)
       return 1
@@ -273,7 +753,6 @@ def main():
         
   else:
     url_list = DEFAULT_ANIME_PAGE_URLS
-    driver = webdriver.Firefox(options=options)
     
     if (is_verbose):
       if (args.source_urls):
@@ -288,33 +767,132 @@ def main():
       if (is_verbose):
         rich_print(f"Loaded source-urls {url_list}", color=ANSI_BRIGHT_PURPLE)
       
-    anime_pages = load_source_urls(driver, url_list, args.scrape_limit, args.pagination_limit, is_verbose)
-    driver.quit()
+    discovery_cache = PageCache(args.cache, cache_max_bytes) if args.cache else None
+    loader = RankingLoader(discovery_cache, options, is_verbose)
+    anime_pages = load_source_urls(loader, url_list, args.scrape_limit, args.pagination_limit, is_verbose, args.discovery_workers)
+    loader.close()
+
+    if (discovery_cache):
+      discovery_cache.close()
+
+  if (args.resume):
+    state_folder_name = args.resume
+  else:
+    state_folder_name = create_state_folder()
+    save_urls(state_folder_name, anime_pages)
+
+  journal = Journal(state_folder_name)
+  pending_anime_pages = journal.pending(anime_pages)
+  writer = open_writer(args.output, args.format)
+  database = Database(args.database) if args.database else None
+  high_water_marks = load_high_water_marks(args.incremental) if args.incremental else None
+  # Marks only move forward once every page of an anime was scraped, so a failed anime is fully retried next time
+  updated_high_water_marks = deepcopy(high_water_marks)
+  run_high_water_marks = {}
+  anime_urls = {}
+
+  for page_url, record in journal.iter_records(with_items=True, record_type=Review):
+    writer.write(record)
+
+    if (database):
+      database.write("reviews", record)
+
+    if (args.incremental):
+      update_high_water_mark(run_high_water_marks, page_url, record)
+      anime_urls[page_url] = record["page_url"]
+
+  if (args.incremental):
+    for page_url in journal.finished & run_high_water_marks.keys():
+      merge_high_water_mark(updated_high_water_marks, anime_urls.pop(page_url), run_high_water_marks.pop(page_url))
+  finished_count = len(anime_pages) - len(pending_anime_pages)
 
   rich_print(f"FOUND {len(anime_pages)} anime pages. Starting scrape...", color=ANSI_BRIGHT_BLUE)
 
-  # cursor = 0
-  # review_page_limit = args.review_pagination_limit
-  scraped_reviews = []
-  func = partial(scrape_pages, options=options, review_page_limit=args.review_pagination_limit, is_verbose=is_verbose)
-  chunks = chunkify(anime_pages, MAX_WORKER_COUNT)
+  if (finished_count or journal.pages):
+    rich_print(f"RESUMING {state_folder_name}: {finished_count} anime pages already finished, {len(journal.pages)} partially scraped, {len(pending_anime_pages)} left.", color=ANSI_BRIGHT_YELLOW)
 
-  with Pool(MAX_WORKER_COUNT) as pool:
-    chunks_scraped = pool.map(func, chunks)
-    scraped_reviews = [comment for chunk in chunks_scraped for comment in chunk]
+  crawler = None
+  retry = RetryEngine(breaker=CircuitBreaker(), dead_letter_path=args.dead_letters)
+  failed_count = 0
+
+  if (args.engine == "async"):
+    crawler = AsyncCrawler(args.concurrency, args.rate, args.burst, PageCache(args.cache, cache_max_bytes) if args.cache else None)
+    handler = partial(crawl_reviews, review_page_limit=args.review_pagination_limit, is_verbose=is_verbose, resume_pages=journal.pages, high_water_marks=high_water_marks, retry=retry)
+    events = crawler.run(pending_anime_pages, handler)
+  else:
+    worker_factory = partial(ReviewWorker, options=options, review_page_limit=args.review_pagination_limit, is_verbose=is_verbose, extraction_mode=args.extraction, resume_pages=journal.pages, backoff=CaptchaBackoff(), cache_folder=args.cache, cache_max_bytes=cache_max_bytes, high_water_marks=high_water_marks, retry=retry, tabs=args.tabs)
+    events = run_work_queue(pending_anime_pages, worker_factory, args.workers)
+
+  exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_interval, args.metrics_port)
+
+  for event, page_url, value in events:
+    if (event == "result"):
+      result_type, payload = value
+
+      if (result_type == "record"):
+        with metrics.time("serialization"):
+          journal.record(page_url, payload)
+          writer.write(payload)
+
+          if (database):
+            database.write("reviews", payload)
+
+        if (args.incremental):
+          update_high_water_mark(run_high_water_marks, page_url, payload)
+          anime_urls[page_url] = payload["page_url"]
+      else:
+        journal.page(page_url, payload)
+      continue
+
+    finished_count += 1
+
+    if (event == "done"):
+      journal.done(page_url)
+
+      if (page_url in run_high_water_marks):
+        merge_high_water_mark(updated_high_water_marks, anime_urls.pop(page_url), run_high_water_marks.pop(page_url))
+
+    if (event == "error"):
+      failed_count += 1
+      rich_print(f"[{finished_count} / {len(anime_pages)}] WORKER FAILED ON PAGE \"{page_url}\": {value}", color=ANSI_BRIGHT_RED)
+    else:
+      rich_print(f"[{finished_count} / {len(anime_pages)}] Finished \"{page_url}\"", color=ANSI_BRIGHT_BLUE)
+
+  journal.close()
+  retry.close()
+
+  if (failed_count):
+    rich_print(f"{failed_count} anime pages failed. They continue where they stopped with --resume {state_folder_name}, and the ones that ran out of retries are listed in {args.dead_letters}.", color=ANSI_BRIGHT_YELLOW)
+
+  if (crawler):
+    crawler.close()
+
+    if (crawler.fetcher.cache):
+      crawler.fetcher.cache.close()
+
+    rich_print(f"Crawler: {crawler.stats}", color=ANSI_BRIGHT_CYAN)
+
+  if (args.incremental):
+    save_high_water_marks(args.incremental, updated_high_water_marks)
+
+  if (args.cache):
+    rich_print(format_cache_stats(cache_stats_before, read_cache_stats(args.cache)), color=ANSI_BRIGHT_CYAN)
 
-  rich_print("\nExporting...", color=ANSI_BRIGHT_YELLOW)
-  
   output_file_name = os.path.basename(args.output)
-  serialized_json = dumps(scraped_reviews, indent=2)
-  size_bytes = len(serialized_json)
 
-  with open(args.output, "w") as f:
-    f.write(serialized_json)
-    rich_print(f"\nExported {output_file_name} (Size {get_size_displayable(size_bytes)})", color=ANSI_BRIGHT_GREEN)
+  with metrics.time("serialization"):
+    size_bytes = writer.close()
+
+    if (database):
+      database.close()
+
+  exporter.close()
+  rich_print(f"\n{metrics.summary_table()}", color=ANSI_BRIGHT_CYAN)
+
+  rich_print(f"\nExported {output_file_name} ({writer.count} reviews, Size {get_size_displayable(size_bytes)})", color=ANSI_BRIGHT_GREEN)
   
   return 0
 
 if __name__ == "__main__":
   exit_code = main()
-  exit(exit_code)
\ No newline at end of file
+  exit(exit_code)
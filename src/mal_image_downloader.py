@@ -0,0 +1,131 @@
+import os
+import asyncio
+from util import *
+from functools import partial
+from sys import exit
+from argparse import ArgumentParser
+from comment_reader import iter_records
+from crawler import AsyncCrawler, DEFAULT_BURST
+from metrics import metrics, MetricsExporter, DEFAULT_SNAPSHOT_INTERVAL
+from image_store import ImageStore, DEFAULT_IMAGE_FOLDER
+from mal_parser import HttpStatusError
+from retry import RetryEngine, MISSING_STATUSES
+
+DEFAULT_FIELDS = ["cover", "avatar"]
+# The image CDN takes a lot more than the site itself
+DEFAULT_IMAGE_CONCURRENCY = 16
+DEFAULT_IMAGE_RATE = 20.0
+
+def iter_image_urls(paths, fields=DEFAULT_FIELDS):
+  """Unique image urls of the given fields across scraper exports, in order of first appearance"""
+  seen_urls = set()
+
+  for path in paths:
+    for record in iter_records(path):
+      for field in fields:
+        url = record.get(field)
+
+        if (url and url.startswith(("http://", "https://")) and url not in seen_urls):
+          seen_urls.add(url)
+          yield url
+
+async def fetch_image(crawler, url, is_verbose=False, retry=None):
+  """Async crawler handler for one image url, yields (status, body, content type).
+
+  Missing images (404, 410) are yielded for the manifest. Other failures are retried after
+  their kind's backoff (see retry.RetryEngine), and rate limits (403, 429) pause the whole host.
+  """
+  attempts = (retry or RetryEngine()).begin(url)
+
+  while (True):
+    try:
+      response = await crawler.fetch(url)
+
+      if (response.status == 200 or response.status in MISSING_STATUSES):
+        break
+
+      raise HttpStatusError(response.status, url)
+    except Exception as e:
+      # Raises RetryExhausted once the failure kind is out of retries
+      delay = attempts.failed(e)
+
+      if (attempts.kind == "rate_limit"):
+        crawler.pause_host(url, delay)
+
+      if (is_verbose):
+        rich_print(f"ERROR FACED WHILE DOWNLOADING \"{url}\" ({attempts.kind}): \"{e}\". Retrying in {delay:.1f}s...", color=ANSI_BRIGHT_YELLOW)
+
+      await asyncio.sleep(delay)
+
+  metrics.count("pages")
+  yield response.status, response.body, response.headers.get("content-type")
+
+def main():
+  parser = ArgumentParser(description="Downloads the covers and avatars referenced by scraper exports into a content-addressed image folder. Every url is fetched once and identical images are stored once.")
+  parser.add_argument("input_files", nargs="+", help="Scraper exports (JSON, JSON Lines, parquet or npz) to read image urls from.")
+  parser.add_argument("--fields", nargs="+", default=DEFAULT_FIELDS, help=f"Record fields holding image urls. The default value is {' '.join(DEFAULT_FIELDS)}.")
+  parser.add_argument("-o", "--output-folder", default=DEFAULT_IMAGE_FOLDER, help=f"Where images and manifest.jsonl are kept. Running again with the same folder only downloads what's missing. The default value is {DEFAULT_IMAGE_FOLDER}.")
+  parser.add_argument("--concurrency", type=int, default=DEFAULT_IMAGE_CONCURRENCY, help=f"Max downloads in flight. The default value is {DEFAULT_IMAGE_CONCURRENCY}.")
+  parser.add_argument("--rate", type=float, default=DEFAULT_IMAGE_RATE, help=f"Average requests per second per host. The default value is {DEFAULT_IMAGE_RATE}.")
+  parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help=f"Max requests per host sent at once. The default value is {DEFAULT_BURST}.")
+  parser.add_argument("--metrics-file", metavar="FILE", help="Writes a JSON snapshot of the run's stage timings and counters to FILE every --metrics-interval seconds.")
+  parser.add_argument("--metrics-interval", type=float, default=DEFAULT_SNAPSHOT_INTERVAL, help=f"Seconds between metrics snapshots. The default value is {DEFAULT_SNAPSHOT_INTERVAL}.")
+  parser.add_argument("--metrics-port", type=int, metavar="PORT", help="Serves the metrics in Prometheus text format on http://127.0.0.1:PORT/metrics while the downloader runs.")
+  parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output.")
+
+  args = parser.parse_args()
+  is_verbose = args.verbose
+
+  for path in args.input_files:
+    if (not os.path.exists(path)):
+      rich_print(f"Error: Input file \"{path}\" not found.", color=ANSI_BRIGHT_RED)
+      return 1
+
+  store = ImageStore(args.output_folder)
+  urls = list(iter_image_urls(args.input_files, args.fields))
+  pending_urls = [url for url in urls if url not in store]
+
+  rich_print(f"FOUND {len(urls)} unique image urls, {len(urls) - len(pending_urls)} already in {args.output_folder}. {len(pending_urls)} left to download.", color=ANSI_BRIGHT_BLUE)
+
+  crawler = AsyncCrawler(args.concurrency, args.rate, args.burst)
+  exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_interval, args.metrics_port)
+  counts = {"stored": 0, "duplicates": 0, "missing": 0, "failed": 0}
+  stored_bytes = 0
+  finished_count = 0
+
+  for event, url, value in crawler.run(pending_urls, partial(fetch_image, is_verbose=is_verbose, retry=RetryEngine())):
+    if (event == "result"):
+      status, body, content_type = value
+
+      with metrics.time("serialization"):
+        if (status == 200):
+          entry, is_duplicate = store.put(url, body, content_type)
+          counts["duplicates" if is_duplicate else "stored"] += 1
+          stored_bytes += 0 if is_duplicate else entry["size"]
+          metrics.count("records")
+        else:
+          store.failed(url, status)
+          counts["missing"] += 1
+      continue
+
+    finished_count += 1
+
+    if (event == "error"):
+      counts["failed"] += 1
+      rich_print(f"FAILED ON IMAGE \"{url}\": {value}", color=ANSI_BRIGHT_YELLOW)
+    elif (is_verbose or finished_count % 100 == 0):
+      rich_print(f"[{finished_count} / {len(pending_urls)}] {url}", color=ANSI_BRIGHT_BLUE)
+
+  crawler.close()
+  store.close()
+  exporter.close()
+
+  rich_print(f"Crawler: {crawler.stats}", color=ANSI_BRIGHT_CYAN)
+  rich_print(f"\n{metrics.summary_table()}", color=ANSI_BRIGHT_CYAN)
+  rich_print(f"\nStored {counts['stored']} new images ({get_size_displayable(stored_bytes)}), {counts['duplicates']} duplicates of stored images, {counts['missing']} missing, {counts['failed']} failed (retried next run).", color=ANSI_BRIGHT_GREEN)
+
+  return 0
+
+if __name__ == "__main__":
+  exit_code = main()
+  exit(exit_code)
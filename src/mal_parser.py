@@ -0,0 +1,213 @@
+import re
+from html_dom import parse_html
+
+RANKING_LINK_SELECTOR = ".anime_ranking_h3 > a.hoverinfo_trigger"
+RANKING_ROW_SELECTOR = "tr.ranking-list"
+# First line of a ranking row's information, e.g. "TV (28 eps)" or "ONA (? eps)"
+RANKING_TYPE_PATTERN = re.compile(r"^(.+?) \((\S+) eps?\)$")
+
+class ParseError(Exception):
+  pass
+
+class CaptchaError(ParseError):
+  pass
+
+class HttpStatusError(ParseError):
+  """A page that answered with another status than 200"""
+
+  def __init__(self, status, url):
+    super().__init__(f"HTTP {status} for \"{url}\"")
+    self.status = status
+
+def has_captcha(document) -> bool:
+  return bool(document.select_one("#captcha-container") or document.select_one(".amzn-captcha-modal"))
+
+def _required(document, selector, page_url):
+  node = document.select_one(selector)
+
+  if (node is None):
+    raise ParseError(f"Missing \"{selector}\" on \"{page_url}\"")
+
+  return node
+
+def image_url(img) -> str:
+  """Reads the real image url from a lazy loaded <img> without depending on it being rendered"""
+  if (img is None):
+    return ""
+
+  return img.get("data-src") or img.get("src") or ""
+
+# One extractor per field, so the benchmarks can time fields separately
+ANIME_FIELDS = {
+  "anime": lambda document, page_url: _required(document, ".title-name", page_url).text(),
+  "english_name": lambda document, page_url: _optional_text(document.select_one(".title-english")),
+  "cover": lambda document, page_url: image_url(document.select_one(".leftside img")),
+  "reviews": lambda document, page_url: _required(document, ".score", page_url).get("data-user", "").split(" ")[0],
+  "score": lambda document, page_url: _required(document, ".score-label", page_url).text(),
+  "ranking": lambda document, page_url: _required(document, ".numbers.ranked", page_url).text()[8:],
+  "popularity": lambda document, page_url: _required(document, ".numbers.popularity", page_url).text()[12:],
+  "members": lambda document, page_url: _required(document, ".numbers.members", page_url).text()[8:],
+  "synopsis": lambda document, page_url: _required(document, "p[itemprop=\"description\"]", page_url).text().replace("\n", " ").replace("[Written by MAL Rewrite]", ""),
+  "genres": lambda document, page_url: [e.text_content() for e in document.select("span[itemprop=\"genre\"]")]
+}
+
+REVIEW_FIELDS = {
+  "username": lambda review: _required_review_node(review, ".username > a").text(),
+  "updated": lambda review: _required_review_node(review, ".update_at").text(),
+  "verdict": lambda review: _required_review_node(review, ".tags > .tag:first-child").text(),
+  "text": lambda review: _required_review_node(review, ".text").text(skip_classes=("js-hidden",)),
+  "hidden": lambda review: _optional_text_content(review.select_one(".text .js-hidden")),
+  "avatar": lambda review: image_url(review.select_one(".thumb img"))
+}
+
+# Raw (string) fields of a ranking row. Rank, score and episodes can be "-", "N/A" or "?" for anime that haven't aired.
+RANKING_FIELDS = {
+  "anime_url": lambda row: _required_row_node(row, RANKING_LINK_SELECTOR).get("href"),
+  "anime": lambda row: _required_row_node(row, RANKING_LINK_SELECTOR).text(),
+  "rank": lambda row: _optional_text(row.select_one(".top-anime-rank-text")),
+  "score": lambda row: _optional_text(row.select_one(".score-label")),
+  "members": lambda row: next((line[:-len(" members")] for line in _ranking_information(row) if line.endswith(" members")), None),
+  "media_type": lambda row: _ranking_type(row, 1),
+  "episodes": lambda row: _ranking_type(row, 2),
+  "thumbnail": lambda row: image_url(row.select_one("td.title img"))
+}
+
+def _optional_text(node):
+  return node.text() if node else None
+
+def _optional_text_content(node):
+  return node.text_content() if node else None
+
+def _required_review_node(review, selector):
+  node = review.select_one(selector)
+
+  if (node is None):
+    raise ParseError("Incomplete review element")
+
+  return node
+
+def _required_row_node(row, selector):
+  node = row.select_one(selector)
+
+  if (node is None):
+    raise ParseError("Incomplete ranking row")
+
+  return node
+
+def _ranking_information(row) -> list[str]:
+  information = row.select_one(".information")
+  return information.text().split("\n") if information else []
+
+def _ranking_type(row, group):
+  lines = _ranking_information(row)
+  match = RANKING_TYPE_PATTERN.match(lines[0]) if lines else None
+  return match.group(group) if match else None
+
+def extract_anime_details(html: str, page_url: str) -> dict:
+  """Extracts the raw (string) anime detail fields from a server rendered anime page.
+
+  Mirrors the fields read through Selenium in mal_anime_scraper.scrape_details.
+  Raises ParseError when the page is a captcha or is missing a required field.
+  """
+  document = parse_html(html)
+
+  if (has_captcha(document)):
+    raise CaptchaError(f"Captcha detected on \"{page_url}\"")
+
+  return {name: extract(document, page_url) for name, extract in ANIME_FIELDS.items()}
+
+def extract_reviews(html: str) -> list[dict]:
+  """Extracts the raw fields of every review on a review page from a single page_source snapshot.
+
+  Returns dicts with the same keys as mal_comment_scraper.REVIEW_EXTRACTION_SCRIPT.
+  """
+  return _extract_reviews(parse_html(html))
+
+def review_elements(document):
+  return document.select(".review-element.js-review-element")
+
+def _extract_reviews(document):
+  return [{name: extract(review) for name, extract in REVIEW_FIELDS.items()} for review in review_elements(document)]
+
+def extract_review_page(html: str):
+  """Returns (anime name, review fields, next review page url or None) for a review page"""
+  document = parse_html(html)
+
+  if (has_captcha(document)):
+    raise CaptchaError("Captcha detected on review page")
+
+  more_reviews = document.select_one(".ga-click[data-ga-click-type=\"review-more-reviews\"]")
+
+  return (
+    _required(document, ".title-name", "review page").text(),
+    _extract_reviews(document),
+    more_reviews.get("href") if more_reviews else None
+  )
+
+def extract_ranking_links(html: str) -> list[tuple[str, str]]:
+  """Returns (anime url, anime name) for every entry of a topanime.php ranking page"""
+  document = parse_html(html)
+
+  if (has_captcha(document)):
+    raise CaptchaError("Captcha detected on ranking page")
+
+  return [(link.get("href"), link.text()) for link in document.select(RANKING_LINK_SELECTOR)]
+
+def ranking_rows(document):
+  return document.select(RANKING_ROW_SELECTOR)
+
+def extract_ranking_entries(html: str) -> list[dict]:
+  """Returns the raw fields (RANKING_FIELDS) of every entry of a topanime.php ranking page, all 50 from one page load"""
+  document = parse_html(html)
+
+  if (has_captcha(document)):
+    raise CaptchaError("Captcha detected on ranking page")
+
+  return [{name: extract(row) for name, extract in RANKING_FIELDS.items()} for row in ranking_rows(document)]
+
+def _label_key(label: str) -> str:
+  """Turns a row label like "Plan to Watch" or "Mean Score:" into plan_to_watch / mean_score"""
+  return label.strip().rstrip(":").strip().lower().replace(" ", "_").replace("-", "_")
+
+def _labeled_values(items, label_selector, value_selector) -> dict:
+  values = {}
+
+  for item in items:
+    label = item.select_one(label_selector)
+    value = item.select_one(value_selector)
+
+    if (label and value):
+      values[_label_key(label.text())] = value.text()
+
+  return values
+
+def extract_user_profile(html: str, page_url: str) -> dict:
+  """Extracts the raw (string) fields of a user profile page.
+
+  Returns the avatar, the labeled rows of the profile sidebar ("last_online", "joined",
+  "reviews", ...) under "status" and the anime list statistics under "anime_stats".
+  Rows a user hid or never filled in are simply missing.
+  """
+  document = parse_html(html)
+
+  if (has_captcha(document)):
+    raise CaptchaError(f"Captcha detected on \"{page_url}\"")
+
+  profile = _required(document, ".user-profile", page_url)
+  anime_stats = {}
+  stats = document.select_one(".stats.anime")
+
+  if (stats):
+    # "Days: 123.4" and "Mean Score: 7.92"
+    for score in stats.select(".stat-score > div"):
+      label, _, value = score.text().partition(":")
+      anime_stats[_label_key(label)] = value.strip()
+
+    anime_stats.update(_labeled_values(stats.select(".stats-status li"), "a", "span"))
+    anime_stats.update(_labeled_values(stats.select(".stats-data li"), "span.fl-l", "span.fl-r"))
+
+  return {
+    "avatar": image_url(profile.select_one(".user-image img")),
+    "status": _labeled_values(profile.select(".user-status li"), ".user-status-title", ".user-status-data"),
+    "anime_stats": anime_stats
+  }
@@ -0,0 +1,194 @@
+import os
+from util import *
+from functools import partial
+from json import load
+from sys import exit
+from argparse import ArgumentParser
+from browser import browser_options, BROWSER_PROFILES, DEFAULT_BROWSER_PROFILE, DEFAULT_TAB_COUNT
+from page_cache import PageCache, DEFAULT_CACHE_FOLDER, DEFAULT_CACHE_MAX_MB, read_cache_stats, format_cache_stats
+from pipeline import Stage, run_pipeline, DEFAULT_QUEUE_SIZE, DEFAULT_MAX_BACKLOG
+from metrics import metrics, MetricsExporter, DEFAULT_SNAPSHOT_INTERVAL
+from output import RecordWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+from storage import Database, DEFAULT_DATABASE_PATH
+from mal_comment_scraper import ReviewWorker, RankingLoader, iter_source_urls, DEFAULT_DISCOVERY_WORKER_COUNT, DEFAULT_ANIME_PAGE_URLS, DEFAULT_SCRAPE_LIMIT, DEFAULT_ANIME_PAGINATION_LIMIT, DEFAULT_REVIEW_PAGINATION_LIMIT, EXTRACTION_MODES, DEFAULT_EXTRACTION_MODE
+from mal_anime_scraper import AnimeDetailsWorker, ENGINES as DETAIL_ENGINES, DEFAULT_ENGINE as DEFAULT_DETAIL_ENGINE
+from mal_user_scraper import UserProfileWorker, profile_url
+from seen_set import DEFAULT_SEEN_SET_PATH, DEFAULT_TTL_DAYS, DAY
+from retry import RetryEngine, CircuitBreaker
+
+DEFAULT_OUTPUT_FOLDER = "temp/pipeline"
+DEFAULT_REVIEW_WORKER_COUNT = 4
+DEFAULT_DETAIL_WORKER_COUNT = 2
+# The only item of the discovery stage, its worker walks every source list itself
+DISCOVERY_ITEM = "ranking"
+
+class DiscoveryWorker:
+  """Reads the ranking pages (over HTTP, see RankingLoader) and yields every anime review url as soon as it's found"""
+
+  def __init__(self, options, source_list, scrape_limit, anime_pagination_limit, is_verbose, cache_folder=None, cache_max_bytes=None, worker_count=DEFAULT_DISCOVERY_WORKER_COUNT):
+    self.source_list = source_list
+    self.scrape_limit = scrape_limit
+    self.anime_pagination_limit = anime_pagination_limit
+    self.is_verbose = is_verbose
+    self.worker_count = worker_count
+    self.cache = PageCache(cache_folder, cache_max_bytes) if cache_folder else None
+    self.loader = RankingLoader(self.cache, options, is_verbose)
+
+  def process(self, item):
+    yield from iter_source_urls(self.loader, self.source_list, self.scrape_limit, self.anime_pagination_limit, self.is_verbose, self.worker_count)
+
+  def close(self):
+    self.loader.close()
+
+    if (self.cache):
+      self.cache.close()
+
+def route(stage_name, item, value):
+  """Feeds discovered anime to the review workers, and every anime and user seen in a review to the detail and user workers"""
+  if (stage_name == "discovery"):
+    return [("reviews", value)]
+
+  if (stage_name == "reviews" and value[0] == "record"):
+    return [("details", value[1]["page_url"]), ("users", value[1]["username"])]
+
+  return []
+
+def main():
+  parser = ArgumentParser(description="Runs ranking discovery, review scraping and anime detail scraping as one streaming pipeline. Anime and users are handed to the next stage as soon as they're found.")
+  parser.add_argument("-s", "--source-urls", help="A JSON file with the ranking page urls to discover anime from. Defaults to the top anime rankings.")
+  parser.add_argument("-l", "--scrape-limit", type=int, default=DEFAULT_SCRAPE_LIMIT, help=f"The max number of anime pages to scrape reviews from. The default value is {DEFAULT_SCRAPE_LIMIT}.")
+  parser.add_argument("-p", "--pagination-limit", type=int, default=DEFAULT_ANIME_PAGINATION_LIMIT, help=f"The number of ranking pages to read per source url. The default value is {DEFAULT_ANIME_PAGINATION_LIMIT}.")
+  parser.add_argument("-r", "--review-pagination-limit", type=int, default=DEFAULT_REVIEW_PAGINATION_LIMIT, help=f"The number of pages of reviews to scrape per anime. The default value is {DEFAULT_REVIEW_PAGINATION_LIMIT}.")
+  parser.add_argument("-x", "--extraction", choices=EXTRACTION_MODES, default=DEFAULT_EXTRACTION_MODE, help=f"How reviews are read from each page, see mal_comment_scraper.py. The default value is {DEFAULT_EXTRACTION_MODE}.")
+  parser.add_argument("-e", "--detail-engine", choices=[engine for engine in DETAIL_ENGINES if engine != "async"], default=DEFAULT_DETAIL_ENGINE, help=f"How anime pages are fetched by the detail workers, see mal_anime_scraper.py. The default value is {DEFAULT_DETAIL_ENGINE}.")
+  parser.add_argument("--discovery-workers", type=int, default=DEFAULT_DISCOVERY_WORKER_COUNT, help=f"Ranking pages the discovery worker loads at once. The default value is {DEFAULT_DISCOVERY_WORKER_COUNT}.")
+  parser.add_argument("--review-workers", type=int, default=DEFAULT_REVIEW_WORKER_COUNT, help=f"Browser processes scraping reviews. The default value is {DEFAULT_REVIEW_WORKER_COUNT}.")
+  parser.add_argument("--detail-workers", type=int, default=DEFAULT_DETAIL_WORKER_COUNT, help=f"Processes scraping anime details. The default value is {DEFAULT_DETAIL_WORKER_COUNT}.")
+  parser.add_argument("--user-workers", type=int, default=0, help="Processes scraping the profile of every reviewer, see mal_user_scraper.py. Profiles aren't scraped by default.")
+  parser.add_argument("--seen-set", default=DEFAULT_SEEN_SET_PATH, metavar="SEEN_SET_FILE", help=f"Seen-set of the user workers, shared with mal_user_scraper.py. The default value is {DEFAULT_SEEN_SET_PATH}.")
+  parser.add_argument("--ttl-days", type=float, default=DEFAULT_TTL_DAYS, help=f"Profiles scraped less than this many days ago are skipped. The default value is {DEFAULT_TTL_DAYS}.")
+  parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help=f"Max items queued for the workers of each stage. The default value is {DEFAULT_QUEUE_SIZE}.")
+  parser.add_argument("--max-backlog", type=int, default=DEFAULT_MAX_BACKLOG, help=f"A stage stops getting new items while the stages after it have more than this many items waiting, and no more results are read while any stage has this many. The default value is {DEFAULT_MAX_BACKLOG}.")
+  parser.add_argument("-o", "--output-folder", default=DEFAULT_OUTPUT_FOLDER, help=f"Where reviews, anime details and users are written (reviews.<format>, anime_details.<format>, users.<format> and user_profiles.<format> with --user-workers). The default value is {DEFAULT_OUTPUT_FOLDER}.")
+  parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT, help=f"Output file format. The default value is {DEFAULT_OUTPUT_FORMAT}.")
+  parser.add_argument("--database", nargs="?", const=DEFAULT_DATABASE_PATH, metavar="DATABASE_FILE", help=f"Also upserts reviews, anime details and users into the SQLite database (default file {DEFAULT_DATABASE_PATH}), see storage.py.")
+  parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_FOLDER, metavar="CACHE_FOLDER", help=f"Reads pages through the on-disk page cache (default folder {DEFAULT_CACHE_FOLDER}).")
+  parser.add_argument("--cache-max-size", type=int, default=DEFAULT_CACHE_MAX_MB, help=f"Size budget of the page cache in MB. The default value is {DEFAULT_CACHE_MAX_MB}.")
+  parser.add_argument("--browser-profile", choices=BROWSER_PROFILES, default=DEFAULT_BROWSER_PROFILE, help=f"Profile of every browser the pipeline starts. The default value is {DEFAULT_BROWSER_PROFILE}.")
+  parser.add_argument("--headless", action="store_true", help="Runs the browsers in headless mode.")
+  parser.add_argument("--tabs", type=int, default=DEFAULT_TAB_COUNT, help=f"Tabs per review and detail browser, which load the next pages of their queue in the background. Needs the lean browser profile. The default value is {DEFAULT_TAB_COUNT}.")
+  parser.add_argument("--metrics-file", metavar="FILE", help="Writes a JSON snapshot of the run's stage timings and per-worker counters to FILE every --metrics-interval seconds.")
+  parser.add_argument("--metrics-interval", type=float, default=DEFAULT_SNAPSHOT_INTERVAL, help=f"Seconds between metrics snapshots. The default value is {DEFAULT_SNAPSHOT_INTERVAL}.")
+  parser.add_argument("--metrics-port", type=int, metavar="PORT", help="Serves the metrics in Prometheus text format on http://127.0.0.1:PORT/metrics while the pipeline runs.")
+  parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output.")
+
+  args = parser.parse_args()
+  is_verbose = args.verbose
+  source_list = DEFAULT_ANIME_PAGE_URLS
+
+  if (args.source_urls):
+    if (not os.path.exists(args.source_urls)):
+      rich_print(f"Error: Source file \"{args.source_urls}\" not found.", color=ANSI_BRIGHT_RED)
+      return 1
+
+    with open(args.source_urls, "r") as f:
+      source_list = load(f)
+
+  if (is_verbose):
+    rich_print(f"{args}", color=ANSI_BRIGHT_PURPLE)
+
+  options = browser_options(args.browser_profile, args.headless)
+  cache_max_bytes = args.cache_max_size * 1024 * 1024
+  cache_stats_before = read_cache_stats(args.cache) if args.cache else None
+  backoff = CaptchaBackoff()
+  # One breaker for the whole site, one dead-letter file per stage
+  breaker = CircuitBreaker()
+  retries = {name: RetryEngine(breaker=breaker, dead_letter_path=f"{args.output_folder}/dead_letters_{name}.jsonl") for name in ["reviews", "details", "users"]}
+
+  stages = [
+    Stage("discovery", partial(DiscoveryWorker, options, source_list, args.scrape_limit, args.pagination_limit, is_verbose, args.cache, cache_max_bytes, args.discovery_workers), 1, args.queue_size),
+    Stage("reviews", partial(ReviewWorker, options=options, review_page_limit=args.review_pagination_limit, is_verbose=is_verbose, extraction_mode=args.extraction, backoff=backoff, cache_folder=args.cache, cache_max_bytes=cache_max_bytes, retry=retries["reviews"], tabs=args.tabs), args.review_workers, args.queue_size),
+    Stage("details", partial(AnimeDetailsWorker, is_verbose=is_verbose, engine=args.detail_engine, backoff=backoff, cache_folder=args.cache, cache_max_bytes=cache_max_bytes, browser_profile=args.browser_profile, retry=retries["details"], tabs=args.tabs), args.detail_workers, args.queue_size)
+  ]
+  outputs = ["reviews", "anime_details", "users"]
+
+  if (args.user_workers > 0):
+    stages.append(Stage("users", partial(UserProfileWorker, is_verbose=is_verbose, seen_set_path=args.seen_set, ttl=args.ttl_days * DAY, backoff=backoff, cache_folder=args.cache, cache_max_bytes=cache_max_bytes, retry=retries["users"]), args.user_workers, args.queue_size))
+    outputs.append("user_profiles")
+
+  os.makedirs(args.output_folder, exist_ok=True)
+  writers = {name: RecordWriter(f"{args.output_folder}/{name}.{args.format}", args.format) for name in outputs}
+  database = Database(args.database) if args.database else None
+  seen_usernames = set()
+  counts = {"discovery": 0, "reviews": 0, "details": 0, "users": 0}
+  exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_interval, args.metrics_port)
+
+  rich_print(f"Starting pipeline: 1 discovery worker, {args.review_workers} review workers, {args.detail_workers} detail workers, {args.user_workers} user workers.", color=ANSI_BRIGHT_BLUE)
+
+  for stage_name, event, item, value in run_pipeline(stages, [("discovery", DISCOVERY_ITEM)], route, args.max_backlog):
+    if (event == "error"):
+      rich_print(f"[{stage_name}] FAILED ON \"{item}\": {value}", color=ANSI_BRIGHT_RED)
+      continue
+
+    if (event == "done"):
+      counts[stage_name] += 1
+
+      if (stage_name == "reviews"):
+        rich_print(f"[reviews] Finished \"{item}\" ({counts['reviews']} / {counts['discovery']} discovered)", color=ANSI_BRIGHT_BLUE)
+      continue
+
+    if (stage_name == "discovery"):
+      counts["discovery"] += 1
+    elif (stage_name == "reviews" and value[0] == "record"):
+      review = value[1]
+
+      with metrics.time("serialization"):
+        writers["reviews"].write(review)
+
+        if (database):
+          database.write("reviews", review)
+
+        # Every reviewer once, their profiles come from the user workers or mal_user_scraper.py
+        if (review["username"] not in seen_usernames):
+          seen_usernames.add(review["username"])
+          user = {"username": review["username"], "profile_url": profile_url(review["username"]), "avatar": review["avatar"]}
+          writers["users"].write(user)
+
+          if (database):
+            database.write("users", user)
+    elif (stage_name == "details"):
+      with metrics.time("serialization"):
+        writers["anime_details"].write(value)
+
+        if (database):
+          database.write("anime", value)
+
+      rich_print(f"[details] {value['anime']} ({value['score']} @ {value['reviews']} reviews) #{value['ranking']}", color=ANSI_BRIGHT_BLUE, bold=True)
+    elif (stage_name == "users"):
+      with metrics.time("serialization"):
+        writers["user_profiles"].write(value)
+
+        if (database):
+          database.write("users", value)
+
+  with metrics.time("serialization"):
+    sizes = {name: writer.close() for name, writer in writers.items()}
+
+    if (database):
+      database.close()
+
+  exporter.close()
+
+  if (args.cache):
+    rich_print(format_cache_stats(cache_stats_before, read_cache_stats(args.cache)), color=ANSI_BRIGHT_CYAN)
+
+  rich_print(f"\n{metrics.summary_table()}", color=ANSI_BRIGHT_CYAN)
+
+  for name, writer in writers.items():
+    rich_print(f"Exported {name}.{args.format} ({writer.count} records, Size {get_size_displayable(sizes[name])})", color=ANSI_BRIGHT_GREEN)
+
+  return 0
+
+if __name__ == "__main__":
+  exit_code = main()
+  exit(exit_code)
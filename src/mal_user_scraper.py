@@ -1,320 +1,327 @@
 import os
+import asyncio
 from util import *
-from selenium import webdriver
-from datetime import datetime
-from multiprocessing import Pool
 from functools import partial
-from json import dumps, dump, load
+from json import load
 from sys import exit
 from argparse import ArgumentParser
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-
-REPLACE_NEWLINES_WITH_SPACES = True
-STATE_FOLDER = "temp/review_scraper"
-DEFAULT_ANIME_PAGINATION_LIMIT = 4
-DEFAULT_SCRAPE_LIMIT = 200
-DEFAULT_REVIEW_PAGINATION_LIMIT = 2
-MAX_WORKER_COUNT = 4
-SIZE_DECIMAL_COUNT = 2
-MAX_RETRY_COUNT = 3
-
-RECOMMENDATION_SCORES = {
-    "Recommended": 3,
-    "Mixed Feelings": 2,
-    "Not Recommended": 1
-}
-
-MONTHS_TO_INDICES = [
-    "Jan",
-    "Feb",
-    "Mar",
-    "Apr",
-    "May",
-    "Jun",
-    "Jul",
-    "Aug",
-    "Sep",
-    "Oct",
-    "Nov",
-    "Dec"
-]
-
-DEFAULT_ANIME_PAGE_URLS = [
-   "https://myanimelist.net/topanime.php?type=tv",
-   "https://myanimelist.net/topanime.php",
-   "https://myanimelist.net/topanime.php?type=bypopularity"
-]
-
-def create_state_folder():
-   if (not os.path.exists("temp")):
-      os.makedirs("temp")
-
-   folder_name = f"{STATE_FOLDER}/state_{formatted_timestamp()}"
-   os.makedirs(folder_name, exist_ok=True)
-
-   return folder_name
-
-def save_urls(state_folder_name, urls):
-   state_name = f"{state_folder_name}/urls.json"
-   
-   with open(state_name, "w") as f:
-      dump(urls, f)
-
-   return state_name
-
-def to_timestamp(s: str):
-    date_split = s.replace(",", "").split(" ")
-    month = date_split[0]
-    day = date_split[1]
-    year = date_split[2]
-
-    month_index = MONTHS_TO_INDICES.index(month) + 1
-
-    return (int(year), month_index, int(day))
-
-def load_source_urls(driver, source_list: list[str], scrape_limit: int, anime_pagination_limit, is_verbose: bool):
-  source_wait = WebDriverWait(driver, 8)
-  anime_pages_checked = set()
-  anime_pages = []
-
-  for page in source_list:
-    if (len(anime_pages) >= scrape_limit):
-      rich_print(f"Reached scrape limit ({scrape_limit}). Skipping...", color=ANSI_BRIGHT_YELLOW)
-      break
+from urllib.parse import quote
+from http_fetch import HttpFetcher
+from mal_parser import CaptchaError, HttpStatusError, extract_user_profile
+from work_queue import run_work_queue
+from metrics import metrics, MetricsExporter, DEFAULT_SNAPSHOT_INTERVAL
+from crawler import AsyncCrawler, DEFAULT_CONCURRENCY, DEFAULT_RATE, DEFAULT_BURST
+from comment_reader import iter_records
+from seen_set import SeenSet, DEFAULT_SEEN_SET_PATH, DEFAULT_TTL_DAYS, DAY
+from page_cache import PageCache, DEFAULT_CACHE_FOLDER, DEFAULT_CACHE_MAX_MB, read_cache_stats, format_cache_stats
+from output import RecordWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+from storage import Database, DEFAULT_DATABASE_PATH
+from records import UserProfile, PROFILE_FIELDS, PROFILE_COUNT_FIELDS, ANIME_STAT_FIELDS
+from retry import RetryEngine, CircuitBreaker
+
+PROFILE_URL = "https://myanimelist.net/profile/{}"
+DEFAULT_WORKER_COUNT = 4
+DEAD_LETTERS_FILE = "temp/user_scraper/dead_letters.jsonl"
+ENGINES = ["http", "async"]
+DEFAULT_ENGINE = "http"
+STORE_NUMBERS_AS_STRINGS = False
+FLOAT_STAT_FIELDS = ["days", "mean_score"]
+
+class ProfileNotFound(Exception):
+  pass
+
+def profile_url(username: str) -> str:
+  return PROFILE_URL.format(quote(username))
+
+def to_number(value, is_float=False):
+  if (value is None or STORE_NUMBERS_AS_STRINGS):
+    return value
+
+  value = value.replace(",", "")
+
+  try:
+    return float(value) if is_float else int(value)
+  except ValueError:
+    return None
+
+def build_user_record(username, profile):
+  status = profile["status"]
+  anime_stats = profile["anime_stats"]
+
+  return UserProfile(
+    username=username,
+    profile_url=profile_url(username),
+    avatar=profile["avatar"],
+    **{name: status.get(name) for name in PROFILE_FIELDS},
+    **{name: to_number(status.get(name)) for name in PROFILE_COUNT_FIELDS},
+    anime_stats={name: to_number(anime_stats.get(name), name in FLOAT_STAT_FIELDS) for name in ANIME_STAT_FIELDS}
+  )
+
+def parse_profile_response(response, username):
+  url = profile_url(username)
+
+  if (response.status == 404):
+    raise ProfileNotFound(f"No profile for \"{username}\"")
+
+  if (response.status != 200):
+    raise HttpStatusError(response.status, url)
+
+  with metrics.time("extraction"):
+    return extract_user_profile(response.text, url)
+
+def iter_usernames(paths):
+  """Unique usernames of comment exports or user lists (pipeline users files), in order of first appearance"""
+  seen_usernames = set()
+
+  for path in paths:
+    for record in iter_records(path):
+      username = record["username"] if isinstance(record, dict) else record
+
+      if (username not in seen_usernames):
+        seen_usernames.add(username)
+        yield username
+
+class UserProfileWorker:
+  """Scrapes user profiles over HTTP for one work queue process.
+
+  Usernames already in the seen-set within its TTL are skipped without a request, every
+  scraped (or deleted) profile is added to it, so a user is fetched once per TTL no matter
+  how many reviews, runs or pipeline stages they show up in.
+  """
+
+  def __init__(self, is_verbose: bool, seen_set_path=DEFAULT_SEEN_SET_PATH, ttl=DEFAULT_TTL_DAYS * DAY, backoff=None, cache_folder=None, cache_max_bytes=None, retry=None):
+    self.is_verbose = is_verbose
+    self.backoff = backoff
+    self.retry = retry or RetryEngine()
+    self.seen = SeenSet(seen_set_path, ttl)
+    self.cache = PageCache(cache_folder, cache_max_bytes) if cache_folder else None
+    self.fetcher = HttpFetcher(cache=self.cache)
+
+  def scrape_profile(self, username):
+    if (self.backoff):
+      self.backoff.wait()
+
+    with metrics.time("navigation"):
+      response = self.fetcher.get(profile_url(username))
+
+    try:
+      profile = parse_profile_response(response, username)
+    except Exception as e:
+      if (self.cache):
+        self.cache.invalidate(profile_url(username))
+
+      if (isinstance(e, CaptchaError)):
+        metrics.count("captchas")
+
+        if (self.backoff):
+          delay = self.backoff.trigger()
+          rich_print(f"Captcha served for \"{username}\". Pausing all workers for {delay}s...", color=ANSI_BRIGHT_YELLOW)
+
+      raise
+
+    if (self.backoff):
+      self.backoff.reset()
+
+    return profile
+
+  def process(self, username):
+    if (self.seen.is_fresh(username)):
+      return
+
+    attempts = self.retry.begin(username, profile_url(username))
+
+    while (True):
+      self.retry.wait()
 
-    driver.get(page)
-    source_wait.until(EC.url_to_be(page))
-
-    for j in range(anime_pagination_limit):
-      page_link_elements = driver.find_elements(By.CSS_SELECTOR, ".anime_ranking_h3 > a.hoverinfo_trigger")
-      
-      for link_element in page_link_elements:
-        page_link = link_element.get_attribute("href")
-
-        if (page_link in anime_pages_checked):
-          continue
-      
-        if (len(anime_pages) >= scrape_limit):
-          rich_print(f"Reached scrape limit ({scrape_limit}). Skipping {page_link}...", color=ANSI_BRIGHT_YELLOW)
-          break
-        
-        anime_name = link_element.text
-        
-        anime_pages_checked.add(page_link)
-        anime_pages.append(page_link + "/reviews")
-
-        if (is_verbose):
-          print(f"Adding anime page: \"{anime_name}\" ({page_link}) ({len(anime_pages)} / {scrape_limit})")
-        else:
-          print(f"Adding anime page: \"{anime_name}\" ({len(anime_pages)} / {scrape_limit})")
-      
-      cookies_prompt = driver.find_elements(By.CSS_SELECTOR, "#accept-btn")
-
-      if (cookies_prompt):
-        print("FOUND THAT PIECE OF SHIT COOKIES PROMPT. NUKING...")
-        cookies_prompt[0].click()
-        source_wait.until(EC.staleness_of(cookies_prompt[0]))
-      
-      if (j < anime_pagination_limit - 1):
-        new_offset = 50 * (j + 1)
-        new_url = page
-
-        if ("?" in new_url):
-          new_url += f"&limit={new_offset}"
-        else:
-          new_url += f"?limit={new_offset}"
-
-        if (is_verbose):
-          rich_print(f"Going to page offset {new_offset}. New URL is \"{new_url}\"", color=ANSI_BRIGHT_PURPLE)
-        
-        driver.get(new_url)
-        source_wait.until(EC.url_to_be(new_url))
-    
-  return anime_pages
-
-def scrape_pages(anime_pages, options, review_page_limit, is_verbose):
-  driver = webdriver.Firefox(options=options)
-  page_wait = WebDriverWait(driver, 10)
-
-  scraped_reviews = []
-  cursor = 0
-
-  while (cursor < len(anime_pages)):
-    page_url = anime_pages[cursor]
-
-    driver.get(page_url)
-    page_wait.until(EC.url_to_be(page_url))
-
-    check_captcha(driver)
-
-    retry_count = 0
-    anime_name = page_wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".title-name"))).text
-    page_url = driver.current_url.rstrip("reviews")
-
-    print(f"\n [{cursor+1} / {len(anime_pages)}] Checking reviews for anime page \"{anime_name}\"\n")
-
-    for j in range(review_page_limit):
       try:
-        check_captcha(driver)
-
-        first_comment = page_wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".review-element.js-review-element")))
-        all_comments = first_comment.find_elements(By.XPATH, "following-sibling::*[contains(@class, 'review-element') and contains(@class, 'js-review-element')]")
-        comments = [first_comment, *all_comments]
-
-        rich_print(f"Found {len(comments)} comments for {anime_name} (page {j+1})", color=ANSI_YELLOW)
-
-        for comment_idx, comment in enumerate(comments):
-            username = comment.find_element(By.CSS_SELECTOR, ".username > a").text
-            timestamp = to_timestamp(comment.find_element(By.CLASS_NAME, "update_at").text)
-            recommendation_verdict = comment.find_element(By.CSS_SELECTOR, ".tags > .tag:first-child").text
-            review_content = comment.find_element(By.CSS_SELECTOR, ".text")
-            review_content_rest = review_content.find_elements(By.CSS_SELECTOR, ".js-hidden")
-            user_profile_picture = comment.find_element(By.CSS_SELECTOR, ".thumb img.lazyloaded").get_attribute("src")
-
-            review_text = review_content.text[:-3]
-
-            if (review_content_rest):
-              review_text += review_content_rest[0].get_attribute("textContent")
-              
-            if (REPLACE_NEWLINES_WITH_SPACES):
-              review_text = review_text.replace("\n", " ")
-            
-            preview_content = ' '.join(review_text.split(" ")[:10]).replace("\n", "")
-            
-            print(f"{ANSI_BRIGHT_GREEN}{anime_name} {ANSI_BRIGHT_BLUE}[{comment_idx + 1} / {len(comments)}]{ANSI_DEFAULT} {username} ({recommendation_verdict}): \"{preview_content + (len(preview_content) < len(review_text) and "..." or "")}\"")
-
-            scraped_reviews.append({
-              'page_url': page_url,
-              'anime': anime_name,
-              'username': username,
-              'avatar': user_profile_picture,
-              'timestamp': int(datetime(timestamp[0], timestamp[1], timestamp[2]).timestamp()),
-              'feelings': RECOMMENDATION_SCORES[recommendation_verdict],
-              'review_text': review_text
-            })
+        profile = self.scrape_profile(username)
+        break
+      except ProfileNotFound:
+        # Deleted or renamed accounts aren't requested again before the TTL is over
+        self.seen.add(username, "missing")
+        metrics.count("skips")
+
+        if (self.is_verbose):
+          rich_print(f"NO PROFILE FOR \"{username}\". Skipping...", color=ANSI_BRIGHT_YELLOW)
+        return
       except Exception as e:
-        retry_count += 1
-
-        if (retry_count > MAX_RETRY_COUNT):
-          print(f"RETRY COUNT EXCEEDED FOR PAGE \"{page_url}\". Skipping...")
-          break
-          
-        if (is_verbose):
-          rich_print(f"\nERROR WHILE TRYING TO SCRAPE \"{page_url}\". Error: {e}. Retrying ({retry_count} / {MAX_RETRY_COUNT})...\n", color=ANSI_BRIGHT_RED)
-        else:
-          rich_print(f"ERROR WHILE TRYING TO SCRAPE \"{page_url}\". Retrying ({retry_count} / {MAX_RETRY_COUNT})...", color=ANSI_BRIGHT_RED)
-        continue
-
-      if (j < review_page_limit - 1):
-        more_reviews_btn = driver.find_elements(By.CSS_SELECTOR, ".ga-click[data-ga-click-type=\"review-more-reviews\"]")
-
-        if (not more_reviews_btn):
-          rich_print(f"No next page for reviews found. Going to the next entry.", color=ANSI_BRIGHT_YELLOW)
-          break
-
-        next_page_url = more_reviews_btn[0].get_attribute("href")
-
-        rich_print(f"Going to page {next_page_url}", color=ANSI_BRIGHT_YELLOW)
-
-        driver.get(next_page_url)
-        WebDriverWait(driver, 10).until(EC.url_to_be(next_page_url))
-    
-    cursor += 1
-    
-  driver.quit()
-  return scraped_reviews
-    
+        delay = attempts.failed(e)
+
+        if (self.is_verbose):
+          rich_print(f"ERROR FACED WHILE PARSING \"{username}\" ({attempts.kind}): \"{e}\". Retrying in {delay:.1f}s...", color=ANSI_BRIGHT_YELLOW)
+
+        sleep(delay)
+
+    self.retry.succeeded()
+    self.seen.add(username)
+    metrics.count("pages")
+    metrics.count("records")
+    yield build_user_record(username, profile)
+
+  def close(self):
+    self.fetcher.close()
+    self.seen.close()
+    self.retry.close()
+
+    if (self.cache):
+      self.cache.close()
+
+async def crawl_user_profile(crawler, username, seen, is_verbose=False, retry=None):
+  """Async crawler handler for one user profile, marks it in seen like UserProfileWorker"""
+  attempts = (retry or RetryEngine()).begin(username, profile_url(username))
+
+  while (True):
+    try:
+      response = await crawler.fetch(profile_url(username))
+      profile = parse_profile_response(response, username)
+      break
+    except ProfileNotFound:
+      seen.add(username, "missing")
+      metrics.count("skips")
+      return
+    except Exception as e:
+      if (isinstance(e, CaptchaError)):
+        metrics.count("captchas")
+        rich_print(f"Captcha served for \"{username}\". Pausing requests to the site for {CAPTCHA_BACKOFF_SECONDS}s...", color=ANSI_BRIGHT_YELLOW)
+        crawler.pause_host(profile_url(username), CAPTCHA_BACKOFF_SECONDS)
+
+      if (crawler.fetcher.cache):
+        crawler.fetcher.cache.invalidate(profile_url(username))
+
+      delay = attempts.failed(e)
+
+      if (attempts.engine.remaining()):
+        crawler.pause_host(profile_url(username), attempts.engine.remaining())
+
+      if (is_verbose):
+        rich_print(f"ERROR FACED WHILE PARSING \"{username}\" ({attempts.kind}): \"{e}\". Retrying in {delay:.1f}s...", color=ANSI_BRIGHT_YELLOW)
+
+      await asyncio.sleep(delay)
+
+  attempts.engine.succeeded()
+  seen.add(username)
+  metrics.count("pages")
+  metrics.count("records")
+  yield build_user_record(username, profile)
+
 def main():
-  parser = ArgumentParser(description="Scrapes the comments from MyAnimeList from a list of source urls using Selenium.", epilog="[TEST]")
-  parser.add_argument("-s", "--source-urls", help="The source urls file to scrape anime pages from.")
+  parser = ArgumentParser(description="Scrapes the profiles of every user found in comment scraper exports or pipeline users files. Every user is fetched once, and profiles scraped within the TTL are skipped on later runs.")
+  parser.add_argument("input_files", nargs="*", help="Comment scraper exports (JSON, JSON Lines, parquet or npz) or users files of mal_pipeline.py to read the usernames from.")
+  parser.add_argument("-u", "--usernames", help="An optional JSON file with a list of usernames to scrape, read after the input files.")
   parser.add_argument("-o", "--output", required=True, help="Output file path.")
-  parser.add_argument("-t", "--target-urls", help="An optional exported file of MAL anime pages to scrape. Will automatically append /reviews to the anime pages if it doesn't end like so. Overrides --source_urls.")
-  parser.add_argument("-l", "--scrape-limit", type=int, default=DEFAULT_SCRAPE_LIMIT, help=f"The max number of anime pages to scrape. All other pages are skipped. The default value is {DEFAULT_SCRAPE_LIMIT}.")
-  parser.add_argument("-p", "--pagination-limit", type=int, default=DEFAULT_ANIME_PAGINATION_LIMIT, help=f"The number of pages of anime urls to scrape from the source urls. The default value is {DEFAULT_ANIME_PAGINATION_LIMIT}.")
-  parser.add_argument("-r", "--review-pagination-limit", type=int, default=DEFAULT_REVIEW_PAGINATION_LIMIT, help=f"The number of pages of reviews to scrape from the anime pages. The default value is {DEFAULT_REVIEW_PAGINATION_LIMIT}.")
-  parser.add_argument("--headless", action="store_true", help="Runs the browser in headless mode.")
+  parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT, help=f"Output file format. \"json\" is a pretty-printed array and \"jsonl\" has one record per line. The default value is {DEFAULT_OUTPUT_FORMAT}.")
+  parser.add_argument("-e", "--engine", choices=ENGINES, default=DEFAULT_ENGINE, help=f"How profiles are fetched. \"http\" runs -w worker processes with keep-alive connections, \"async\" uses the asyncio crawler (--concurrency, --rate, --burst). The default value is {DEFAULT_ENGINE}.")
+  parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKER_COUNT, help=f"The number of worker processes with the http engine. The default value is {DEFAULT_WORKER_COUNT}.")
+  parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help=f"Max requests in flight with the async engine. The default value is {DEFAULT_CONCURRENCY}.")
+  parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help=f"Average requests per second per host with the async engine. The default value is {DEFAULT_RATE}.")
+  parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help=f"Max requests per host sent at once with the async engine. The default value is {DEFAULT_BURST}.")
+  parser.add_argument("--seen-set", default=DEFAULT_SEEN_SET_PATH, metavar="SEEN_SET_FILE", help=f"Where the scraped usernames and their scrape times are kept between runs. The default value is {DEFAULT_SEEN_SET_PATH}.")
+  parser.add_argument("--ttl-days", type=float, default=DEFAULT_TTL_DAYS, help=f"Profiles scraped less than this many days ago are skipped. The default value is {DEFAULT_TTL_DAYS}.")
+  parser.add_argument("--force", action="store_true", help="Scrapes every profile again, ignoring the seen-set (it's still updated).")
+  parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_FOLDER, metavar="CACHE_FOLDER", help=f"Reads profile pages through the on-disk page cache (default folder {DEFAULT_CACHE_FOLDER}).")
+  parser.add_argument("--cache-max-size", type=int, default=DEFAULT_CACHE_MAX_MB, help=f"Size budget of the page cache in MB. The default value is {DEFAULT_CACHE_MAX_MB}.")
+  parser.add_argument("--dead-letters", default=DEAD_LETTERS_FILE, metavar="DEAD_LETTER_FILE", help=f"Usernames whose profile ran out of retries are appended to this JSON Lines file. \"python retry.py DEAD_LETTER_FILE\" turns it into a list for -u. The default value is {DEAD_LETTERS_FILE}.")
+  parser.add_argument("--database", nargs="?", const=DEFAULT_DATABASE_PATH, metavar="DATABASE_FILE", help=f"Also upserts every profile into the users table of the SQLite database (default file {DEFAULT_DATABASE_PATH}), see storage.py.")
+  parser.add_argument("--metrics-file", metavar="FILE", help="Writes a JSON snapshot of the run's stage timings and per-worker counters to FILE every --metrics-interval seconds.")
+  parser.add_argument("--metrics-interval", type=float, default=DEFAULT_SNAPSHOT_INTERVAL, help=f"Seconds between metrics snapshots. The default value is {DEFAULT_SNAPSHOT_INTERVAL}.")
+  parser.add_argument("--metrics-port", type=int, metavar="PORT", help="Serves the metrics in Prometheus text format on http://127.0.0.1:PORT/metrics while the scraper runs.")
   parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output.")
 
   args = parser.parse_args()
   is_verbose = args.verbose
 
-  options = Options()
-  options.add_argument("--width=1280")
-  options.add_argument("--height=800")
+  if (not args.input_files and not args.usernames):
+    rich_print("Error: No input files or username list (-u) specified.", color=ANSI_BRIGHT_RED)
+    return 1
 
-  if (args.headless):
-    options.add_argument("--headless")
+  for path in [*args.input_files, *([args.usernames] if args.usernames else [])]:
+    if (not os.path.exists(path)):
+      rich_print(f"Error: Input file \"{path}\" not found.", color=ANSI_BRIGHT_RED)
+      return 1
 
   if (is_verbose):
     rich_print(f"{args}", color=ANSI_BRIGHT_PURPLE)
 
-  anime_pages = []
+  usernames = list(iter_usernames(args.input_files))
 
-  if (args.target_urls):
-    if (not os.path.exists(args.target_urls)):
-      rich_print(f"Error: Target file \"{args.target_urls}\" not found.", color=ANSI_BRIGHT_RED)
-      return 1
+  if (args.usernames):
+    with open(args.usernames, "r", encoding="utf-8") as f:
+      known_usernames = set(usernames)
+      usernames += [username for username in dict.fromkeys(load(f)) if username not in known_usernames]
 
-    if (is_verbose):
-      rich_print(f"Loading target-urls {args.target_urls}", color=ANSI_BRIGHT_PURPLE)
-
-    with open(args.target_urls, "r") as f:
-      anime_pages = load(f)
-    
-    for i, page in enumerate(anime_pages):
-      if (not page.endswith("/reviews")):
-        anime_pages[i] = page.rstrip("/") + "/reviews"
-    
-    if (is_verbose):
-      rich_print(f"Loaded target-urls: {anime_pages}", color=ANSI_BRIGHT_PURPLE)
-        
+  ttl = 0 if args.force else args.ttl_days * DAY
+  seen = SeenSet(args.seen_set, ttl)
+  fresh_usernames = seen.fresh(usernames)
+  pending_usernames = [username for username in usernames if username not in fresh_usernames]
+
+  rich_print(f"FOUND {len(usernames)} unique users, {len(fresh_usernames)} scraped in the last {args.ttl_days:g} days. {len(pending_usernames)} left to scrape.", color=ANSI_BRIGHT_BLUE)
+
+  cache_max_bytes = args.cache_max_size * 1024 * 1024
+  cache_stats_before = read_cache_stats(args.cache) if args.cache else None
+  writer = RecordWriter(args.output, args.format)
+  database = Database(args.database) if args.database else None
+  crawler = None
+  retry = RetryEngine(breaker=CircuitBreaker(), dead_letter_path=args.dead_letters)
+  failed_count = 0
+
+  if (args.engine == "async"):
+    crawler = AsyncCrawler(args.concurrency, args.rate, args.burst, PageCache(args.cache, cache_max_bytes) if args.cache else None)
+    events = crawler.run(pending_usernames, partial(crawl_user_profile, seen=seen, is_verbose=is_verbose, retry=retry))
   else:
-    url_list = DEFAULT_ANIME_PAGE_URLS
-    driver = webdriver.Firefox(options=options)
-    
-    if (is_verbose):
-      if (args.source_urls):
-        rich_print(f"Loading source-urls from file {args.source_urls}", color=ANSI_BRIGHT_PURPLE)
-      else:
-        rich_print(f"Loading default source-urls list: {url_list}", color=ANSI_BRIGHT_PURPLE)
-
-    if (args.source_urls and os.path.exists(args.source_urls)):
-      with open(args.source_urls, "r") as f:
-        url_list = load(f)
+    worker_factory = partial(UserProfileWorker, is_verbose=is_verbose, seen_set_path=args.seen_set, ttl=ttl, backoff=CaptchaBackoff(), cache_folder=args.cache, cache_max_bytes=cache_max_bytes, retry=retry)
+    events = run_work_queue(pending_usernames, worker_factory, args.workers)
 
-      if (is_verbose):
-        rich_print(f"Loaded source-urls {url_list}", color=ANSI_BRIGHT_PURPLE)
-      
-    anime_pages = load_source_urls(driver, url_list, args.scrape_limit, args.pagination_limit, is_verbose)
-    driver.quit()
+  exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_interval, args.metrics_port)
+  finished_count = 0
+
+  for event, username, value in events:
+    if (event == "result"):
+      with metrics.time("serialization"):
+        writer.write(value)
 
-  rich_print(f"FOUND {len(anime_pages)} anime pages. Starting scrape...", color=ANSI_BRIGHT_BLUE)
+        if (database):
+          database.write("users", value)
 
-  # cursor = 0
-  # review_page_limit = args.review_pagination_limit
-  scraped_reviews = []
-  func = partial(scrape_pages, options=options, review_page_limit=args.review_pagination_limit, is_verbose=is_verbose)
-  chunks = chunkify(anime_pages, MAX_WORKER_COUNT)
+      rich_print(f"[{finished_count + 1} / {len(pending_usernames)}] {username} ({value['anime_stats']['total_entries']} entries, {value['reviews']} reviews)", color=ANSI_BRIGHT_BLUE, bold=True)
+      continue
 
-  with Pool(MAX_WORKER_COUNT) as pool:
-    chunks_scraped = pool.map(func, chunks)
-    scraped_reviews = [comment for chunk in chunks_scraped for comment in chunk]
+    finished_count += 1
+
+    if (event == "error"):
+      failed_count += 1
+      rich_print(f"FAILED ON USER \"{username}\": {value}", color=ANSI_BRIGHT_YELLOW)
+
+  seen.close()
+  retry.close()
+
+  if (failed_count):
+    rich_print(f"{failed_count} profiles failed, see {args.dead_letters}.", color=ANSI_BRIGHT_YELLOW)
+
+  if (crawler):
+    crawler.close()
+
+    if (crawler.fetcher.cache):
+      crawler.fetcher.cache.close()
+
+    rich_print(f"Crawler: {crawler.stats}", color=ANSI_BRIGHT_CYAN)
+
+  if (args.cache):
+    rich_print(format_cache_stats(cache_stats_before, read_cache_stats(args.cache)), color=ANSI_BRIGHT_CYAN)
 
-  rich_print("\nExporting...", color=ANSI_BRIGHT_YELLOW)
-  
   output_file_name = os.path.basename(args.output)
-  serialized_json = dumps(scraped_reviews, indent=2)
-  size_bytes = len(serialized_json)
 
-  with open(args.output, "w") as f:
-    f.write(serialized_json)
-    rich_print(f"\nExported {output_file_name} (Size {get_size_displayable(size_bytes)})", color=ANSI_BRIGHT_GREEN)
-  
+  with metrics.time("serialization"):
+    size_bytes = writer.close()
+
+    if (database):
+      database.close()
+
+  exporter.close()
+  rich_print(f"\n{metrics.summary_table()}", color=ANSI_BRIGHT_CYAN)
+  rich_print(f"\nExported {output_file_name} ({writer.count} profiles, Size {get_size_displayable(size_bytes)})", color=ANSI_BRIGHT_GREEN)
+
   return 0
 
 if __name__ == "__main__":
   exit_code = main()
-  exit(exit_code)
\ No newline at end of file
+  exit(exit_code)
@@ -0,0 +1,265 @@
+import os
+from bisect import bisect_left
+from contextlib import contextmanager
+from json import dump
+from threading import Lock, Thread, Event
+from time import perf_counter, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+METRIC_PREFIX = "mal_scraper"
+DEFAULT_SNAPSHOT_INTERVAL = 10
+STAGES = ["navigation", "wait", "captcha", "extraction", "serialization"]
+COUNTERS = ["pages", "records", "retries", "captchas", "skips", "errors", "restarts", "prefetches"]
+# Upper bounds (seconds) of the stage histogram buckets, Prometheus style
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+MAIN_WORKER = "main"
+
+class Histogram:
+  __slots__ = ("counts", "count", "sum", "max")
+
+  def __init__(self):
+    # The last bucket counts everything above LATENCY_BUCKETS[-1]
+    self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def observe(self, seconds):
+    self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    self.count += 1
+    self.sum += seconds
+    self.max = max(self.max, seconds)
+
+  def merge(self, other):
+    for i, count in enumerate(other["counts"]):
+      self.counts[i] += count
+
+    self.count += other["count"]
+    self.sum += other["sum"]
+    self.max = max(self.max, other["max"])
+
+  def percentile(self, p):
+    """Estimated by interpolating inside the bucket the percentile falls in"""
+    if (not self.count):
+      return 0.0
+
+    rank = self.count * p / 100
+    seen = 0
+
+    for i, count in enumerate(self.counts):
+      if (count and seen + count >= rank):
+        lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+        upper = LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.max
+        return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+
+      seen += count
+
+    return self.max
+
+  def to_dict(self):
+    return {"counts": list(self.counts), "count": self.count, "sum": self.sum, "max": self.max}
+
+class Metrics:
+  """Per-stage timing histograms and per-worker counters of one scraper run.
+
+  Every process records into its own module level `metrics`. Work queue processes
+  send what they recorded to the parent after every item (drain/merge), so the
+  parent's registry always holds the whole run. Safe to use from several threads.
+  """
+
+  def __init__(self):
+    self.lock = Lock()
+    self.reset()
+
+  def reset(self, worker=MAIN_WORKER):
+    with self.lock:
+      self.worker = worker
+      self.started = time()
+      self.histograms = {stage: Histogram() for stage in STAGES}
+      self.counters = {}
+
+  def observe(self, stage, seconds):
+    with self.lock:
+      if (stage not in self.histograms):
+        self.histograms[stage] = Histogram()
+
+      self.histograms[stage].observe(seconds)
+
+  @contextmanager
+  def time(self, stage):
+    started = perf_counter()
+
+    try:
+      yield
+    finally:
+      self.observe(stage, perf_counter() - started)
+
+  def count(self, name, n=1):
+    with self.lock:
+      worker_counters = self.counters.setdefault(self.worker, dict.fromkeys(COUNTERS, 0))
+      worker_counters[name] = worker_counters.get(name, 0) + n
+
+  def drain(self):
+    """Returns everything recorded since the last drain and starts over"""
+    with self.lock:
+      delta = {
+        "histograms": {stage: histogram.to_dict() for stage, histogram in self.histograms.items() if histogram.count},
+        "counters": self.counters
+      }
+      self.histograms = {stage: Histogram() for stage in STAGES}
+      self.counters = {}
+
+    return delta
+
+  def merge(self, delta):
+    with self.lock:
+      for stage, histogram in delta["histograms"].items():
+        self.histograms.setdefault(stage, Histogram()).merge(histogram)
+
+      for worker, counters in delta["counters"].items():
+        worker_counters = self.counters.setdefault(worker, dict.fromkeys(COUNTERS, 0))
+
+        for name, value in counters.items():
+          worker_counters[name] = worker_counters.get(name, 0) + value
+
+  def totals(self):
+    totals = dict.fromkeys(COUNTERS, 0)
+
+    for counters in self.counters.values():
+      for name, value in counters.items():
+        totals[name] = totals.get(name, 0) + value
+
+    return totals
+
+  def snapshot(self):
+    with self.lock:
+      elapsed = time() - self.started
+
+      return {
+        "timestamp": time(),
+        "elapsed_seconds": round(elapsed, 2),
+        "stages": {
+          stage: {
+            "count": histogram.count,
+            "total_seconds": round(histogram.sum, 3),
+            "mean": round(histogram.sum / histogram.count, 4) if histogram.count else 0.0,
+            "p50": round(histogram.percentile(50), 4),
+            "p95": round(histogram.percentile(95), 4),
+            "p99": round(histogram.percentile(99), 4),
+            "max": round(histogram.max, 4),
+            "buckets": dict(zip([*map(str, LATENCY_BUCKETS), "+Inf"], histogram.counts))
+          } for stage, histogram in self.histograms.items()
+        },
+        "workers": {worker: dict(counters) for worker, counters in self.counters.items()},
+        "totals": self.totals(),
+        "pages_per_second": round(self.totals()["pages"] / elapsed, 2) if elapsed else 0.0
+      }
+
+  def prometheus(self):
+    """Prometheus text exposition format"""
+    lines = [f"# HELP {METRIC_PREFIX}_stage_seconds Time spent per scraping stage.", f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"]
+
+    with self.lock:
+      for stage, histogram in self.histograms.items():
+        cumulative = 0
+
+        for bound, count in zip([*map(str, LATENCY_BUCKETS), "+Inf"], histogram.counts):
+          cumulative += count
+          lines.append(f"{METRIC_PREFIX}_stage_seconds_bucket{{stage=\"{stage}\",le=\"{bound}\"}} {cumulative}")
+
+        lines.append(f"{METRIC_PREFIX}_stage_seconds_sum{{stage=\"{stage}\"}} {histogram.sum}")
+        lines.append(f"{METRIC_PREFIX}_stage_seconds_count{{stage=\"{stage}\"}} {histogram.count}")
+
+      for name in COUNTERS:
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+
+        for worker, counters in self.counters.items():
+          lines.append(f"{METRIC_PREFIX}_{name}_total{{worker=\"{worker}\"}} {counters.get(name, 0)}")
+
+    return "\n".join(lines) + "\n"
+
+  def summary_table(self):
+    snapshot = self.snapshot()
+    rows = [f"{'stage':<14}{'count':>8}{'total s':>10}{'mean s':>10}{'p50 s':>10}{'p95 s':>10}{'max s':>10}"]
+
+    for stage, stats in snapshot["stages"].items():
+      if (stats["count"]):
+        rows.append(f"{stage:<14}{stats['count']:>8}{stats['total_seconds']:>10.2f}{stats['mean']:>10.3f}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['max']:>10.3f}")
+
+    rows.append("")
+    rows.append(f"{'worker':<14}" + "".join(f"{name:>11}" for name in COUNTERS))
+
+    for worker, counters in sorted(snapshot["workers"].items()):
+      rows.append(f"{worker:<14}" + "".join(f"{counters.get(name, 0):>11}" for name in COUNTERS))
+
+    rows.append(f"{'total':<14}" + "".join(f"{snapshot['totals'][name]:>11}" for name in COUNTERS))
+    rows.append(f"\n{snapshot['totals']['pages']} pages in {snapshot['elapsed_seconds']}s ({snapshot['pages_per_second']} pages/s)")
+
+    return "\n".join(rows)
+
+metrics = Metrics()
+
+class MetricsExporter:
+  """Writes periodic JSON snapshots of metrics to snapshot_path and/or serves them
+  in Prometheus text format on http://127.0.0.1:port/metrics while a run is going"""
+
+  def __init__(self, registry=metrics, snapshot_path=None, interval=DEFAULT_SNAPSHOT_INTERVAL, port=None):
+    self.registry = registry
+    self.snapshot_path = snapshot_path
+    self.interval = interval
+    self.server = None
+    self._stopped = Event()
+    self._thread = None
+
+    if (port is not None):
+      self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+      Thread(target=self.server.serve_forever, daemon=True).start()
+
+    if (snapshot_path):
+      self._thread = Thread(target=self._snapshot_loop, daemon=True)
+      self._thread.start()
+
+  def _handler(self):
+    registry = self.registry
+
+    class PrometheusHandler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        if (self.path.split("?")[0] != "/metrics"):
+          self.send_error(404)
+          return
+
+        body = registry.prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass
+
+    return PrometheusHandler
+
+  def write_snapshot(self):
+    # Replaced atomically so a dashboard never reads half a file
+    temp_path = f"{self.snapshot_path}.tmp"
+
+    with open(temp_path, "w") as f:
+      dump(self.registry.snapshot(), f, indent=2)
+
+    os.replace(temp_path, self.snapshot_path)
+
+  def _snapshot_loop(self):
+    while (not self._stopped.wait(self.interval)):
+      self.write_snapshot()
+
+  def close(self):
+    self._stopped.set()
+
+    if (self._thread):
+      self._thread.join()
+      self.write_snapshot()
+
+    if (self.server):
+      self.server.shutdown()
+      self.server.server_close()
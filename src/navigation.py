@@ -0,0 +1,113 @@
+from time import monotonic, sleep
+from uuid import uuid4
+from metrics import metrics, Histogram
+from page_cache import page_type
+from util import CAPTCHA_SELECTOR
+
+# What has to be in the DOM before a page of each type (page_cache.page_type) can be read.
+# The one place these are defined, every scraper navigating a browser waits through it.
+# Only elements every page of the type has: READY_SCRIPT also waits for the document to be parsed,
+# so the reviews are there with the title, and a page without reviews is still ready.
+READY_SELECTORS = {
+  "ranking": [".top-ranking-table"],
+  "reviews": [".title-name"],
+  "anime": [".title-name"],
+  "profile": [".user-profile"],
+  "other": ["body"]
+}
+DEFAULT_TIMEOUT = 10
+MIN_TIMEOUT = 4
+MAX_TIMEOUT = 45
+# Timeout as a multiple of the p95 of the page type's ready times, once there are MIN_SAMPLES of them
+P95_FACTOR = 3
+MIN_SAMPLES = 20
+POLL_SECONDS = 0.1
+
+# Ready once the previous document is gone, the new one is parsed and has every selector (or is a captcha)
+READY_SCRIPT = """
+const [token, selectors, captchaSelector] = arguments;
+
+if (window.__malNavigation === token || document.readyState === "loading") {
+  return false;
+}
+
+return Boolean(document.querySelector(captchaSelector)) || selectors.every(selector => document.querySelector(selector));
+"""
+
+class NavigationTimeout(TimeoutError):
+  pass
+
+class AdaptiveTimeouts:
+  """Per page type navigation timeouts that follow the site's observed speed.
+
+  Until a page type has MIN_SAMPLES ready times, its timeout is default. Then it's
+  P95_FACTOR times their p95, within [minimum, maximum]. Only pages that got ready are
+  samples, a timed out page says nothing about how long the site takes.
+  """
+
+  def __init__(self, default=DEFAULT_TIMEOUT, minimum=MIN_TIMEOUT, maximum=MAX_TIMEOUT):
+    self.default = default
+    self.minimum = minimum
+    self.maximum = maximum
+    self.histograms = {}
+
+  def timeout(self, kind) -> float:
+    histogram = self.histograms.get(kind)
+
+    if (histogram is None or histogram.count < MIN_SAMPLES):
+      return self.default
+
+    return min(self.maximum, max(self.minimum, histogram.percentile(95) * P95_FACTOR))
+
+  def observe(self, kind, seconds):
+    self.histograms.setdefault(kind, Histogram()).observe(seconds)
+
+def wait_until_ready(driver, kind, timeouts=None, token=None, started=None, observe=True):
+  """Polls until the browser's document is a parsed page of kind with its READY_SELECTORS (or a captcha).
+
+  token is the tag start_navigation put on the previous document, which doesn't count as ready.
+  The timeout runs from started (monotonic time of the navigation). Unless observe is False,
+  the ready time of a navigation (a token was given) is recorded in timeouts.
+  Raises NavigationTimeout when the page isn't ready within the page type's timeout, without recording it.
+  """
+  timeout = timeouts.timeout(kind) if timeouts else DEFAULT_TIMEOUT
+  selectors = READY_SELECTORS.get(kind, READY_SELECTORS["other"])
+  started = started or monotonic()
+
+  with metrics.time("wait"):
+    while (not driver.execute_script(READY_SCRIPT, token, selectors, CAPTCHA_SELECTOR)):
+      if (monotonic() - started > timeout):
+        raise NavigationTimeout(f"{kind} page not ready after {timeout:.1f}s (at \"{driver.current_url}\")")
+
+      sleep(POLL_SECONDS)
+
+  if (timeouts and token and observe):
+    timeouts.observe(kind, monotonic() - started)
+
+def start_navigation(driver, url) -> tuple[str, float]:
+  """Tags the current document and starts loading url, returns the (token, started) wait_until_ready needs.
+  With the "none" page load strategy, driver.get returns right away and the page loads in the background."""
+  token = uuid4().hex
+
+  try:
+    driver.execute_script("window.__malNavigation = arguments[0];", token)
+  except Exception:
+    # Nothing loaded yet (or the previous page is gone), there's no document to mistake for the new one
+    pass
+
+  started = monotonic()
+
+  with metrics.time("navigation"):
+    driver.get(url)
+
+  return token, started
+
+def navigate(driver, url, timeouts=None, kind=None):
+  """Loads url and returns as soon as its page type's READY_SELECTORS are there.
+
+  Works with the "none" page load strategy: the previous document is tagged first, so
+  it's never mistaken for the new one. The url the browser ends up on doesn't matter,
+  so redirects and trailing slashes don't stall it.
+  """
+  token, started = start_navigation(driver, url)
+  wait_until_ready(driver, kind or page_type(url), timeouts, token, started)
@@ -0,0 +1,54 @@
+from json import dumps
+from records import json_default
+from columnar import ColumnarWriter, COLUMNAR_FORMATS
+
+OUTPUT_FORMATS = ["json", "jsonl"]
+DEFAULT_OUTPUT_FORMAT = "json"
+# Reviews can also be exported column by column, see columnar.py
+REVIEW_OUTPUT_FORMATS = OUTPUT_FORMATS + COLUMNAR_FORMATS
+
+class RecordWriter:
+  """Writes records to the output file one at a time as they're scraped.
+
+  "jsonl" writes one compact JSON object per line. "json" streams the same
+  pretty-printed array dumps(records, indent=2) would produce, without ever
+  holding the whole list or its serialized string in memory.
+  size_bytes keeps a running count of the bytes written for the size report.
+  """
+
+  def __init__(self, path, output_format=DEFAULT_OUTPUT_FORMAT):
+    self.output_format = output_format
+    self.file = open(path, "w", encoding="utf-8")
+    self.count = 0
+    self.size_bytes = 0
+
+  def _write(self, text):
+    self.file.write(text)
+    self.size_bytes += len(text.encode("utf-8"))
+
+  def write(self, record):
+    if (self.output_format == "jsonl"):
+      self._write(dumps(record, default=json_default) + "\n")
+    else:
+      indented = "\n".join("  " + line for line in dumps(record, indent=2, default=json_default).split("\n"))
+      self._write(("[\n" if self.count == 0 else ",\n") + indented)
+
+    self.count += 1
+
+  def write_all(self, records):
+    for record in records:
+      self.write(record)
+
+  def close(self):
+    if (self.output_format == "json"):
+      self._write("\n]" if self.count else "[]")
+
+    self.file.close()
+    return self.size_bytes
+
+def open_writer(path, output_format=DEFAULT_OUTPUT_FORMAT):
+  """RecordWriter for the JSON formats, ColumnarWriter for the columnar ones"""
+  if (output_format in COLUMNAR_FORMATS):
+    return ColumnarWriter(path, output_format)
+
+  return RecordWriter(path, output_format)
@@ -0,0 +1,246 @@
+import os
+import gzip
+import sqlite3
+from threading import RLock, get_ident
+from hashlib import sha1
+from time import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_CACHE_FOLDER = "temp/page_cache"
+DEFAULT_CACHE_MAX_MB = 2048
+HOUR = 60 * 60
+
+# How long a cached page is served without asking the site again, per page type
+PAGE_TYPE_TTLS = {
+  "ranking": 6 * HOUR,
+  "anime": 24 * HOUR,
+  "reviews": 12 * HOUR,
+  "profile": 24 * HOUR,
+  "image": 30 * 24 * HOUR,
+  "other": 1 * HOUR
+}
+
+STAT_NAMES = ["hits", "misses", "revalidated", "stores", "evictions"]
+
+def page_type(url: str) -> str:
+  path = urlsplit(url).path
+
+  if ("topanime.php" in path):
+    return "ranking"
+  if ("/reviews" in path):
+    return "reviews"
+  if (path.startswith("/anime/")):
+    return "anime"
+  if (path.startswith("/profile/")):
+    return "profile"
+  if (path.startswith("/images/") or path.endswith((".jpg", ".jpeg", ".png", ".webp", ".gif"))):
+    return "image"
+
+  return "other"
+
+def normalize_url(url: str) -> str:
+  """Cache key form of url: lowercase scheme/host, sorted query, no fragment and no trailing slash"""
+  parts = urlsplit(url.strip())
+  query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+  path = parts.path.rstrip("/") or "/"
+
+  return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
+
+class CacheEntry:
+  __slots__ = ("url", "body", "fetched_at", "etag", "last_modified", "is_fresh")
+
+  def __init__(self, url, body, fetched_at, etag, last_modified, is_fresh):
+    self.url = url
+    self.body = body
+    self.fetched_at = fetched_at
+    self.etag = etag
+    self.last_modified = last_modified
+    self.is_fresh = is_fresh
+
+  @property
+  def text(self):
+    return self.body.decode("utf-8", errors="replace")
+
+class PageCache:
+  """On-disk page cache shared by every worker process of every scraper.
+
+  Bodies are stored gzipped in sharded folders and indexed in a small SQLite
+  database, which also keeps the LRU order and cumulative hit/miss statistics.
+  Each process must open its own PageCache, threads of one process can share it.
+  """
+
+  def __init__(self, folder=DEFAULT_CACHE_FOLDER, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024, ttls=None):
+    self.folder = folder
+    self.max_bytes = max_bytes
+    self.ttls = {**PAGE_TYPE_TTLS, **(ttls or {})}
+    self.stats = dict.fromkeys(STAT_NAMES, 0)
+
+    os.makedirs(folder, exist_ok=True)
+
+    self.lock = RLock()
+    self.db = sqlite3.connect(f"{folder}/index.sqlite", timeout=30, isolation_level=None, check_same_thread=False)
+    self._query("PRAGMA journal_mode=WAL")
+    self._query("""CREATE TABLE IF NOT EXISTS pages (
+      key TEXT PRIMARY KEY,
+      url TEXT NOT NULL,
+      page_type TEXT NOT NULL,
+      size INTEGER NOT NULL,
+      fetched_at REAL NOT NULL,
+      accessed_at REAL NOT NULL,
+      etag TEXT,
+      last_modified TEXT
+    )""")
+    self._query("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+    self._query("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    self._create_size_total()
+
+  def _create_size_total(self):
+    """Keeps the total size of the cached pages in meta, updated by triggers in the same transaction as every
+    change to pages, so no process has to sum the table. Caches from before it are summed once, here."""
+    with self.lock:
+      self.db.execute("BEGIN IMMEDIATE")
+
+      try:
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.execute("CREATE TRIGGER IF NOT EXISTS pages_size_insert AFTER INSERT ON pages BEGIN UPDATE meta SET value = value + new.size WHERE name = 'total_bytes'; END")
+        self.db.execute("CREATE TRIGGER IF NOT EXISTS pages_size_update AFTER UPDATE OF size ON pages BEGIN UPDATE meta SET value = value + new.size - old.size WHERE name = 'total_bytes'; END")
+        self.db.execute("CREATE TRIGGER IF NOT EXISTS pages_size_delete AFTER DELETE ON pages BEGIN UPDATE meta SET value = value - old.size WHERE name = 'total_bytes'; END")
+        self.db.execute("INSERT OR IGNORE INTO meta (name, value) SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM pages")
+        self.db.execute("COMMIT")
+      except BaseException:
+        self.db.execute("ROLLBACK")
+        raise
+
+  def total_bytes(self) -> int:
+    return self._query("SELECT value FROM meta WHERE name = 'total_bytes'")[0][0]
+
+  def _query(self, sql, params=()):
+    with self.lock:
+      return self.db.execute(sql, params).fetchall()
+
+  def _key(self, url):
+    return sha1(normalize_url(url).encode("utf-8")).hexdigest()
+
+  def _path(self, key):
+    return f"{self.folder}/{key[:2]}/{key}.gz"
+
+  def get(self, url):
+    """Returns the CacheEntry for url (fresh or stale) or None. Stale entries can be revalidated."""
+    key = self._key(url)
+    rows = self._query("SELECT page_type, fetched_at, etag, last_modified FROM pages WHERE key = ?", (key,))
+
+    if (not rows):
+      self.stats["misses"] += 1
+      return None
+
+    try:
+      with gzip.open(self._path(key), "rb") as f:
+        body = f.read()
+    except OSError:
+      self._remove(key)
+      self.stats["misses"] += 1
+      return None
+
+    page_type_name, fetched_at, etag, last_modified = rows[0]
+    is_fresh = time() - fetched_at < self.ttls.get(page_type_name, self.ttls["other"])
+
+    self._query("UPDATE pages SET accessed_at = ? WHERE key = ?", (time(), key))
+    self.stats["hits" if is_fresh else "misses"] += 1
+
+    return CacheEntry(url, body, fetched_at, etag, last_modified, is_fresh)
+
+  def get_fresh_text(self, url):
+    """Returns the cached page as text if it's still within its TTL, otherwise None"""
+    entry = self.get(url)
+    return entry.text if entry and entry.is_fresh else None
+
+  def is_fresh(self, url) -> bool:
+    """Whether url has a copy within its TTL, without reading it or counting a hit/miss"""
+    rows = self._query("SELECT page_type, fetched_at FROM pages WHERE key = ?", (self._key(url),))
+    return bool(rows) and time() - rows[0][1] < self.ttls.get(rows[0][0], self.ttls["other"])
+
+  def put(self, url, body, etag=None, last_modified=None):
+    if (isinstance(body, str)):
+      body = body.encode("utf-8")
+
+    key = self._key(url)
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Written to a temporary file first so other processes never read half a page
+    temp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+
+    with gzip.open(temp_path, "wb", compresslevel=5) as f:
+      f.write(body)
+
+    os.replace(temp_path, path)
+    now = time()
+
+    self._query("""INSERT INTO pages (key, url, page_type, size, fetched_at, accessed_at, etag, last_modified)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+      ON CONFLICT (key) DO UPDATE SET size = excluded.size, fetched_at = excluded.fetched_at,
+        accessed_at = excluded.accessed_at, etag = excluded.etag, last_modified = excluded.last_modified""",
+      (key, url, page_type(url), os.path.getsize(path), now, now, etag, last_modified))
+    self.stats["stores"] += 1
+
+    self._evict()
+
+  def revalidated(self, url):
+    """Marks a stale entry as fresh again after the site answered 304 Not Modified"""
+    self._query("UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE key = ?", (time(), time(), self._key(url)))
+    self.stats["revalidated"] += 1
+
+  def invalidate(self, url):
+    self._remove(self._key(url))
+
+  def _evict(self):
+    total_bytes = self.total_bytes()
+
+    if (total_bytes <= self.max_bytes):
+      return
+
+    # Evicts least recently used pages until the cache is back under 90% of its budget
+    target_bytes = self.max_bytes * 0.9
+
+    for key, size in self._query("SELECT key, size FROM pages ORDER BY accessed_at ASC"):
+      if (total_bytes <= target_bytes):
+        break
+
+      self._remove(key)
+      total_bytes -= size
+      self.stats["evictions"] += 1
+
+  def _remove(self, key):
+    self._query("DELETE FROM pages WHERE key = ?", (key,))
+
+    if (os.path.exists(self._path(key))):
+      os.remove(self._path(key))
+
+  def read_stats(self):
+    """Cumulative statistics of every process that used this cache folder"""
+    totals = dict.fromkeys(STAT_NAMES, 0)
+    totals.update(self._query("SELECT name, value FROM stats"))
+    return totals
+
+  def close(self):
+    for name, value in self.stats.items():
+      if (value):
+        self._query("INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", (name, value))
+
+    self.stats = dict.fromkeys(STAT_NAMES, 0)
+
+    with self.lock:
+      self.db.close()
+
+def read_cache_stats(folder):
+  cache = PageCache(folder)
+  stats = cache.read_stats()
+  cache.close()
+  return stats
+
+def format_cache_stats(before, after):
+  delta = {name: after[name] - before[name] for name in STAT_NAMES}
+  lookups = delta["hits"] + delta["misses"]
+  hit_rate = (delta["hits"] / lookups * 100) if lookups else 0
+
+  return f"Page cache: {delta['hits']} hits, {delta['misses']} misses ({hit_rate:.1f}% hit rate), {delta['revalidated']} revalidated, {delta['stores']} stored, {delta['evictions']} evicted"
@@ -0,0 +1,242 @@
+import multiprocessing
+from collections import Counter, deque
+from queue import Empty, Full
+from time import monotonic, sleep
+from metrics import metrics
+from work_queue import _worker_main, WORKER_POLL_INTERVAL
+
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_MAX_BACKLOG = 1000
+# How often a backlogged pipeline checks whether its stages made room again
+BACKLOG_POLL_INTERVAL = 0.05
+
+class Stage:
+  """One stage of a pipeline: worker_count processes running worker_factory() workers,
+  fed through a queue of at most queue_size items (see work_queue.run_work_queue for the worker interface)"""
+
+  def __init__(self, name, worker_factory, worker_count=1, queue_size=DEFAULT_QUEUE_SIZE):
+    self.name = name
+    self.worker_factory = worker_factory
+    self.worker_count = max(1, worker_count)
+    self.queue_size = max(queue_size, self.worker_count)
+
+class _StageState:
+  def __init__(self, stage):
+    self.stage = stage
+    self.task_queue = multiprocessing.Queue(stage.queue_size)
+    self.pending = deque()
+    self.seen = set()
+    self.queued = Counter()
+    self.outstanding = 0
+    self.closed = False
+    self.workers = {}
+    self.lost_checks = 0
+    self.spawned = 0
+
+def run_pipeline(stages, initial_items, route, max_backlog=DEFAULT_MAX_BACKLOG):
+  """Runs stages as a streaming pipeline, every stage with its own worker processes.
+
+  initial_items is an iterable of (stage name, item), pulled as the stages make room for it.
+  route(stage name, item, value) is called in the parent for every result and returns the
+  (stage name, item) pairs it feeds to later stages. Items are deduplicated per stage, so every item is processed once per run.
+  Items routed to a stage that isn't part of stages are dropped, so optional stages
+  can be left out without changing route.
+
+  Stage queues are bounded. Items that don't fit wait in the parent, and a stage isn't fed
+  new items while the stages after it have more than max_backlog items waiting, so a fast
+  upstream stage can't run ahead of a slow downstream one. While any stage has max_backlog
+  items waiting, no more results are read and no more initial items are pulled, so the parent
+  never holds more than max_backlog items per stage, plus the ones a single result is routed to.
+
+  Yields (stage name, event, item, value) with the same events as run_work_queue.
+  """
+  states = {stage.name: _StageState(stage) for stage in stages}
+  max_backlog = max(1, max_backlog)
+  order = [stage.name for stage in stages]
+  initial_items = iter(initial_items)
+  is_initial_exhausted = False
+  in_flight = {}
+  started_by = Counter()
+  next_worker_id = 0
+
+  def spawn(state):
+    nonlocal next_worker_id
+    worker_id = next_worker_id
+    next_worker_id += 1
+    label = f"{state.stage.name}-{state.spawned}"
+    state.spawned += 1
+    process = multiprocessing.Process(target=_worker_main, args=(worker_id, state.stage.worker_factory, state.task_queue, result_queue, label), daemon=True)
+    process.start()
+    state.workers[worker_id] = process
+    stage_of[worker_id] = state
+
+  def enqueue(stage_name, item):
+    state = states.get(stage_name)
+
+    if (state and item not in state.seen):
+      state.seen.add(item)
+      state.pending.append(item)
+      state.outstanding += 1
+
+  def is_finished(stage_name):
+    state = states[stage_name]
+    return is_initial_exhausted and state.outstanding <= 0 and all(states[name].closed for name in order[:order.index(stage_name)])
+
+  def is_backlogged():
+    return any(len(state.pending) >= max_backlog for state in states.values())
+
+  def feed():
+    nonlocal is_initial_exhausted
+
+    while (not is_initial_exhausted and not is_backlogged()):
+      initial_item = next(initial_items, None)
+
+      if (initial_item is None):
+        is_initial_exhausted = True
+      else:
+        enqueue(*initial_item)
+
+    for i, name in enumerate(order):
+      state = states[name]
+      backlog = sum(len(states[downstream].pending) for downstream in order[i + 1:])
+
+      while (state.pending and backlog < max_backlog):
+        try:
+          state.task_queue.put_nowait(state.pending[0])
+        except Full:
+          break
+
+        state.queued[state.pending.popleft()] += 1
+
+      if (not state.closed and is_finished(name)):
+        state.closed = True
+
+        # The queue is only left with items when every worker of the stage died
+        for _ in state.workers:
+          try:
+            state.task_queue.put_nowait(None)
+          except Full:
+            break
+
+  def handle(event, worker_id, item, value):
+    state = stage_of[worker_id]
+
+    if (event == "start"):
+      in_flight[worker_id] = item
+      started_by[worker_id] += 1
+      state.queued[item] -= 1
+
+      if (state.queued[item] <= 0):
+        del state.queued[item]
+    elif (event == "metrics"):
+      metrics.merge(value)
+    elif (event == "exit"):
+      state.workers.pop(worker_id).join()
+    elif (event == "result"):
+      for stage_name, next_item in route(state.stage.name, item, value):
+        enqueue(stage_name, next_item)
+
+      yield (state.stage.name, event, item, value)
+    else:
+      in_flight.pop(worker_id, None)
+      state.outstanding -= 1
+      yield (state.stage.name, event, item, value)
+
+  def check_workers():
+    dead = {worker_id for state in states.values() for worker_id, process in state.workers.items() if not process.is_alive()}
+
+    # Whatever a dead worker reported before dying is already in the queue, so it's handled first
+    while (dead):
+      try:
+        message = result_queue.get_nowait()
+      except Empty:
+        break
+
+      yield from handle(*message)
+
+    for state in states.values():
+      for worker_id, process in list(state.workers.items()):
+        if (worker_id not in dead):
+          continue
+
+        del state.workers[worker_id]
+
+        if (worker_id in in_flight):
+          item = in_flight.pop(worker_id)
+          state.outstanding -= 1
+          yield (state.stage.name, "error", item, f"Worker exited with code {process.exitcode}")
+
+        if (started_by[worker_id] and not state.closed):
+          spawn(state)
+
+      # Items a worker took from the queue right before dying never report a "start".
+      # Once nothing is queued or running for two checks in a row, they're failed here.
+      is_idle = state.queued and not any(stage_of[worker_id] is state for worker_id in in_flight)
+
+      if (is_idle and state.task_queue.qsize() == 0):
+        state.lost_checks += 1
+      else:
+        state.lost_checks = 0
+
+      if (state.lost_checks >= 2 or (state.queued and not state.workers)):
+        for lost_item, count in list(state.queued.items()):
+          for _ in range(count):
+            state.outstanding -= 1
+            yield (state.stage.name, "error", lost_item, "Item was never finished by a worker")
+
+        state.queued.clear()
+        state.lost_checks = 0
+
+      # Nothing would ever take them, and they'd keep the pipeline backlogged
+      if (state.pending and not state.workers):
+        for lost_item in state.pending:
+          state.outstanding -= 1
+          yield (state.stage.name, "error", lost_item, "Item was never finished by a worker")
+
+        state.pending.clear()
+
+  result_queue = multiprocessing.Queue()
+  stage_of = {}
+
+  for state in states.values():
+    for _ in range(state.stage.worker_count):
+      spawn(state)
+
+  try:
+    feed()
+    next_check = monotonic() + WORKER_POLL_INTERVAL
+
+    while (any(state.workers for state in states.values())):
+      if (is_backlogged()):
+        # Results stay in the queue until the stages made room for the items they're routed to
+        sleep(BACKLOG_POLL_INTERVAL)
+      else:
+        try:
+          message = result_queue.get(timeout=WORKER_POLL_INTERVAL)
+        except Empty:
+          message = None
+
+        if (message):
+          yield from handle(*message)
+
+      # Checked on a timer rather than only when the queue goes quiet, or a dead worker
+      # would go unnoticed for as long as the others keep reporting
+      if (monotonic() >= next_check):
+        yield from check_workers()
+        next_check = monotonic() + WORKER_POLL_INTERVAL
+
+      feed()
+
+    for stage_name, item in initial_items:
+      enqueue(stage_name, item)
+
+    # Left over if every worker of a stage died
+    for name in order:
+      state = states[name]
+
+      for item in [*state.queued.elements(), *state.pending]:
+        yield (name, "error", item, "Item was never finished by a worker")
+  finally:
+    for state in states.values():
+      for process in state.workers.values():
+        process.terminate()
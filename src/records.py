@@ -0,0 +1,92 @@
+from sys import intern
+
+# Sidebar rows every user profile has, None when the user hid them
+PROFILE_FIELDS = ["last_online", "gender", "birthday", "location", "joined"]
+PROFILE_COUNT_FIELDS = ["forum_posts", "reviews", "recommendations", "interest_stacks", "blog_posts", "clubs"]
+ANIME_STAT_FIELDS = ["days", "mean_score", "watching", "completed", "on_hold", "dropped", "plan_to_watch", "total_entries", "rewatched", "episodes"]
+
+def _intern(value):
+  return intern(value) if isinstance(value, str) else value
+
+class Record:
+  """Base of the scraped record types.
+
+  Fields live in __slots__ instead of a dict per record, and the strings repeated
+  across records (anime names, urls, usernames, avatars, genres) are interned, so
+  thousands of records of one anime share a single copy of each. Records pickle as
+  a bare tuple of their values and are re-interned on the receiving side.
+  record["field"] reads like the dicts they replace. They only become dicts, in the
+  exported JSON shape, when they're written (to_dict / json_default).
+  """
+
+  __slots__ = ()
+  # Fields whose values are interned
+  INTERNED = ()
+
+  def __init__(self, *values, **fields):
+    if (fields):
+      values = tuple(fields.pop(name, None) for name in self.__slots__)
+
+      # A misspelled field would otherwise be dropped without a trace
+      if (fields):
+        raise TypeError(f"{type(self).__name__} has no field(s) {', '.join(map(repr, fields))}")
+    elif (len(values) > len(self.__slots__)):
+      raise TypeError(f"{type(self).__name__} takes at most {len(self.__slots__)} values, got {len(values)}")
+
+    for name, value in zip(self.__slots__, values):
+      setattr(self, name, _intern(value) if name in self.INTERNED else value)
+
+  @classmethod
+  def from_dict(cls, data):
+    return cls(*(data.get(name) for name in cls.__slots__))
+
+  def to_dict(self):
+    return {name: getattr(self, name) for name in self.__slots__}
+
+  def values(self):
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+  def __getitem__(self, name):
+    try:
+      return getattr(self, name)
+    except AttributeError:
+      raise KeyError(name) from None
+
+  def __eq__(self, other):
+    return type(self) is type(other) and self.values() == other.values()
+
+  # Mutable (and may hold lists), so unhashable like the dicts they replace
+  __hash__ = None
+
+  def __reduce__(self):
+    return (type(self), self.values())
+
+  def __repr__(self):
+    return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+class Review(Record):
+  __slots__ = ("page_url", "anime", "username", "avatar", "timestamp", "feelings", "review_text")
+  INTERNED = ("page_url", "anime", "username", "avatar")
+
+class AnimeDetails(Record):
+  __slots__ = ("anime", "english_name", "cover", "anime_url", "score", "reviews", "members", "ranking", "popularity", "synopsis", "genres")
+  INTERNED = ("anime", "english_name", "cover", "anime_url")
+
+  def __init__(self, *values, **fields):
+    super().__init__(*values, **fields)
+    self.genres = [intern(genre) for genre in self.genres or []]
+
+class RankingEntry(Record):
+  __slots__ = ("anime", "anime_url", "rank", "score", "members", "media_type", "episodes", "thumbnail")
+  INTERNED = ("anime", "anime_url", "media_type", "thumbnail")
+
+class UserProfile(Record):
+  __slots__ = ("username", "profile_url", "avatar", *PROFILE_FIELDS, *PROFILE_COUNT_FIELDS, "anime_stats")
+  INTERNED = ("username", "profile_url", "avatar", "gender", "location")
+
+def json_default(value):
+  """json.dumps(default=...) hook turning records into their exported dict shape"""
+  if (isinstance(value, Record)):
+    return value.to_dict()
+
+  raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
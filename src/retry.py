@@ -0,0 +1,323 @@
+import os
+import http.client
+from json import dumps, loads
+from multiprocessing import Array, Value
+from random import uniform
+from sys import exit
+from time import time, sleep
+from argparse import ArgumentParser
+from mal_parser import CaptchaError, HttpStatusError
+from metrics import metrics
+from util import rich_print, ANSI_BRIGHT_YELLOW
+
+FAILURE_KINDS = ["network", "parse", "rate_limit", "driver", "missing"]
+# Statuses the site answers with when it's throttling us, and for pages that don't exist
+RATE_LIMIT_STATUSES = [403, 429]
+MISSING_STATUSES = [404, 410]
+# Selenium/urllib3 errors (by class name, so HTTP-only scrapers don't need them) raised once the browser is gone
+DRIVER_ERRORS = ["InvalidSessionIdException", "NoSuchWindowException", "MaxRetryError", "ProtocolError"]
+DEAD_DRIVER_MESSAGES = ["invalid session id", "Browsing context has been discarded", "Failed to decode response from marionette", "Tried to run command without establishing a connection", "Connection refused"]
+TIMEOUT_ERRORS = ["TimeoutException"]
+# Failures that say something about the site's health, as opposed to our own browser crashing
+SITE_FAILURE_KINDS = ["network", "parse", "rate_limit"]
+# Attempts of one item across every failure kind
+MAX_TOTAL_ATTEMPTS = 8
+BREAKER_BUCKETS = 12
+DEFAULT_BREAKER_WINDOW = 60
+DEFAULT_BREAKER_ERROR_RATE = 0.5
+DEFAULT_BREAKER_MIN_REQUESTS = 20
+DEFAULT_BREAKER_COOLDOWN = 120
+# How long a half-open breaker waits for its probe's result before letting another worker probe
+DEFAULT_BREAKER_PROBE_TIMEOUT = 60
+HALF_OPEN_POLL_SECONDS = 0.5
+
+class RetryExhausted(RuntimeError):
+  def __init__(self, message, kind):
+    super().__init__(message)
+    self.kind = kind
+
+def classify(error) -> str:
+  """Failure kind of an exception raised while loading or parsing a page, one of FAILURE_KINDS"""
+  if (isinstance(error, CaptchaError)):
+    return "rate_limit"
+
+  if (isinstance(error, HttpStatusError)):
+    if (error.status in RATE_LIMIT_STATUSES):
+      return "rate_limit"
+
+    if (error.status in MISSING_STATUSES):
+      return "missing"
+
+    return "network" if error.status >= 500 else "parse"
+
+  class_names = {cls.__name__ for cls in type(error).__mro__}
+
+  if (class_names & set(DRIVER_ERRORS)):
+    return "driver"
+
+  if ("WebDriverException" in class_names and any(message in str(error) for message in DEAD_DRIVER_MESSAGES)):
+    return "driver"
+
+  if (class_names & set(TIMEOUT_ERRORS) or isinstance(error, (OSError, http.client.HTTPException))):
+    return "network"
+
+  return "parse"
+
+class RetryPolicy:
+  """How often a failure kind is retried and how long to wait in between.
+
+  The wait doubles with every attempt up to max_delay, and half of it is random so
+  workers that failed together don't all come back at the same moment.
+  """
+
+  def __init__(self, max_attempts, base_delay, max_delay):
+    self.max_attempts = max_attempts
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+
+  def delay(self, attempt) -> float:
+    delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+    return delay / 2 + uniform(0, delay / 2)
+
+DEFAULT_POLICIES = {
+  # Timeouts and dropped connections usually pass
+  "network": RetryPolicy(4, 2, 60),
+  # A page that doesn't parse twice in a row won't parse the third time either
+  "parse": RetryPolicy(2, 1, 10),
+  "rate_limit": RetryPolicy(5, 30, 600),
+  # The browser is restarted before every retry
+  "driver": RetryPolicy(3, 5, 30),
+  "missing": RetryPolicy(1, 0, 0)
+}
+
+class CircuitBreaker:
+  """Site-wide error rate breaker shared by every worker process of a run.
+
+  Page loads are counted in BREAKER_BUCKETS time buckets covering the last window
+  seconds. Once the window holds at least min_requests loads and error_rate of them
+  failed, the breaker opens and every worker holds off for cooldown seconds before
+  loading anything again. The window starts over afterwards.
+  After the cooldown the breaker is half-open: wait() lets one worker at a time through
+  to probe the site, and the first load that's recorded decides. A success closes the
+  breaker, a site failure opens it again straight away.
+  Create it in the parent process and hand it to the workers, like CaptchaBackoff.
+  """
+
+  def __init__(self, window=DEFAULT_BREAKER_WINDOW, error_rate=DEFAULT_BREAKER_ERROR_RATE, min_requests=DEFAULT_BREAKER_MIN_REQUESTS, cooldown=DEFAULT_BREAKER_COOLDOWN, probe_timeout=DEFAULT_BREAKER_PROBE_TIMEOUT):
+    self.window = window
+    self.error_rate = error_rate
+    self.min_requests = min_requests
+    self.cooldown = cooldown
+    self.probe_timeout = probe_timeout
+    # (bucket number, successes, failures) per bucket
+    self._buckets = Array("d", BREAKER_BUCKETS * 3)
+    self._open_until = Value("d", 0.0)
+    self._is_half_open = Value("b", 0, lock=False)
+    # Until when the current probe of a half-open breaker holds the other workers back
+    self._probe_until = Value("d", 0.0, lock=False)
+
+  def _open(self, now):
+    self._open_until.value = now + self.cooldown
+    self._is_half_open.value = 1
+    self._probe_until.value = 0.0
+    self._buckets[:] = [0] * (BREAKER_BUCKETS * 3)
+
+  def is_half_open(self) -> bool:
+    return bool(self._is_half_open.value) and self._open_until.value <= time()
+
+  def record(self, is_success) -> bool:
+    """Counts one page load. Returns True if this failure opened the breaker."""
+    now = time()
+    bucket = int(now // (self.window / BREAKER_BUCKETS))
+    slot = bucket % BREAKER_BUCKETS * 3
+
+    with self._buckets.get_lock():
+      if (self.is_half_open()):
+        self._is_half_open.value = 0
+        self._probe_until.value = 0.0
+
+        if (is_success):
+          return False
+
+        self._open(now)
+        return True
+
+      if (self._buckets[slot] != bucket):
+        self._buckets[slot:slot + 3] = [bucket, 0, 0]
+
+      self._buckets[slot + (1 if is_success else 2)] += 1
+
+      if (is_success or self._open_until.value > now):
+        return False
+
+      buckets = [self._buckets[i:i + 3] for i in range(0, BREAKER_BUCKETS * 3, 3)]
+      successes = sum(s for number, s, f in buckets if bucket - number < BREAKER_BUCKETS)
+      failures = sum(f for number, s, f in buckets if bucket - number < BREAKER_BUCKETS)
+
+      if (successes + failures < self.min_requests or failures < (successes + failures) * self.error_rate):
+        return False
+
+      self._open(now)
+
+    return True
+
+  def remaining(self) -> float:
+    """Seconds left in the cooldown, or of another worker's probe while half-open"""
+    now = time()
+    remaining = self._open_until.value - now
+
+    if (remaining <= 0 and self._is_half_open.value):
+      remaining = self._probe_until.value - now
+
+    return max(0.0, remaining)
+
+  def _claim_probe(self) -> bool:
+    with self._buckets.get_lock():
+      if (not self.is_half_open()):
+        return self._open_until.value <= time()
+
+      if (self._probe_until.value > time()):
+        return False
+
+      self._probe_until.value = time() + self.probe_timeout
+      return True
+
+  def wait(self):
+    waited = 0.0
+
+    while (not self._claim_probe()):
+      delay = self.remaining() if self._open_until.value > time() else min(self.remaining(), HALF_OPEN_POLL_SECONDS)
+      sleep(delay)
+      waited += delay
+
+    if (waited):
+      metrics.observe("wait", waited)
+
+class DeadLetters:
+  """JSON Lines file of the items that ran out of retries, for a later targeted run.
+
+  The file is opened on the first failure, so one instance can be created in the
+  parent process and handed to every worker process, which then append to it on
+  their own. Lines are short enough for O_APPEND writes not to interleave.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._file = None
+
+  def add(self, item, url, kind, error, attempts):
+    if (self._file is None):
+      if (os.path.dirname(self.path)):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+      self._file = open(self.path, "a", encoding="utf-8")
+
+    self._file.write(dumps({"item": item, "url": url, "kind": kind, "error": str(error)[:500], "attempts": attempts, "failed_at": time()}) + "\n")
+    self._file.flush()
+
+  def close(self):
+    if (self._file):
+      self._file.close()
+      self._file = None
+
+def read_dead_letters(path, kinds=None) -> list[str]:
+  """Unique items of a dead-letter file (of the given failure kinds), in order of failure"""
+  items = {}
+
+  with open(path, "r", encoding="utf-8") as f:
+    for line in f:
+      try:
+        entry = loads(line)
+      except ValueError:
+        continue
+
+      if (kinds is None or entry["kind"] in kinds):
+        items[entry["item"]] = True
+
+  return list(items)
+
+class RetryEngine:
+  """Retry decisions shared by the scrapers' workers and async handlers.
+
+  Every item gets a RetryState from begin(). Failures are classified (see classify)
+  and retried after a jittered exponential delay of their kind's RetryPolicy, each
+  kind counting its own attempts. Items that use up their retries are written to the
+  dead-letter file. With a CircuitBreaker, every page load counts towards the site's
+  error rate and workers call wait() before loading a page.
+  """
+
+  def __init__(self, policies=None, breaker=None, dead_letter_path=None):
+    self.policies = {**DEFAULT_POLICIES, **(policies or {})}
+    self.breaker = breaker
+    self.dead_letters = DeadLetters(dead_letter_path) if dead_letter_path else None
+
+  def begin(self, item, url=None):
+    return RetryState(self, item, url or item)
+
+  def succeeded(self):
+    if (self.breaker):
+      self.breaker.record(True)
+
+  def remaining(self) -> float:
+    """Seconds left before the circuit breaker lets pages load again"""
+    return self.breaker.remaining() if self.breaker else 0.0
+
+  def wait(self):
+    if (self.breaker):
+      self.breaker.wait()
+
+  def close(self):
+    if (self.dead_letters):
+      self.dead_letters.close()
+
+class RetryState:
+  """Attempts of one item (url is the page that's failing, e.g. one review page of an anime)"""
+
+  def __init__(self, engine, item, url):
+    self.engine = engine
+    self.item = item
+    self.url = url
+    self.kind = None
+    self.attempts = dict.fromkeys(FAILURE_KINDS, 0)
+
+  def failed(self, error) -> float:
+    """Returns how many seconds to wait before the next attempt. Raises RetryExhausted (after writing the dead letter) once there's none left."""
+    engine = self.engine
+    self.kind = classify(error)
+    self.attempts[self.kind] += 1
+    metrics.count("errors")
+
+    if (engine.breaker and self.kind in SITE_FAILURE_KINDS and engine.breaker.record(False)):
+      rich_print(f"Site error rate above {engine.breaker.error_rate:.0%}. Pausing all workers for {engine.breaker.cooldown}s...", color=ANSI_BRIGHT_YELLOW)
+
+    policy = engine.policies[self.kind]
+    attempt_count = sum(self.attempts.values())
+
+    if (self.attempts[self.kind] >= policy.max_attempts or attempt_count >= MAX_TOTAL_ATTEMPTS):
+      metrics.count("skips")
+
+      if (engine.dead_letters):
+        engine.dead_letters.add(self.item, self.url, self.kind, error, attempt_count)
+
+      raise RetryExhausted(f"RETRY COUNT REACHED ({self.kind}: {error})", self.kind) from error
+
+    metrics.count("retries")
+    return policy.delay(self.attempts[self.kind])
+
+def main():
+  parser = ArgumentParser(description="Prints the items of a dead-letter file as a JSON list, ready for the comment scraper's -t, the anime scraper's -u or the user scraper's -u.")
+  parser.add_argument("dead_letter_file")
+  parser.add_argument("-k", "--kinds", nargs="+", choices=FAILURE_KINDS, help="Only items that failed with these kinds of errors. Defaults to all of them.")
+
+  args = parser.parse_args()
+
+  if (not os.path.exists(args.dead_letter_file)):
+    print(f"Error: Dead-letter file \"{args.dead_letter_file}\" not found.")
+    return 1
+
+  print(dumps(read_dead_letters(args.dead_letter_file, args.kinds), indent=2))
+  return 0
+
+if __name__ == "__main__":
+  exit_code = main()
+  exit(exit_code)
@@ -0,0 +1,60 @@
+import os
+import sqlite3
+from threading import RLock
+from time import time
+
+DEFAULT_SEEN_SET_PATH = "temp/user_scraper/seen.sqlite"
+DEFAULT_TTL_DAYS = 7
+DAY = 24 * 60 * 60
+# Keys per "IN (...)" query, well below SQLite's variable limit
+QUERY_CHUNK_SIZE = 500
+
+class SeenSet:
+  """Persistent set of scraped keys (usernames) with the time each one was last scraped.
+
+  A key stays "fresh" for ttl seconds, repeated runs skip fresh keys and scrape stale
+  ones again. The status is kept too, so a deleted profile isn't requested on every run.
+  Backed by SQLite, every process opens its own SeenSet on the same file.
+  """
+
+  def __init__(self, path=DEFAULT_SEEN_SET_PATH, ttl=DEFAULT_TTL_DAYS * DAY):
+    self.path = path
+    self.ttl = ttl
+
+    if (os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    self.lock = RLock()
+    self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    self._query("PRAGMA journal_mode=WAL")
+    self._query("""CREATE TABLE IF NOT EXISTS seen (
+      key TEXT PRIMARY KEY,
+      status TEXT NOT NULL,
+      seen_at REAL NOT NULL
+    )""")
+
+  def _query(self, sql, params=()):
+    with self.lock:
+      return self.db.execute(sql, params).fetchall()
+
+  def is_fresh(self, key) -> bool:
+    return bool(self._query("SELECT 1 FROM seen WHERE key = ? AND seen_at >= ?", (key, time() - self.ttl)))
+
+  def fresh(self, keys) -> set:
+    """The keys of keys scraped within the TTL"""
+    keys = list(keys)
+    found = set()
+    oldest = time() - self.ttl
+
+    for i in range(0, len(keys), QUERY_CHUNK_SIZE):
+      chunk = keys[i:i + QUERY_CHUNK_SIZE]
+      placeholders = ", ".join("?" * len(chunk))
+      found.update(key for (key,) in self._query(f"SELECT key FROM seen WHERE seen_at >= ? AND key IN ({placeholders})", (oldest, *chunk)))
+
+    return found
+
+  def add(self, key, status="ok"):
+    self._query("INSERT INTO seen (key, status, seen_at) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET status = excluded.status, seen_at = excluded.seen_at", (key, status, time()))
+
+  def close(self):
+    self.db.close()
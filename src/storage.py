@@ -0,0 +1,172 @@
+import os
+import re
+import sqlite3
+from json import dumps, loads
+from sys import exit
+from time import time
+from argparse import ArgumentParser
+from comment_reader import iter_records
+from output import RecordWriter, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+from records import json_default
+
+DEFAULT_DATABASE_PATH = "temp/mal.sqlite"
+DEFAULT_BATCH_SIZE = 500
+DAY = 24 * 60 * 60
+TABLES = ["reviews", "anime", "users"]
+ANIME_ID_PATTERN = re.compile(r"/anime/(\d+)")
+
+def anime_id(url: str) -> int:
+  """The numeric anime id of any anime, review or ranking entry url"""
+  match = ANIME_ID_PATTERN.search(url)
+
+  if (not match):
+    raise ValueError(f"No anime id in \"{url}\"")
+
+  return int(match.group(1))
+
+# Every table keeps the record exactly as exported in "data", next to the columns it's keyed and queried by.
+# Upserts: a review is only replaced by the same or a newer edit, anime records by the latest scrape and
+# user records are merged, so a minimal user record from a review never drops the fields of a scraped profile.
+UPSERTS = {
+  "reviews": ("""INSERT INTO reviews (anime_id, username, timestamp, scraped_at, data) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (username, anime_id) DO UPDATE SET timestamp = excluded.timestamp, scraped_at = excluded.scraped_at, data = excluded.data
+    WHERE excluded.timestamp >= reviews.timestamp""",
+    lambda record: (anime_id(record["page_url"]), record["username"], record["timestamp"])),
+  "anime": ("""INSERT INTO anime (anime_id, scraped_at, data) VALUES (?, ?, ?)
+    ON CONFLICT (anime_id) DO UPDATE SET scraped_at = excluded.scraped_at, data = excluded.data""",
+    lambda record: (anime_id(record["anime_url"]),)),
+  "users": ("""INSERT INTO users (username, scraped_at, data) VALUES (?, ?, ?)
+    ON CONFLICT (username) DO UPDATE SET scraped_at = MAX(users.scraped_at, excluded.scraped_at), data = json_patch(users.data, excluded.data)""",
+    lambda record: (record["username"],))
+}
+
+class Database:
+  """SQLite store of reviews, anime details and users that accumulates every run.
+
+  Records are keyed by their natural keys (anime id from the url, username + anime id
+  for reviews) and upserted, so re-scraping or importing an overlapping export never
+  duplicates anything. Writes are committed in batches of batch_size records.
+  Only one process should write to a database at a time.
+  """
+
+  def __init__(self, path=DEFAULT_DATABASE_PATH, batch_size=DEFAULT_BATCH_SIZE):
+    self.path = path
+    self.batch_size = batch_size
+    self.pending = 0
+    self.counts = dict.fromkeys(TABLES, 0)
+
+    if (os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    self.db = sqlite3.connect(path, timeout=30)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.executescript("""
+      CREATE TABLE IF NOT EXISTS reviews (
+        anime_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        scraped_at REAL NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (username, anime_id)
+      );
+      CREATE INDEX IF NOT EXISTS reviews_anime_id ON reviews (anime_id);
+      CREATE INDEX IF NOT EXISTS reviews_timestamp ON reviews (timestamp);
+      CREATE TABLE IF NOT EXISTS anime (
+        anime_id INTEGER PRIMARY KEY,
+        scraped_at REAL NOT NULL,
+        data TEXT NOT NULL
+      );
+      CREATE INDEX IF NOT EXISTS anime_scraped_at ON anime (scraped_at);
+      CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        scraped_at REAL NOT NULL,
+        data TEXT NOT NULL
+      );
+      CREATE INDEX IF NOT EXISTS users_scraped_at ON users (scraped_at);
+    """)
+
+  def write(self, table, record):
+    sql, keys = UPSERTS[table]
+    self.db.execute(sql, (*keys(record), time(), dumps(record, default=json_default)))
+    self.counts[table] += 1
+    self.pending += 1
+
+    if (self.pending >= self.batch_size):
+      self.commit()
+
+  def write_all(self, table, records):
+    for record in records:
+      self.write(table, record)
+
+  def commit(self):
+    self.db.commit()
+    self.pending = 0
+
+  def count(self, table):
+    return self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+  def iter_records(self, table):
+    """Streams the records of table in the shape the scrapers export them, in order of first insertion"""
+    for (data,) in self.db.execute(f"SELECT data FROM {table} ORDER BY rowid"):
+      yield loads(data)
+
+  def export(self, table, path, output_format=DEFAULT_OUTPUT_FORMAT):
+    """Writes table to path like the scrapers' own output files. Returns the RecordWriter used."""
+    writer = RecordWriter(path, output_format)
+    writer.write_all(self.iter_records(table))
+    writer.close()
+    return writer
+
+  def stale_anime_urls(self, max_age):
+    """Urls of the anime whose details weren't refreshed in the last max_age seconds, oldest first"""
+    rows = self.db.execute("SELECT data FROM anime WHERE scraped_at < ? ORDER BY scraped_at", (time() - max_age,))
+    return [loads(data)["anime_url"] for (data,) in rows]
+
+  def close(self):
+    self.commit()
+    self.db.close()
+
+def main():
+  parser = ArgumentParser(description="Imports scraper exports into the SQLite database, exports its tables in the scrapers' output format and lists anime due for a refresh.")
+  parser.add_argument("database", nargs="?", default=DEFAULT_DATABASE_PATH, help=f"Database file. The default value is {DEFAULT_DATABASE_PATH}.")
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  import_parser = commands.add_parser("import", help="Upserts the records of a JSON or JSON Lines export into a table.")
+  import_parser.add_argument("table", choices=TABLES)
+  import_parser.add_argument("input", nargs="+", help="Export files of the matching scraper.")
+
+  export_parser = commands.add_parser("export", help="Writes a table in the scrapers' output format.")
+  export_parser.add_argument("table", choices=TABLES)
+  export_parser.add_argument("-o", "--output", required=True, help="Output file path.")
+  export_parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT, help=f"Output file format. The default value is {DEFAULT_OUTPUT_FORMAT}.")
+
+  stale_parser = commands.add_parser("stale", help="Prints a JSON list of the anime urls not refreshed in the last --days days, ready for the anime scraper's -u.")
+  stale_parser.add_argument("-d", "--days", type=float, default=7, help="The default value is 7.")
+
+  args = parser.parse_args()
+  database = Database(args.database)
+
+  if (args.command == "import"):
+    for path in args.input:
+      if (not os.path.exists(path)):
+        print(f"Error: Input file \"{path}\" not found.")
+        database.close()
+        return 1
+
+      database.write_all(args.table, iter_records(path))
+
+    database.commit()
+    print(f"Imported {database.counts[args.table]} records, {args.table} now holds {database.count(args.table)}.")
+  elif (args.command == "export"):
+    writer = database.export(args.table, args.output, args.format)
+    print(f"Exported {os.path.basename(args.output)} ({writer.count} records)")
+  else:
+    print(dumps(database.stale_anime_urls(args.days * DAY), indent=2))
+
+  database.close()
+  return 0
+
+if __name__ == "__main__":
+  exit_code = main()
+  exit(exit_code)
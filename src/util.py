@@ -1,7 +1,9 @@
 from datetime import datetime
 from math import log10
+from multiprocessing import Value
 from selenium.webdriver.common.by import By
-from time import sleep
+from time import sleep, time
+from metrics import metrics
 
 ANSI_RED = "\033[31m"
 ANSI_GREEN = "\033[32m"
@@ -22,6 +24,10 @@ ANSI_DEFAULT = "\033[0m"
 ANSI_BOLD = "\033[1m"
 ANSI_UNDERLINE = "\033[4m"
 
+CAPTCHA_SELECTOR = "#captcha-container, .amzn-captcha-modal"
+CAPTCHA_BACKOFF_SECONDS = 30
+CAPTCHA_BACKOFF_MAX_SECONDS = 600
+
 def formatted_timestamp():
    return datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
@@ -40,16 +46,69 @@ def rich_print(*values, color=ANSI_DEFAULT, bold=False, underline=False):
 
   print(f"{style}{text}{ANSI_DEFAULT}")
 
-def check_captcha(driver):
-  captcha_container = driver.find_elements(By.ID, "captcha-container")
-
-  if (captcha_container):
-    rich_print("Captcha found. Waiting for user input...", color=ANSI_BRIGHT_YELLOW)
-
-  while True:
-    sleep(1)
-    if (not driver.find_elements(By.ID, "captcha-container") and not driver.find_elements(By.CLASS_NAME, "amzn-captcha-modal")):
-      break
+class CaptchaBackoff:
+  """Pause shared by every worker process of a run.
+
+  When one worker runs into a captcha, all of them stop navigating until the pause
+  is over, so the other browsers don't keep hammering the site and escalate the block.
+  Every captcha in a row doubles the pause (up to max_seconds), a clean page resets it.
+  Create it in the parent process and hand it to the workers.
+  """
+
+  def __init__(self, seconds=CAPTCHA_BACKOFF_SECONDS, max_seconds=CAPTCHA_BACKOFF_MAX_SECONDS):
+    self.seconds = seconds
+    self.max_seconds = max_seconds
+    self._paused_until = Value("d", 0.0)
+    self._strikes = Value("i", 0)
+
+  def trigger(self):
+    with self._strikes.get_lock():
+      self._strikes.value += 1
+      delay = min(self.seconds * 2 ** (self._strikes.value - 1), self.max_seconds)
+      self._paused_until.value = max(self._paused_until.value, time() + delay)
+
+    return delay
+
+  def reset(self):
+    if (self._strikes.value):
+      with self._strikes.get_lock():
+        self._strikes.value = 0
+
+  def remaining(self) -> float:
+    return max(0.0, self._paused_until.value - time())
+
+  def wait(self):
+    remaining = self._paused_until.value - time()
+
+    if (remaining > 0):
+      rich_print(f"Captcha backoff active. Pausing for {remaining:.0f}s...", color=ANSI_BRIGHT_YELLOW)
+      sleep(remaining)
+      metrics.observe("captcha", remaining)
+
+def element_image_url(img):
+  """Reads an image url from data-src/src, so it doesn't depend on the lazy loader having rendered the image"""
+  return img.get_attribute("data-src") or img.get_attribute("src") or ""
+
+def check_captcha(driver, backoff=None):
+  """Returns straight away on a clean page. On a captcha, triggers the shared backoff and waits for the user to solve it."""
+  with metrics.time("captcha"):
+    if (not driver.find_elements(By.CSS_SELECTOR, CAPTCHA_SELECTOR)):
+      if (backoff):
+        backoff.reset()
+      return False
+
+    metrics.count("captchas")
+
+    if (backoff):
+      delay = backoff.trigger()
+      rich_print(f"Captcha found. Pausing all workers for {delay}s. Waiting for user input...", color=ANSI_BRIGHT_YELLOW)
+    else:
+      rich_print("Captcha found. Waiting for user input...", color=ANSI_BRIGHT_YELLOW)
+
+    while (driver.find_elements(By.CSS_SELECTOR, CAPTCHA_SELECTOR)):
+      sleep(1)
+
+    return True
   
 def chunkify(lst, n):
     """Split lst into n roughly equal chunks"""
@@ -64,6 +123,9 @@ def get_size_displayable(size_bytes: int, decimal_count=2) -> str:
     9: "GB"
   }
 
+  if (size_bytes <= 0):
+    return f"{0:.{decimal_count}f} B"
+
   n_log = int(log10(size_bytes))
   pow_10 = max(k for k in size_abbreviations.keys() if k <= n_log)
     
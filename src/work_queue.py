@@ -0,0 +1,195 @@
+import multiprocessing
+from collections import Counter, deque
+from queue import Empty
+from time import monotonic
+from metrics import metrics
+
+WORKER_POLL_INTERVAL = 1
+
+def worker_lookahead(worker) -> int:
+  """How many items a worker wants ahead of the one it's processing: its lookahead, if it has a prefetch(item)"""
+  return getattr(worker, "lookahead", 0) if hasattr(worker, "prefetch") else 0
+
+def prefetch_item(worker, item):
+  try:
+    worker.prefetch(item)
+  except Exception:
+    # Prefetching is only a head start, process(item) still loads whatever didn't make it
+    pass
+
+def _iter_tasks(task_queue, worker, taken_ahead=None):
+  """Yields task_queue's items up to its None, handing the ones taken ahead to worker.prefetch
+  and taken_ahead(item) (see run_work_queue)"""
+  lookahead = worker_lookahead(worker)
+  ahead = deque()
+  is_exhausted = False
+
+  while (True):
+    while (not is_exhausted and len(ahead) <= lookahead):
+      try:
+        # Only waits for an item when there's nothing to work on, never to fill the lookahead
+        item = task_queue.get_nowait() if ahead else task_queue.get()
+      except Empty:
+        break
+
+      if (item is None):
+        is_exhausted = True
+        break
+
+      if (ahead):
+        if (taken_ahead):
+          taken_ahead(item)
+
+        prefetch_item(worker, item)
+
+      ahead.append(item)
+
+    if (not ahead):
+      return
+
+    yield ahead.popleft()
+
+def _worker_main(worker_id, worker_factory, task_queue, result_queue, label=None):
+  # Forked workers start with a copy of the parent's metrics
+  metrics.reset(label or f"worker-{worker_id}")
+  worker = worker_factory()
+
+  try:
+    for item in _iter_tasks(task_queue, worker, lambda item: result_queue.put(("ahead", worker_id, item, None))):
+      result_queue.put(("start", worker_id, item, None))
+
+      try:
+        for value in worker.process(item):
+          result_queue.put(("result", worker_id, item, value))
+      except Exception as e:
+        result_queue.put(("metrics", worker_id, None, metrics.drain()))
+        result_queue.put(("error", worker_id, item, str(e)))
+        continue
+
+      result_queue.put(("metrics", worker_id, None, metrics.drain()))
+      result_queue.put(("done", worker_id, item, None))
+  finally:
+    worker.close()
+    result_queue.put(("metrics", worker_id, None, metrics.drain()))
+    result_queue.put(("exit", worker_id, None, None))
+
+def run_work_queue(items, worker_factory, worker_count: int):
+  """Processes items with worker_count worker processes pulling from one shared queue.
+
+  worker_factory is called once in every process and must return an object with a
+  process(item) generator and a close() method. Workers take the next item only when
+  they're free, so one slow item holds up a single worker instead of a whole chunk.
+  Workers that also have a prefetch(item) method and a lookahead count take up to that
+  many items that are already queued ahead of the current one, and get prefetch(item)
+  for each of them, e.g. to load their pages in the background. When such a worker
+  dies, the items it took ahead fail along with the one it was processing (or at the
+  end of the run, if it died before reporting them).
+  What workers record in metrics.metrics is merged into the parent's after every item.
+
+  Yields (event, item, value) tuples as workers report them:
+    ("result", item, value) for every value yielded by process(item)
+    ("done", item, None) once process(item) finished
+    ("error", item, message) if process(item) raised or its worker process died
+  """
+  items = list(items)
+  worker_count = max(1, min(worker_count, len(items)))
+
+  if (not items):
+    return
+
+  task_queue = multiprocessing.Queue()
+  result_queue = multiprocessing.Queue()
+
+  for item in items:
+    task_queue.put(item)
+
+  for _ in range(worker_count):
+    task_queue.put(None)
+
+  def spawn(worker_id):
+    process = multiprocessing.Process(target=_worker_main, args=(worker_id, worker_factory, task_queue, result_queue), daemon=True)
+    process.start()
+    return process
+
+  workers = {worker_id: spawn(worker_id) for worker_id in range(worker_count)}
+  in_flight = {}
+  # Items each worker took ahead of its current one, in the order it'll start them
+  taken_ahead = {}
+  started_by = Counter()
+  unfinished = Counter(items)
+  next_worker_id = worker_count
+
+  def handle(event, worker_id, item, value):
+    if (event == "ahead"):
+      taken_ahead.setdefault(worker_id, []).append(item)
+    elif (event == "start"):
+      in_flight[worker_id] = item
+      started_by[worker_id] += 1
+
+      if (item in taken_ahead.get(worker_id, [])):
+        taken_ahead[worker_id].remove(item)
+    elif (event == "metrics"):
+      metrics.merge(value)
+    elif (event == "exit"):
+      workers.pop(worker_id).join()
+    else:
+      if (event != "result"):
+        in_flight.pop(worker_id, None)
+        unfinished[item] -= 1
+      yield (event, item, value)
+
+  def check_workers():
+    # A worker that died (e.g. the browser took the process down) never reports back.
+    # Fail its current item and start a replacement so the remaining queue still drains.
+    nonlocal next_worker_id
+    dead = {worker_id for worker_id, process in workers.items() if not process.is_alive()}
+
+    # Whatever a dead worker reported before dying is already in the queue, so it's handled first
+    while (dead):
+      try:
+        message = result_queue.get_nowait()
+      except Empty:
+        break
+
+      yield from handle(*message)
+
+    for worker_id in dead & workers.keys():
+      process = workers.pop(worker_id)
+      lost_items = ([in_flight.pop(worker_id)] if worker_id in in_flight else []) + taken_ahead.pop(worker_id, [])
+
+      for item in lost_items:
+        unfinished[item] -= 1
+        yield ("error", item, f"Worker exited with code {process.exitcode}")
+
+      # Workers that never got an item running are not replaced, so a factory that always fails can't loop forever
+      if (started_by[worker_id]):
+        # The dead worker may have taken its None already (e.g. looking ahead), the replacement gets its own
+        task_queue.put(None)
+        workers[next_worker_id] = spawn(next_worker_id)
+        next_worker_id += 1
+
+  try:
+    next_check = monotonic() + WORKER_POLL_INTERVAL
+
+    while (workers):
+      try:
+        message = result_queue.get(timeout=WORKER_POLL_INTERVAL)
+      except Empty:
+        message = None
+
+      if (message):
+        yield from handle(*message)
+
+      # Checked on a timer rather than only when the queue goes quiet, or a dead worker
+      # would go unnoticed for as long as the others keep reporting
+      if (monotonic() >= next_check):
+        yield from check_workers()
+        next_check = monotonic() + WORKER_POLL_INTERVAL
+
+    # Items are left over if every worker died, or a worker died before its "start" message got through
+    for item, count in unfinished.items():
+      for _ in range(count):
+        yield ("error", item, "Item was never finished by a worker")
+  finally:
+    for process in workers.values():
+      process.terminate()
@@ -0,0 +1,32 @@
+import os
+import sys
+from functools import partial
+from threading import Thread
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import pytest
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_FOLDER = os.path.join(ROOT_FOLDER, "benchmarks", "fixtures")
+# The scrapers are scripts importing each other from src, not a package
+sys.path.insert(0, os.path.join(ROOT_FOLDER, "src"))
+
+class QuietHandler(SimpleHTTPRequestHandler):
+  def log_message(self, format, *args):
+    pass
+
+@pytest.fixture
+def serve_folder():
+  """Serves folders over HTTP on localhost. serve_folder(folder, handler) returns the base url."""
+  servers = []
+
+  def serve(folder, handler=QuietHandler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=str(folder)))
+    Thread(target=server.serve_forever, daemon=True).start()
+    servers.append(server)
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+  yield serve
+
+  for server in servers:
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import glob
+import subprocess
+from conftest import QuietHandler, FIXTURES_FOLDER, ROOT_FOLDER
+from checkpoint import JOURNAL_FILE_NAME
+from mal_parser import extract_ranking_entries
+
+RANKING_COUNT = 48
+
+class RankingHandler(QuietHandler):
+  def translate_path(self, path):
+    return os.path.join(FIXTURES_FOLDER, "ranking_0.html")
+
+def run_scraper(folder, *args):
+  return subprocess.run([sys.executable, os.path.join(ROOT_FOLDER, "src", "mal_anime_scraper.py"), *args], cwd=folder, capture_output=True, text=True, timeout=120)
+
+def write_previous_details(path):
+  with open(os.path.join(FIXTURES_FOLDER, "ranking_0.html"), "r", encoding="utf-8") as f:
+    rows = extract_ranking_entries(f.read())[:RANKING_COUNT]
+
+  with open(path, "w", encoding="utf-8") as f:
+    for row in rows:
+      f.write(json.dumps({"anime": "Old name", "english_name": "English name", "cover": "", "anime_url": row["anime_url"], "score": 1.0, "reviews": 7, "members": 1, "ranking": 999, "popularity": 5, "synopsis": "Synopsis", "genres": ["Action"]}) + "\n")
+
+def read_jsonl(path):
+  with open(path, "r", encoding="utf-8") as f:
+    return [json.loads(line) for line in f]
+
+def test_light_mode_through_a_resume(tmp_path, serve_folder):
+  source_urls = tmp_path / "sources.json"
+  source_urls.write_text(json.dumps([f"{serve_folder(FIXTURES_FOLDER, RankingHandler)}/topanime.php"]))
+  write_previous_details(tmp_path / "previous.jsonl")
+  light_args = ["--detail-mode", "light", "--previous-details", "previous.jsonl", "-f", "jsonl", "-w", "1"]
+
+  first_run = run_scraper(tmp_path, "--ranking", "-s", "sources.json", "-l", str(RANKING_COUNT), "-p", "1", "-o", "first.jsonl", *light_args)
+  assert first_run.returncode == 0, first_run.stderr
+  [state_folder] = glob.glob(str(tmp_path / "temp" / "anime_details" / "state_*"))
+
+  # As if the run had died after its first 10 anime
+  journal_path = os.path.join(state_folder, JOURNAL_FILE_NAME)
+
+  with open(journal_path, "r", encoding="utf-8") as f:
+    lines = f.readlines()
+
+  with open(journal_path, "w", encoding="utf-8") as f:
+    f.writelines(lines[:20])
+
+  resumed_run = run_scraper(tmp_path, "--resume", state_folder, "-o", "resumed.jsonl", *light_args)
+  assert resumed_run.returncode == 0, resumed_run.stderr
+  assert f"LIGHT MODE: {RANKING_COUNT - 10} anime refreshed" in resumed_run.stdout
+
+  records = read_jsonl(tmp_path / "resumed.jsonl")
+
+  assert records == read_jsonl(tmp_path / "first.jsonl")
+  assert len({record["anime_url"] for record in records}) == RANKING_COUNT
+  # Refreshed from the ranking rows, with the rest of the fields from the previous records
+  assert all(record["ranking"] != 999 and record["synopsis"] == "Synopsis" for record in records)
+
+def test_light_mode_resume_needs_a_ranking_run(tmp_path):
+  state_folder = tmp_path / "state"
+  state_folder.mkdir()
+  (state_folder / "urls.json").write_text(json.dumps(["https://myanimelist.net/anime/1"]))
+
+  run = run_scraper(tmp_path, "--resume", str(state_folder), "-o", "out.jsonl", "--detail-mode", "light")
+
+  assert "The light detail mode needs --ranking" in run.stdout
+  assert not (tmp_path / "out.jsonl").exists()
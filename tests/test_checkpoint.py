@@ -0,0 +1,109 @@
+import json
+from checkpoint import Journal, JOURNAL_FILE_NAME, URLS_FILE_NAME, load_state_urls
+from records import AnimeDetails
+
+def journal_lines(folder):
+  with open(folder / JOURNAL_FILE_NAME, "r", encoding="utf-8") as f:
+    return f.read().splitlines()
+
+def test_resume_skips_finished_items(tmp_path):
+  journal = Journal(str(tmp_path))
+  journal.record("a", {"n": 1})
+  journal.done("a")
+  journal.record("b", {"n": 2})
+  journal.close()
+
+  journal = Journal(str(tmp_path))
+
+  assert journal.pending(["a", "b", "c"]) == ["b", "c"]
+  # "b" never finished, its record is scraped again instead of kept
+  assert list(journal.iter_records()) == [{"n": 1}]
+  assert journal.record_count == 1
+  journal.close()
+
+def test_page_checkpoints(tmp_path):
+  journal = Journal(str(tmp_path))
+  journal.record("anime", {"review": 1})
+  journal.page("anime", {"page": 1, "next": "?p=2"})
+  journal.record("anime", {"review": 2})
+  journal.close()
+
+  journal = Journal(str(tmp_path))
+
+  assert journal.pages == {"anime": {"page": 1, "next": "?p=2"}}
+  assert journal.pending(["anime"]) == ["anime"]
+  assert list(journal.iter_records(with_items=True)) == [("anime", {"review": 1})]
+
+  # The resumed run scrapes page 2 again and finishes the anime
+  journal.record("anime", {"review": 2})
+  journal.done("anime")
+  journal.close()
+
+  journal = Journal(str(tmp_path))
+
+  assert journal.pages == {}
+  assert journal.pending(["anime"]) == []
+  assert list(journal.iter_records()) == [{"review": 1}, {"review": 2}]
+  journal.close()
+
+def test_torn_last_line(tmp_path):
+  journal = Journal(str(tmp_path))
+  journal.record("a", {"n": 1})
+  journal.done("a")
+  journal.close()
+
+  # The previous run died in the middle of a line
+  with open(tmp_path / JOURNAL_FILE_NAME, "a", encoding="utf-8") as f:
+    f.write('{"type": "record", "item": "b", "val')
+
+  journal = Journal(str(tmp_path))
+
+  assert list(journal.iter_records()) == [{"n": 1}]
+  journal.record("b", {"n": 2})
+  journal.done("b")
+  journal.close()
+
+  lines = journal_lines(tmp_path)
+  # The torn line stays on its own and the new entries start on a fresh line
+  assert lines[2] == '{"type": "record", "item": "b", "val'
+  assert [json.loads(line)["type"] for line in lines[3:]] == ["resume", "record", "done"]
+
+  journal = Journal(str(tmp_path))
+
+  assert journal.pending(["a", "b"]) == []
+  assert list(journal.iter_records()) == [{"n": 1}, {"n": 2}]
+  journal.close()
+
+def test_records_written_after_replay_are_not_replayed_twice(tmp_path):
+  journal = Journal(str(tmp_path))
+  journal.record("a", {"n": 1})
+  journal.done("a")
+  journal.close()
+
+  journal = Journal(str(tmp_path))
+  journal.record("b", {"n": 2})
+  journal.done("b")
+
+  # Only what was in the journal when the run started
+  assert list(journal.iter_records()) == [{"n": 1}]
+  journal.close()
+
+def test_records_are_read_back_as_record_type(tmp_path):
+  details = AnimeDetails(anime="Cowboy Bebop", anime_url="https://myanimelist.net/anime/1", genres=["Action"])
+
+  journal = Journal(str(tmp_path))
+  journal.record(details.anime_url, details)
+  journal.done(details.anime_url)
+  journal.close()
+
+  journal = Journal(str(tmp_path))
+
+  assert list(journal.iter_records()) == [details.to_dict()]
+  assert list(journal.iter_records(with_items=True, record_type=AnimeDetails)) == [(details.anime_url, details)]
+  journal.close()
+
+def test_state_urls(tmp_path):
+  with open(tmp_path / URLS_FILE_NAME, "w") as f:
+    json.dump(["https://myanimelist.net/anime/1"], f)
+
+  assert load_state_urls(str(tmp_path)) == ["https://myanimelist.net/anime/1"]
@@ -0,0 +1,24 @@
+import json
+import pytest
+from mal_cluster import seed_items
+
+ANIME_URL = "https://myanimelist.net/anime/1/Cowboy_Bebop"
+
+def write_json(path, data):
+  path.write_text(json.dumps(data), encoding="utf-8")
+  return str(path)
+
+def test_seed_items_from_exports(tmp_path):
+  reviews = write_json(tmp_path / "reviews.json", [{"page_url": ANIME_URL, "username": "someone"}])
+  details = write_json(tmp_path / "anime_details.json", [{"anime": "Cowboy Bebop", "anime_url": ANIME_URL}])
+  urls = write_json(tmp_path / "urls.json", [ANIME_URL])
+
+  assert list(seed_items("details", [details, reviews, urls])) == [ANIME_URL] * 3
+  assert list(seed_items("reviews", [reviews, details, urls])) == [ANIME_URL + "/reviews"] * 3
+  assert list(seed_items("users", [reviews])) == ["someone"]
+
+def test_seed_items_without_the_field(tmp_path):
+  details = write_json(tmp_path / "anime_details.json", [{"anime": "Cowboy Bebop", "anime_url": ANIME_URL}])
+
+  with pytest.raises(ValueError, match="username"):
+    list(seed_items("users", [details]))
@@ -0,0 +1,66 @@
+import pytest
+from columnar import ColumnarWriter, read_columns, COLUMNAR_FORMATS, FORMAT_MODULES
+from comment_reader import iter_records
+
+REVIEWS = [
+  {
+    "page_url": "https://myanimelist.net/anime/1/Cowboy_Bebop/reviews",
+    "anime": "Cowboy Bebop",
+    "username": "someone",
+    "avatar": "https://cdn.myanimelist.net/images/userimages/1.jpg",
+    "timestamp": 1700000000,
+    "feelings": 3,
+    "review_text": "Still the best. 最高"
+  },
+  {
+    "page_url": "https://myanimelist.net/anime/1/Cowboy_Bebop/reviews",
+    "anime": "Cowboy Bebop",
+    "username": "someone else",
+    "avatar": None,
+    "timestamp": 1600000000,
+    "feelings": 1,
+    "review_text": ""
+  },
+  {
+    "page_url": "https://myanimelist.net/anime/5/Cowboy_Bebop__Tengoku_no_Tobira/reviews",
+    "anime": "Cowboy Bebop: Tengoku no Tobira",
+    "username": "someone",
+    "avatar": "",
+    "timestamp": 2 ** 40,
+    "feelings": 2,
+    "review_text": "Line one\nline two"
+  }
+]
+
+@pytest.fixture(params=COLUMNAR_FORMATS)
+def output_format(request):
+  for module_name in FORMAT_MODULES[request.param]:
+    pytest.importorskip(module_name)
+
+  return request.param
+
+def write(path, reviews, output_format):
+  writer = ColumnarWriter(str(path), output_format)
+  writer.write_all(reviews)
+  return writer.close()
+
+def test_round_trip(tmp_path, output_format):
+  path = tmp_path / f"reviews.{output_format}"
+  write(path, REVIEWS, output_format)
+
+  records = list(iter_records(str(path)))
+
+  assert records == REVIEWS
+  # A missing avatar stays missing instead of turning into an empty one
+  assert records[1]["avatar"] is None and records[2]["avatar"] == ""
+
+  for record in records:
+    assert type(record["timestamp"]) is int and type(record["feelings"]) is int
+    assert all(type(record[name]) is str for name in ["page_url", "anime", "username", "review_text"])
+
+def test_empty_export(tmp_path, output_format):
+  path = tmp_path / f"reviews.{output_format}"
+  write(path, [], output_format)
+
+  assert all(values == [] for values in read_columns(str(path)).values())
+  assert list(iter_records(str(path))) == []
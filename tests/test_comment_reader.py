@@ -0,0 +1,63 @@
+import json
+import pytest
+import comment_reader
+from comment_reader import iter_records, count_anime_pages
+
+RECORDS = [
+  {
+    "page_url": f"https://myanimelist.net/anime/{i % 3}",
+    "text": "Line one\nline \"two\", with ] and } in it " * (i % 4),
+    "score": i,
+  }
+  for i in range(20)
+]
+
+def write_json(path, records, **kwargs):
+  path.write_text(json.dumps(records, **kwargs), encoding="utf-8")
+  return str(path)
+
+def write_jsonl(path, records):
+  path.write_text("".join(json.dumps(record) + "\n" for record in records), encoding="utf-8")
+  return str(path)
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_json_array_across_chunk_boundaries(tmp_path, monkeypatch, chunk_size):
+  monkeypatch.setattr(comment_reader, "READ_CHUNK_SIZE", chunk_size)
+
+  assert list(iter_records(write_json(tmp_path / "compact.json", RECORDS))) == RECORDS
+  assert list(iter_records(write_json(tmp_path / "indented.json", RECORDS, indent=2))) == RECORDS
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_nested_worker_chunks(tmp_path, monkeypatch, chunk_size):
+  monkeypatch.setattr(comment_reader, "READ_CHUNK_SIZE", chunk_size)
+  path = write_json(tmp_path / "nested.json", [RECORDS[:5], RECORDS[5:]], indent=2)
+
+  assert list(iter_records(path)) == RECORDS
+
+def test_jsonl(tmp_path):
+  path = write_jsonl(tmp_path / "records.jsonl", RECORDS)
+
+  assert list(iter_records(path)) == RECORDS
+
+def test_empty_files(tmp_path):
+  assert list(iter_records(write_json(tmp_path / "empty.json", []))) == []
+
+  (tmp_path / "blank.jsonl").write_text("\n  \n", encoding="utf-8")
+  assert list(iter_records(str(tmp_path / "blank.jsonl"))) == []
+
+def test_truncated_array(tmp_path, monkeypatch):
+  monkeypatch.setattr(comment_reader, "READ_CHUNK_SIZE", 16)
+  path = tmp_path / "truncated.json"
+  path.write_text(json.dumps(RECORDS)[:-40], encoding="utf-8")
+
+  with pytest.raises(ValueError):
+    list(iter_records(str(path)))
+
+def test_count_anime_pages(tmp_path):
+  path = write_jsonl(tmp_path / "records.jsonl", RECORDS)
+
+  assert count_anime_pages(path) == {
+    "https://myanimelist.net/anime/0": 7,
+    "https://myanimelist.net/anime/1": 7,
+    "https://myanimelist.net/anime/2": 6,
+  }
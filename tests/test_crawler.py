@@ -0,0 +1,64 @@
+import asyncio
+from threading import Thread
+from conftest import QuietHandler
+from crawler import AsyncCrawler
+from page_cache import PageCache
+
+async def fetch_status(crawler, url):
+  response = await crawler.fetch(url)
+  yield response.status
+
+def test_cached_pages_skip_requests(tmp_path, serve_folder):
+  (tmp_path / "site").mkdir()
+  (tmp_path / "site" / "page.html").write_text("<html>page</html>")
+  requests = []
+
+  class CountingHandler(QuietHandler):
+    def do_GET(self):
+      requests.append(self.path)
+      super().do_GET()
+
+  url = f"{serve_folder(tmp_path / 'site', CountingHandler)}/page.html"
+  cache = PageCache(str(tmp_path / "cache"))
+
+  try:
+    for _ in range(2):
+      crawler = AsyncCrawler(4, 100, 4, cache=cache)
+
+      try:
+        assert list(crawler.run([url], fetch_status)) == [("result", url, 200), ("done", url, None)]
+      finally:
+        crawler.close()
+  finally:
+    cache.close()
+
+  assert requests == ["/page.html"]
+  assert crawler.stats.cache_hits == 1
+
+def test_closing_early_cancels_the_crawl():
+  cancelled = []
+
+  async def handler(crawler, item):
+    if (item == "slow"):
+      try:
+        await asyncio.sleep(3600)
+      except asyncio.CancelledError:
+        cancelled.append(item)
+        raise
+
+    yield item
+
+  crawler = AsyncCrawler(4, 100, 4)
+  events = crawler.run(["fast", "slow"], handler)
+
+  def consume_one():
+    assert next(events) == ("result", "fast", "fast")
+    events.close()
+
+  thread = Thread(target=consume_one, daemon=True)
+  thread.start()
+  thread.join(10)
+  crawler.close()
+
+  assert not thread.is_alive()
+  assert cancelled == ["slow"]
@@ -0,0 +1,77 @@
+import os
+import shutil
+import pytest
+from conftest import FIXTURES_FOLDER
+import mal_anime_scraper
+from mal_anime_scraper import AnimeDetailsWorker, build_anime_record
+from mal_parser import ParseError, CaptchaError, extract_anime_details
+
+def read_fixture(file_name):
+  with open(os.path.join(FIXTURES_FOLDER, file_name), "r", encoding="utf-8") as f:
+    return f.read()
+
+@pytest.mark.parametrize("file_name, expected", [
+  ("anime_5114.html", {"anime": "Fullmetal Alchemist: Brotherhood", "english_name": None, "score": "9.10", "ranking": "2", "popularity": "3", "members": "3,609,474", "reviews": "2,214,512", "genres": ["Action", "Adventure", "Drama", "Fantasy"]}),
+  ("anime_52991.html", {"anime": "Sousou no Frieren", "english_name": "Frieren: Beyond Journey's End", "score": "9.29", "ranking": "1", "popularity": "120", "members": "1,282,536", "reviews": "773,351", "genres": ["Adventure", "Drama", "Fantasy"]})
+])
+def test_extract_anime_details(file_name, expected):
+  details = extract_anime_details(read_fixture(file_name), file_name)
+
+  for name, value in expected.items():
+    assert details[name] == value
+
+  assert details["cover"].startswith("https://cdn.myanimelist.net/images/anime/")
+  assert details["synopsis"] and "\n" not in details["synopsis"]
+
+def test_extract_anime_details_missing_field():
+  with pytest.raises(ParseError):
+    extract_anime_details("<html><body><p>Nothing here</p></body></html>", "empty")
+
+def test_extract_anime_details_captcha():
+  with pytest.raises(CaptchaError):
+    extract_anime_details("<html><body><div id=\"captcha-container\"></div></body></html>", "captcha")
+
+@pytest.fixture
+def anime_site(tmp_path, serve_folder):
+  """The anime fixtures, plus a page the parser doesn't understand, on a local server"""
+  for file_name in ("anime_5114.html", "anime_52991.html"):
+    shutil.copy(os.path.join(FIXTURES_FOLDER, file_name), tmp_path / file_name)
+
+  (tmp_path / "redesigned.html").write_text("<html><body><h1 class=\"new-title\">Sousou no Frieren</h1></body></html>", encoding="utf-8")
+  return serve_folder(str(tmp_path))
+
+def test_http_engine(anime_site, monkeypatch):
+  def no_browser(*args):
+    raise AssertionError("The HTTP engine started the browser on a page it can parse")
+
+  monkeypatch.setattr(mal_anime_scraper, "extract_details_selenium", no_browser)
+  worker = AnimeDetailsWorker(False, engine="http")
+
+  try:
+    records = [record for page in ("anime_5114.html", "anime_52991.html") for record in worker.process(f"{anime_site}/{page}")]
+  finally:
+    worker.close()
+
+  assert [record["anime"] for record in records] == ["Fullmetal Alchemist: Brotherhood", "Sousou no Frieren"]
+  assert records[1]["score"] == 9.29 and records[1]["members"] == 1282536 and records[1]["ranking"] == 1
+  assert records[1]["anime_url"] == f"{anime_site}/anime_52991.html"
+  assert worker.browser.driver is None
+
+def test_selenium_fallback_on_parse_error(anime_site, monkeypatch):
+  browser_pages = []
+  details = extract_anime_details(read_fixture("anime_52991.html"), "anime_52991.html")
+
+  def fake_browser_extraction(browser, anime_page, backoff=None):
+    browser_pages.append(anime_page)
+    return details
+
+  monkeypatch.setattr(mal_anime_scraper, "extract_details_selenium", fake_browser_extraction)
+  worker = AnimeDetailsWorker(False, engine="http")
+
+  try:
+    records = list(worker.process(f"{anime_site}/redesigned.html"))
+  finally:
+    worker.close()
+
+  assert browser_pages == [f"{anime_site}/redesigned.html"]
+  assert records == [build_anime_record(f"{anime_site}/redesigned.html", details)]
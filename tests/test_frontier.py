@@ -0,0 +1,106 @@
+import multiprocessing
+from functools import partial
+from time import sleep, monotonic
+from frontier import Frontier, run_node
+
+LEASE_SECONDS = 1
+
+class StubWorker:
+  """Work queue style worker yielding one result per item, tagged with the node that scraped it"""
+
+  def __init__(self, node, seconds=0.05):
+    self.node = node
+    self.seconds = seconds
+
+  def process(self, item):
+    sleep(self.seconds)
+    yield {"item": item, "node": self.node}
+
+  def close(self):
+    pass
+
+class HangingWorker(StubWorker):
+  def process(self, item):
+    sleep(3600)
+    yield from ()
+
+class ReviewStubWorker(StubWorker):
+  def process(self, item):
+    yield {"page_url": item, "username": f"user-{item}"}
+
+def ignore_log(message):
+  pass
+
+def follow_up_route(kind, item, value):
+  return [("details", value["page_url"])] if kind == "reviews" else []
+
+def start_node(path, node, worker_class, batch_size):
+  process = multiprocessing.Process(target=run_node, args=(path, {"pages": partial(worker_class, node)}, batch_size, LEASE_SECONDS, False, node, ignore_log))
+  process.start()
+  return process
+
+def wait_for(condition, timeout=30):
+  started = monotonic()
+
+  while (not condition()):
+    assert monotonic() - started < timeout, "Timed out"
+    sleep(0.05)
+
+def test_dead_node_items_are_released_and_stored_once(tmp_path):
+  path = str(tmp_path / "frontier.sqlite")
+  frontier = Frontier(path)
+  items = [f"item-{i}" for i in range(12)]
+  frontier.add("pages", items)
+
+  # Leases a batch and dies in the middle of it
+  doomed = start_node(path, "doomed", HangingWorker, 3)
+  leased_by_doomed = lambda: frontier.db.execute("SELECT item FROM items WHERE lease_owner = 'doomed'").fetchall()
+  wait_for(lambda: len(leased_by_doomed()) == 3)
+  doomed_items = {item for (item,) in leased_by_doomed()}
+  doomed.kill()
+  doomed.join()
+
+  nodes = [start_node(path, f"node-{i}", StubWorker, 2) for i in range(3)]
+
+  for process in nodes:
+    process.join(60)
+    assert process.exitcode == 0
+
+  results = frontier.results(limit=100)
+  stored_items = [value["item"] for _, _, _, value in results]
+
+  assert sorted(stored_items) == sorted(items)
+  assert frontier.counts()["pages"]["done"] == len(items)
+  assert frontier.is_drained()
+
+  for _, _, item, value in results:
+    assert value["node"] != "doomed"
+
+  attempts = dict(frontier.db.execute("SELECT item, attempts FROM items").fetchall())
+  assert all(attempts[item] == 2 for item in doomed_items)
+  frontier.close()
+
+def test_completion_is_stored_once(tmp_path):
+  frontier = Frontier(str(tmp_path / "frontier.sqlite"))
+  frontier.add("pages", ["item"])
+  assert frontier.lease("first", ["pages"], 1, lease_seconds=0) == [("pages", "item")]
+
+  # The lease of "first" expired, so "second" got the item too
+  sleep(0.01)
+  assert frontier.lease("second", ["pages"], 1) == [("pages", "item")]
+  assert frontier.complete("second", "pages", "item", [{"node": "second"}])
+  assert not frontier.complete("first", "pages", "item", [{"node": "first"}])
+  assert [value for _, _, _, value in frontier.results()] == [{"node": "second"}]
+  frontier.close()
+
+def test_follow_ups_are_worked_before_the_node_exits(tmp_path):
+  path = str(tmp_path / "frontier.sqlite")
+  frontier = Frontier(path)
+  frontier.add("reviews", ["anime-1", "anime-2"])
+
+  finished_count = run_node(path, {"reviews": partial(ReviewStubWorker, "node"), "details": partial(StubWorker, "node", 0)}, route=follow_up_route, node="node", log=ignore_log)
+
+  assert finished_count == 4
+  assert frontier.counts()["details"]["done"] == 2
+  assert frontier.is_drained()
+  frontier.close()
@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+from time import monotonic
+from functools import partial
+import pytest
+from conftest import QuietHandler
+import mal_image_downloader
+from mal_image_downloader import fetch_image
+from crawler import AsyncCrawler
+from retry import RetryEngine, RetryPolicy
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"cover" * 50
+JPEG_BYTES = b"\xff\xd8\xff\xe0" + b"avatar" * 50
+
+@pytest.fixture
+def image_folder(tmp_path):
+  folder = tmp_path / "cdn"
+  (folder / "images").mkdir(parents=True)
+  (folder / "images" / "cover.png").write_bytes(PNG_BYTES)
+  # Same bytes under another url, like the default avatar
+  (folder / "images" / "cover_copy.png").write_bytes(PNG_BYTES)
+  (folder / "images" / "avatar.jpg").write_bytes(JPEG_BYTES)
+  return folder
+
+def write_export(path, base_url):
+  records = [
+    {"anime": "A", "cover": f"{base_url}/images/cover.png"},
+    {"anime": "B", "cover": f"{base_url}/images/cover_copy.png", "avatar": f"{base_url}/images/avatar.jpg"},
+    {"anime": "C", "cover": f"{base_url}/images/gone.jpg", "avatar": f"{base_url}/images/avatar.jpg"}
+  ]
+
+  with open(path, "w", encoding="utf-8") as f:
+    for record in records:
+      f.write(json.dumps(record) + "\n")
+
+def read_manifest(folder):
+  with open(folder / "manifest.jsonl", "r", encoding="utf-8") as f:
+    return {entry["url"]: entry for entry in map(json.loads, f)}
+
+def run_downloader(monkeypatch, *args):
+  monkeypatch.setattr(sys, "argv", ["mal_image_downloader.py", *args])
+  assert mal_image_downloader.main() == 0
+
+def test_dedup_and_manifest_replay(tmp_path, image_folder, serve_folder, monkeypatch):
+  requests = []
+
+  class CountingHandler(QuietHandler):
+    def do_GET(self):
+      requests.append(self.path)
+      super().do_GET()
+
+  base_url = serve_folder(image_folder, CountingHandler)
+  export_path = tmp_path / "details.jsonl"
+  output_folder = tmp_path / "images"
+  write_export(export_path, base_url)
+
+  run_downloader(monkeypatch, str(export_path), "-o", str(output_folder))
+  manifest = read_manifest(output_folder)
+
+  assert sorted(requests) == ["/images/avatar.jpg", "/images/cover.png", "/images/cover_copy.png", "/images/gone.jpg"]
+  assert manifest[f"{base_url}/images/cover.png"]["sha256"] == manifest[f"{base_url}/images/cover_copy.png"]["sha256"]
+  assert manifest[f"{base_url}/images/gone.jpg"] == {"url": f"{base_url}/images/gone.jpg", "status": 404}
+
+  stored_files = sorted(name for _, _, names in os.walk(output_folder) for name in names if name != "manifest.jsonl")
+  assert len(stored_files) == 2
+  assert sorted(name.rsplit(".", 1)[1] for name in stored_files) == ["jpg", "png"]
+
+  cover_path = output_folder / manifest[f"{base_url}/images/cover.png"]["path"]
+  assert cover_path.read_bytes() == PNG_BYTES
+
+  # A second run replays the manifest and requests nothing
+  requests.clear()
+  run_downloader(monkeypatch, str(export_path), "-o", str(output_folder))
+
+  assert requests == []
+  assert read_manifest(output_folder) == manifest
+
+def test_rate_limit_backs_off(image_folder, serve_folder):
+  request_times = []
+
+  class RateLimitedHandler(QuietHandler):
+    def do_GET(self):
+      request_times.append(monotonic())
+
+      if (len(request_times) == 1):
+        self.send_error(429)
+      else:
+        super().do_GET()
+
+  url = f"{serve_folder(image_folder, RateLimitedHandler)}/images/cover.png"
+  retry = RetryEngine(policies={"rate_limit": RetryPolicy(3, 0.5, 0.5)})
+  crawler = AsyncCrawler(4, 100, 4)
+
+  try:
+    events = list(crawler.run([url], partial(fetch_image, retry=retry)))
+  finally:
+    crawler.close()
+
+  assert [(event, value[0]) for event, _, value in events if event == "result"] == [("result", 200)]
+  assert len(request_times) == 2
+  # Half of the delay is jitter, the other half is always waited
+  assert request_times[1] - request_times[0] >= 0.25
@@ -0,0 +1,82 @@
+import pytest
+from navigation import AdaptiveTimeouts, NavigationTimeout, READY_SCRIPT, READY_SELECTORS, start_navigation, wait_until_ready
+from mal_comment_scraper import load_review_page, ReviewPagination
+from retry import classify
+
+class FakeElement:
+  def __init__(self, text):
+    self.text = text
+
+class FakeDriver:
+  """A browser showing one page, ready once ready_after navigations' worth of polls went by"""
+
+  def __init__(self, selectors_present, ready_after=0):
+    self.selectors_present = selectors_present
+    self.ready_after = ready_after
+    self.current_url = "about:blank"
+    self.page_source = "<html></html>"
+
+  def get(self, url):
+    self.current_url = url
+
+  def execute_script(self, script, *args):
+    if (script != READY_SCRIPT):
+      return None
+
+    self.ready_after -= 1
+    token, selectors, captcha_selector = args
+    return self.ready_after < 0 and all(selector in self.selectors_present for selector in selectors)
+
+  def find_elements(self, by, selector):
+    return [FakeElement(selector)] if selector in self.selectors_present else []
+
+  def find_element(self, by, selector):
+    elements = self.find_elements(by, selector)
+
+    if (not elements):
+      raise LookupError(selector)
+
+    return elements[0]
+
+class FakeBrowser:
+  def __init__(self, driver):
+    self.driver = driver
+    self.timeouts = AdaptiveTimeouts(default=0.3)
+
+  def open(self, url, kind):
+    token, started = start_navigation(self.driver, url)
+    wait_until_ready(self.driver, kind, self.timeouts, token, started)
+    return self.driver
+
+def test_ready_time_is_recorded():
+  timeouts = AdaptiveTimeouts(default=1)
+  driver = FakeDriver([".title-name"], ready_after=2)
+  token, started = start_navigation(driver, "https://myanimelist.net/anime/1/A/reviews")
+  wait_until_ready(driver, "reviews", timeouts, token, started)
+
+  assert timeouts.histograms["reviews"].count == 1
+
+def test_timeout_is_not_a_ready_time():
+  timeouts = AdaptiveTimeouts(default=0.2)
+  driver = FakeDriver([])
+  token, started = start_navigation(driver, "https://myanimelist.net/anime/1/A/reviews")
+
+  with pytest.raises(NavigationTimeout) as error:
+    wait_until_ready(driver, "reviews", timeouts, token, started)
+
+  assert classify(error.value) == "network"
+  assert "reviews" not in timeouts.histograms
+
+def test_review_page_without_reviews():
+  assert READY_SELECTORS["reviews"] == [".title-name"]
+  browser = FakeBrowser(FakeDriver([".title-name"]))
+  url = "https://myanimelist.net/anime/1/Nobody_Reviewed_This/reviews"
+
+  for extraction_mode in ("elements", "source"):
+    anime_name, loaded_url, comments, next_page_url = load_review_page(browser, url, extraction_mode)
+    assert (anime_name, loaded_url, comments, next_page_url) == (".title-name", url, [], None)
+
+  pagination = ReviewPagination(url, 4)
+  assert pagination.handle_page(anime_name, loaded_url, comments, next_page_url) == []
+  assert pagination.finished
+  assert browser.timeouts.histograms["reviews"].count == 2
@@ -0,0 +1,71 @@
+import json
+import os
+import pytest
+from checkpoint import Journal
+from comment_reader import iter_records
+from output import RecordWriter
+
+RECORDS = [
+  {"anime_url": "https://myanimelist.net/anime/1", "score": 8.5, "tags": ["Action", "Drama"], "episodes": None},
+  {"anime_url": "https://myanimelist.net/anime/2", "score": 7, "tags": [], "episodes": 12, "title": "Café"},
+]
+
+def write(path, records, output_format):
+  writer = RecordWriter(str(path), output_format)
+  writer.write_all(records)
+  return writer.close()
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl"])
+def test_output_is_valid_after_close(tmp_path, output_format):
+  path = tmp_path / f"out.{output_format}"
+  size_bytes = write(path, RECORDS, output_format)
+
+  assert size_bytes == os.path.getsize(path)
+  assert list(iter_records(str(path))) == RECORDS
+
+def test_json_matches_dumps(tmp_path):
+  write(tmp_path / "out.json", RECORDS, "json")
+  write(tmp_path / "empty.json", [], "json")
+
+  assert (tmp_path / "out.json").read_text(encoding="utf-8") == json.dumps(RECORDS, indent=2)
+  assert json.loads((tmp_path / "empty.json").read_text(encoding="utf-8")) == []
+
+def crash_mid_run(state_folder, path, output_format):
+  # Writes the first record and half of the second, then dies without closing anything
+  journal = Journal(str(state_folder))
+  writer = RecordWriter(str(path), output_format)
+
+  journal.record(RECORDS[0]["anime_url"], RECORDS[0])
+  journal.done(RECORDS[0]["anime_url"])
+  writer.write(RECORDS[0])
+  writer.file.write(json.dumps(RECORDS[1])[:20])
+  writer.file.flush()
+
+@pytest.mark.parametrize("output_format", ["json", "jsonl"])
+def test_resume_after_crash(tmp_path, output_format):
+  state_folder = tmp_path / "state"
+  state_folder.mkdir()
+  path = tmp_path / f"out.{output_format}"
+
+  crash_mid_run(state_folder, path, output_format)
+
+  # The partial file isn't valid
+  with pytest.raises(ValueError):
+    list(iter_records(str(path)))
+
+  # The resumed run writes the kept records again, then carries on from the journal
+  journal = Journal(str(state_folder))
+  writer = RecordWriter(str(path), output_format)
+  writer.write_all(journal.iter_records())
+
+  for record in RECORDS:
+    if (record["anime_url"] not in journal.finished):
+      journal.record(record["anime_url"], record)
+      journal.done(record["anime_url"])
+      writer.write(record)
+
+  writer.close()
+  journal.close()
+
+  assert writer.count == len(RECORDS)
+  assert list(iter_records(str(path))) == RECORDS
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+from page_cache import PageCache
+
+def summed_bytes(cache):
+  return cache._query("SELECT COALESCE(SUM(size), 0) FROM pages")[0][0]
+
+def test_total_bytes_follows_every_change(tmp_path):
+  cache = PageCache(str(tmp_path), 10 ** 9)
+  other_process = PageCache(str(tmp_path), 10 ** 9)
+
+  try:
+    for i in range(10):
+      cache.put(f"https://myanimelist.net/anime/{i}", os.urandom(2000))
+
+    cache.put("https://myanimelist.net/anime/1", os.urandom(5000))
+    other_process.put("https://myanimelist.net/anime/100", os.urandom(3000))
+    cache.invalidate("https://myanimelist.net/anime/2")
+
+    assert cache.total_bytes() == other_process.total_bytes() == summed_bytes(cache)
+  finally:
+    cache.close()
+    other_process.close()
+
+def test_eviction_uses_the_total(tmp_path):
+  cache = PageCache(str(tmp_path), 10 ** 9)
+
+  try:
+    for i in range(10):
+      cache.put(f"https://myanimelist.net/anime/{i}", os.urandom(2000))
+
+    cache.max_bytes = summed_bytes(cache)
+    cache.put("https://myanimelist.net/anime/10", os.urandom(2000))
+
+    assert cache.stats["evictions"] > 0
+    assert cache.total_bytes() == summed_bytes(cache) <= cache.max_bytes * 0.9
+    assert cache.get("https://myanimelist.net/anime/0") is None
+    assert cache.get("https://myanimelist.net/anime/10") is not None
+  finally:
+    cache.close()
+
+def test_total_of_a_cache_from_before_it(tmp_path):
+  cache = PageCache(str(tmp_path), 10 ** 9)
+
+  for i in range(5):
+    cache.put(f"https://myanimelist.net/anime/{i}", os.urandom(2000))
+
+  cache.close()
+  db = sqlite3.connect(tmp_path / "index.sqlite")
+
+  for trigger in ("pages_size_insert", "pages_size_update", "pages_size_delete"):
+    db.execute(f"DROP TRIGGER {trigger}")
+
+  db.execute("DROP TABLE meta")
+  db.commit()
+  db.close()
+
+  cache = PageCache(str(tmp_path), 10 ** 9)
+
+  try:
+    assert cache.total_bytes() == summed_bytes(cache) > 0
+  finally:
+    cache.close()
@@ -0,0 +1,102 @@
+import os
+from time import sleep
+from collections import deque
+from threading import Thread
+import pipeline
+from pipeline import Stage, run_pipeline
+
+class Discovery:
+  """Finds every page at once, like a ranking walk"""
+
+  def process(self, item):
+    for i in range(200):
+      yield f"page-{i}"
+
+  def close(self):
+    pass
+
+class SlowPages:
+  def process(self, item):
+    sleep(0.002)
+    yield item.upper()
+
+  def close(self):
+    pass
+
+class DyingOrSpinning:
+  """Dies on "die", and keeps reporting results on "spin" until flag_path exists"""
+
+  def __init__(self, flag_path):
+    self.flag_path = flag_path
+
+  def process(self, item):
+    if (item == "die"):
+      # Lets the "start" message reach the parent first
+      sleep(0.5)
+      os._exit(3)
+
+    for i in range(400):
+      if (os.path.exists(self.flag_path)):
+        return
+
+      yield i
+      sleep(0.05)
+
+  def close(self):
+    pass
+
+def run(stages, initial_items, route, timeout=60, on_event=None, **kwargs):
+  """The events of run_pipeline, failing the test instead of hanging it"""
+  events = []
+
+  def consume():
+    for event in run_pipeline(stages, initial_items, route, **kwargs):
+      events.append(event)
+
+      if (on_event):
+        on_event(event)
+
+  thread = Thread(target=consume, daemon=True)
+  thread.start()
+  thread.join(timeout)
+  assert not thread.is_alive(), "run_pipeline never finished"
+  return events
+
+def test_pending_items_stay_under_max_backlog(monkeypatch):
+  longest = []
+
+  class TrackedDeque(deque):
+    def append(self, item):
+      super().append(item)
+      longest.append(len(self))
+
+  class TrackedState(pipeline._StageState):
+    def __init__(self, stage):
+      super().__init__(stage)
+      self.pending = TrackedDeque()
+
+  monkeypatch.setattr(pipeline, "_StageState", TrackedState)
+
+  def route(stage_name, item, value):
+    return [("pages", value)] if (stage_name == "discovery") else []
+
+  initial_items = (("discovery", f"ranking-{i}") for i in range(50))
+  events = run([Stage("discovery", Discovery), Stage("pages", SlowPages, 1, 2)], initial_items, route, max_backlog=10)
+
+  assert len([item for stage_name, event, item, value in events if (stage_name, event) == ("discovery", "done")]) == 50
+  assert len([item for stage_name, event, item, value in events if (stage_name, event) == ("pages", "done")]) == 200
+  assert max(longest) <= 10
+
+def test_dead_worker_is_noticed_while_others_report(tmp_path):
+  flag_path = str(tmp_path / "stop")
+
+  def stop_spinning(event):
+    if (event[1] == "error"):
+      open(flag_path, "w").close()
+
+  events = run([Stage("work", lambda: DyingOrSpinning(flag_path), 2)], [("work", "die"), ("work", "spin")], lambda *args: [], on_event=stop_spinning)
+
+  assert ("work", "error", "die", "Worker exited with code 3") in events
+  assert ("work", "done", "spin", None) in events
+  # "spin" stopped because the death was reported, not because it ran out
+  assert len([event for event in events if event[1] == "result"]) < 400
@@ -0,0 +1,77 @@
+import json
+import pickle
+import pytest
+from records import Review, AnimeDetails, RankingEntry, json_default
+
+def review(**fields):
+  return Review(**{
+    "page_url": "https://myanimelist.net/anime/1/Cowboy_Bebop/reviews",
+    "anime": "Cowboy Bebop",
+    "username": "someone",
+    "avatar": "",
+    "timestamp": 1700000000,
+    "feelings": 3,
+    "review_text": "Still the best.",
+    **fields
+  })
+
+def built(*parts):
+  # A string built at runtime, so it starts out as a separate copy
+  return "".join(parts)
+
+def test_missing_fields_are_none():
+  entry = RankingEntry(anime="Cowboy Bebop", rank=1)
+
+  assert entry["anime"] == "Cowboy Bebop" and entry.rank == 1
+  assert entry.anime_url is None
+
+  with pytest.raises(KeyError):
+    entry["not_a_field"]
+
+def test_unknown_fields_are_rejected():
+  with pytest.raises(TypeError, match="'review_txt'"):
+    review(review_txt="typo")
+
+  with pytest.raises(TypeError):
+    RankingEntry(*range(len(RankingEntry.__slots__) + 1))
+
+def test_equality():
+  assert review() == review()
+  assert review() != review(feelings=1)
+  # Same values, different record type or plain dict
+  assert RankingEntry(anime="A") != AnimeDetails(anime="A")
+  assert review() != review().to_dict()
+
+def test_records_are_unhashable():
+  with pytest.raises(TypeError):
+    hash(review())
+
+def test_interning():
+  first = review(anime=built("Cowboy ", "Bebop"), username=built("some", "one"))
+  second = review(anime=built("Cowboy ", "Bebop"), username=built("some", "one"))
+  details = AnimeDetails(genres=[built("Act", "ion")])
+
+  assert first.anime is second.anime
+  assert first.username is second.username
+  assert details.genres[0] is AnimeDetails(genres=[built("Act", "ion")]).genres[0]
+  # Text is never interned
+  assert review(review_text=built("a", "b")).review_text is not review(review_text=built("a", "b")).review_text
+
+def test_pickling():
+  record = review()
+  data = pickle.dumps(record)
+  copy = pickle.loads(data)
+
+  assert copy == record and type(copy) is Review
+  # Pickled as a bare tuple of values, without the field names
+  assert b"review_text" not in data
+  # Re-interned on the receiving side
+  assert copy.anime is record.anime
+
+def test_dict_round_trip():
+  details = AnimeDetails(anime="Cowboy Bebop", score=8.75, genres=["Action", "Sci-Fi"])
+  exported = json.loads(json.dumps(details, default=json_default))
+
+  assert exported == details.to_dict()
+  assert list(exported) == list(AnimeDetails.__slots__)
+  assert AnimeDetails.from_dict(exported) == details
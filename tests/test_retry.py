@@ -0,0 +1,120 @@
+import http.client
+from time import sleep
+from threading import Thread
+import pytest
+from selenium.common.exceptions import InvalidSessionIdException, TimeoutException, WebDriverException
+from mal_parser import CaptchaError, HttpStatusError
+from retry import classify, RetryEngine, RetryPolicy, RetryExhausted, CircuitBreaker, read_dead_letters, MAX_TOTAL_ATTEMPTS
+
+URL = "https://myanimelist.net/anime/1"
+
+@pytest.mark.parametrize("error, kind", [
+  (CaptchaError("captcha"), "rate_limit"),
+  (HttpStatusError(429, URL), "rate_limit"),
+  (HttpStatusError(403, URL), "rate_limit"),
+  (HttpStatusError(404, URL), "missing"),
+  (HttpStatusError(410, URL), "missing"),
+  (HttpStatusError(503, URL), "network"),
+  (HttpStatusError(400, URL), "parse"),
+  (InvalidSessionIdException("gone"), "driver"),
+  (WebDriverException("Tried to run command without establishing a connection"), "driver"),
+  (WebDriverException("element not interactable"), "parse"),
+  (TimeoutException("page load"), "network"),
+  (ConnectionResetError(), "network"),
+  (http.client.RemoteDisconnected(), "network"),
+  (KeyError("score"), "parse"),
+])
+def test_classify(error, kind):
+  assert classify(error) == kind
+
+def test_delays_double_up_to_the_max():
+  policy = RetryPolicy(5, 1, 4)
+
+  for attempt, delay in [(1, 1), (2, 2), (3, 4), (4, 4)]:
+    assert delay / 2 <= policy.delay(attempt) <= delay
+
+def test_retries_run_out_into_the_dead_letters(tmp_path):
+  path = tmp_path / "dead_letters.jsonl"
+  engine = RetryEngine(policies={"parse": RetryPolicy(2, 0.01, 0.01)}, dead_letter_path=str(path))
+
+  attempts = engine.begin("anime-1", URL)
+  assert attempts.failed(KeyError("score")) <= 0.01
+
+  with pytest.raises(RetryExhausted) as exhausted:
+    attempts.failed(KeyError("score"))
+
+  assert exhausted.value.kind == "parse"
+
+  # Missing pages aren't retried at all
+  with pytest.raises(RetryExhausted):
+    engine.begin("anime-2").failed(HttpStatusError(404, "anime-2"))
+
+  engine.close()
+
+  assert read_dead_letters(str(path)) == ["anime-1", "anime-2"]
+  assert read_dead_letters(str(path), ["missing"]) == ["anime-2"]
+
+def test_attempts_across_kinds_are_capped():
+  policy = RetryPolicy(100, 0, 0)
+  engine = RetryEngine(policies={"network": policy, "parse": policy})
+  attempts = engine.begin("anime-1")
+
+  with pytest.raises(RetryExhausted):
+    for i in range(MAX_TOTAL_ATTEMPTS):
+      attempts.failed(ConnectionResetError() if i % 2 else KeyError("score"))
+
+  assert sum(attempts.attempts.values()) == MAX_TOTAL_ATTEMPTS
+
+def test_breaker_opens_on_the_error_rate():
+  breaker = CircuitBreaker(min_requests=4, error_rate=0.5, cooldown=60)
+
+  assert not breaker.record(True)
+  assert not breaker.record(False)
+  assert not breaker.record(True)
+  # 2 of 4 loads failed
+  assert breaker.record(False)
+  assert breaker.remaining() > 59
+
+def test_breaker_needs_min_requests():
+  breaker = CircuitBreaker(min_requests=4, error_rate=0.5, cooldown=60)
+
+  assert not any(breaker.record(False) for _ in range(3))
+  assert breaker.remaining() == 0
+
+def test_half_open_breaker_lets_one_probe_through():
+  breaker = CircuitBreaker(min_requests=2, error_rate=0.5, cooldown=0.2)
+  breaker.record(False)
+  assert breaker.record(False)
+
+  # The probe fails: open again right away, without min_requests loads
+  breaker.wait()
+  assert breaker.is_half_open()
+  assert breaker.record(False)
+  assert breaker.remaining() > 0.1 and not breaker.is_half_open()
+
+  breaker.wait()
+  probe_claimed = []
+  other_worker = Thread(target=lambda: (breaker.wait(), probe_claimed.append(True)), daemon=True)
+  other_worker.start()
+  sleep(0.3)
+
+  # Held back while the first worker probes
+  assert not probe_claimed and breaker.remaining() > 0
+
+  # The probe succeeds and closes the breaker
+  assert not breaker.record(True)
+  other_worker.join(5)
+
+  assert probe_claimed == [True]
+  assert breaker.remaining() == 0 and not breaker.is_half_open()
+  assert not breaker.record(False)
+
+def test_probe_times_out():
+  breaker = CircuitBreaker(min_requests=1, error_rate=0.5, cooldown=0.1, probe_timeout=0.2)
+  assert breaker.record(False)
+
+  breaker.wait()
+  # The probing worker never reports back, another one probes once the timeout is over
+  breaker.wait()
+
+  assert breaker.is_half_open()
@@ -0,0 +1,81 @@
+import pytest
+import seen_set
+from seen_set import SeenSet, DAY
+from mal_user_scraper import UserProfileWorker, ProfileNotFound
+
+PROFILE = {"status": {"gender": "Female", "reviews": "3"}, "anime_stats": {"days": "12.5", "completed": "40"}, "avatar": ""}
+
+class Clock:
+  def __init__(self):
+    self.now = 1_700_000_000.0
+
+  def __call__(self):
+    return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+  clock = Clock()
+  monkeypatch.setattr(seen_set, "time", clock)
+  return clock
+
+def test_keys_are_fresh_within_the_ttl(tmp_path, clock):
+  seen = SeenSet(str(tmp_path / "seen.sqlite"), ttl=DAY)
+
+  try:
+    seen.add("someone")
+    clock.now += DAY - 1
+
+    assert seen.is_fresh("someone")
+    assert not seen.is_fresh("someone else")
+    assert seen.fresh(["someone", "someone else"]) == {"someone"}
+
+    clock.now += 2
+
+    assert not seen.is_fresh("someone")
+    assert seen.fresh(["someone"]) == set()
+  finally:
+    seen.close()
+
+def test_fresh_queries_in_chunks(tmp_path, clock):
+  seen = SeenSet(str(tmp_path / "seen.sqlite"))
+  usernames = [f"user{i}" for i in range(seen_set.QUERY_CHUNK_SIZE * 2 + 1)]
+
+  try:
+    for username in usernames[::2]:
+      seen.add(username)
+
+    assert seen.fresh(usernames) == set(usernames[::2])
+  finally:
+    seen.close()
+
+def test_worker_skips_fresh_usernames(tmp_path, clock):
+  requested = []
+
+  def scrape_profile(username):
+    requested.append(username)
+
+    if (username == "deleted"):
+      raise ProfileNotFound(f"No profile for \"{username}\"")
+
+    return PROFILE
+
+  worker = UserProfileWorker(False, seen_set_path=str(tmp_path / "seen.sqlite"), ttl=DAY)
+  worker.scrape_profile = scrape_profile
+
+  try:
+    records = list(worker.process("someone"))
+    assert [record["username"] for record in records] == ["someone"]
+    assert list(worker.process("deleted")) == []
+
+    # Seen within the TTL, including the missing profile: no request at all
+    clock.now += DAY / 2
+    assert list(worker.process("someone")) == []
+    assert list(worker.process("deleted")) == []
+    assert requested == ["someone", "deleted"]
+
+    # Scraped again once the TTL is over
+    clock.now += DAY
+    assert len(list(worker.process("someone"))) == 1
+    assert requested == ["someone", "deleted", "someone"]
+  finally:
+    worker.close()
@@ -0,0 +1,45 @@
+import pytest
+from storage import Database, anime_id
+
+URL = "https://myanimelist.net/anime/5114/Fullmetal_Alchemist__Brotherhood"
+
+@pytest.fixture
+def database(tmp_path):
+  database = Database(str(tmp_path / "mal.sqlite"), batch_size=2)
+  yield database
+  database.close()
+
+def test_anime_id():
+  assert anime_id(URL) == 5114
+  assert anime_id("https://myanimelist.net/anime/5114/x/reviews?p=2") == 5114
+
+  with pytest.raises(ValueError):
+    anime_id("https://myanimelist.net/profile/someone")
+
+def test_upserting_anime_twice_keeps_the_newer_values(database):
+  database.write("anime", {"anime_url": URL, "score": 9.1, "members": 100})
+  database.write("anime", {"anime_url": URL + "/", "score": 9.0, "members": 200})
+  database.commit()
+
+  assert database.count("anime") == 1
+  assert list(database.iter_records("anime")) == [{"anime_url": URL + "/", "score": 9.0, "members": 200}]
+
+def test_reviews_are_only_replaced_by_newer_edits(database):
+  review = {"page_url": f"{URL}/reviews", "username": "someone", "timestamp": 100, "text": "first"}
+
+  database.write("reviews", review)
+  database.write("reviews", {**review, "timestamp": 200, "text": "edited"})
+  database.write("reviews", {**review, "timestamp": 150, "text": "older copy"})
+  database.write("reviews", {**review, "username": "someone else"})
+  database.commit()
+
+  assert database.count("reviews") == 2
+  assert [record["text"] for record in database.iter_records("reviews")] == ["edited", "first"]
+
+def test_users_are_merged(database):
+  database.write("users", {"username": "someone", "location": "Tokyo", "favorites": [1]})
+  database.write("users", {"username": "someone", "favorites": [2]})
+  database.commit()
+
+  assert database.count("users") == 1
+  assert list(database.iter_records("users")) == [{"username": "someone", "location": "Tokyo", "favorites": [2]}]
@@ -0,0 +1,97 @@
+import os
+from time import sleep
+from threading import Thread
+from work_queue import run_work_queue
+
+class DyingWorker:
+  """Takes lookahead items ahead, and kills its process on the "die" item"""
+
+  def __init__(self, lookahead=1):
+    self.lookahead = lookahead
+
+  def prefetch(self, item):
+    pass
+
+  def process(self, item):
+    if (item == "die"):
+      # Lets the "start" and "ahead" messages reach the parent first
+      sleep(0.5)
+      os._exit(3)
+
+    yield item.upper()
+
+  def close(self):
+    pass
+
+class PlainWorker(DyingWorker):
+  def __init__(self):
+    super().__init__(0)
+
+class SpinningWorker(PlainWorker):
+  """Dies on "die", and keeps reporting results on "spin" until flag_path exists"""
+
+  def __init__(self, flag_path):
+    super().__init__()
+    self.flag_path = flag_path
+
+  def process(self, item):
+    if (item == "die"):
+      yield from super().process(item)
+
+    for i in range(400):
+      if (os.path.exists(self.flag_path)):
+        return
+
+      yield i
+      sleep(0.05)
+
+def run(items, worker_factory, worker_count, timeout=60, on_event=None):
+  """The events of run_work_queue, failing the test instead of hanging it"""
+  events = []
+
+  def consume():
+    for event in run_work_queue(items, worker_factory, worker_count):
+      events.append(event)
+
+      if (on_event):
+        on_event(event)
+
+  thread = Thread(target=consume, daemon=True)
+  thread.start()
+  thread.join(timeout)
+  assert not thread.is_alive(), "run_work_queue never finished"
+  return events
+
+def test_results():
+  events = run(["a", "b", "c"], PlainWorker, 2)
+  assert sorted(value for event, item, value in events if event == "result") == ["A", "B", "C"]
+  assert sorted(item for event, item, value in events if event == "done") == ["a", "b", "c"]
+
+def test_worker_dying_after_looking_ahead_to_the_end():
+  # The worker took its None while looking ahead from "a", then dies on the last item
+  events = run(["a", "die"], DyingWorker, 1)
+
+  assert ("done", "a", None) in events
+  assert ("error", "die", "Worker exited with code 3") in events
+  assert len([event for event, item, value in events if event in ("done", "error")]) == 2
+
+def test_items_taken_ahead_fail_with_their_worker():
+  events = run(["die", "b", "c", "d"], lambda: DyingWorker(2), 1)
+  errors = [item for event, item, value in events if event == "error" and value == "Worker exited with code 3"]
+
+  assert errors == ["die", "b", "c"]
+  assert ("done", "d", None) in events
+
+def test_dead_worker_is_noticed_while_others_report(tmp_path):
+  flag_path = str(tmp_path / "stop")
+
+  def stop_spinning(event):
+    if (event[0] == "error"):
+      open(flag_path, "w").close()
+
+  events = run(["die", "spin"], lambda: SpinningWorker(flag_path), 2, on_event=stop_spinning)
+
+  assert ("error", "die", "Worker exited with code 3") in events
+  assert ("done", "spin", None) in events
+  # "spin" stopped because the death was reported, not because it ran out
+  assert len([event for event in events if event[0] == "result"]) < 400